@@ -2,16 +2,32 @@
 # This file contains the logic for generating outfit recommendations using the Gemini API.
 
 import os
-import time
+import asyncio
+import random
+import re
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from agents.user_preference_agent import adjust_outfit_with_preferences  # integrate user preferences
+import gemini_client
+import llm_cache
+from singleflight import SingleFlight, AsyncSingleFlight, make_key
+from metrics import timed, OUTFIT_SPECULATIONS, STAGE_SECONDS, STAGE_ERRORS
+from agents.user_preference_agent import adjust_outfit_with_preferences, adjust_outfit_with_preferences_async  # integrate user preferences
 
 # Load environment variables
 load_dotenv()
-GOOGLE_API_KEY = os.environ.get("GEMINI_API_KEY") 
 TREND_ANALYZER_URL = os.environ.get("TREND_ANALYZER_URL", "http://localhost:5000/analyze_trends")
 
+# Speculative mode: for this fraction of closet requests the general prompt is sent at the
+# same time as the closet prompt, so a closet fallback doesn't wait for a second call.
+# 0 disables it; 1 speculates on every closet request (up to twice the Gemini tokens).
+OUTFIT_SPECULATION_BUDGET = min(1.0, max(0.0, float(os.environ.get("OUTFIT_SPECULATION_BUDGET", 0))))
+OUTFIT_SPECULATION_WORKERS = int(os.environ.get("OUTFIT_SPECULATION_WORKERS", 8))
+
+gemini_flight = SingleFlight(name="outfit_gemini")
+gemini_async_flight = AsyncSingleFlight(name="outfit_gemini_async")
+_speculation_pool = ThreadPoolExecutor(max_workers=OUTFIT_SPECULATION_WORKERS, thread_name_prefix="outfit-speculation")
+
 
 def analyze_fashion_trends(query="current fashion trends"):
     """Calls the trend analyzer API to get current fashion trends"""
@@ -27,32 +43,255 @@ def analyze_fashion_trends(query="current fashion trends"):
         return None
 
 
-def call_gemini_api(prompt, model_name="gemma-3-4b-it"):
-    """Calls the Gemini API with exponential backoff for error handling."""
-    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent"
-    retries = 0
-    max_retries = 5
-    base_delay = 1.0
+def call_gemini_api(prompt, model_name="gemma-3-4b-it", cache_site="outfit_general", bypass_cache=False, deadline=None):
+    """Calls the Gemini API; responses are cached on disk per call site (see llm_cache.py)
+    and identical prompts already in flight share a single call. `deadline` (see
+    gemini_client.new_deadline) bounds the call and its retries; pass the request's own
+    so a closet attempt and its fallback share it."""
+    return gemini_flight.do(
+        make_key(model_name, prompt, bypass_cache), _call_gemini_api_with_retries,
+        prompt, model_name, cache_site, bypass_cache, deadline
+    )
 
-    while retries < max_retries:
-        try:
-            headers = {"Content-Type": "application/json"}
-            payload = {"contents": [{"parts": [{"text": prompt}]}]}
-            response = requests.post(api_url, headers=headers, params={"key": GOOGLE_API_KEY}, json=payload)
-            response.raise_for_status()
-            data = response.json()
-            if data and "candidates" in data and len(data["candidates"]) > 0:
-                return data["candidates"][0]["content"]["parts"][0]["text"]
-            return "No recommendation found."
-        except requests.exceptions.RequestException as e:
-            print(f"API call failed: {e}")
-            retries += 1
-            delay = base_delay * (2 ** retries)
-            print(f"Retrying in {delay:.2f} seconds...")
-            time.sleep(delay)
+
+def _call_gemini_api_with_retries(prompt, model_name, cache_site, bypass_cache, deadline):
+    """Calls the Gemini API, retrying transient errors within the deadline."""
+    def call():
+        return gemini_client.extract_text(gemini_client.generate_content_with_retries(prompt, model_name, deadline=deadline))
+
+    try:
+        return llm_cache.cached_text(cache_site, model_name, prompt, call, bypass=bypass_cache) or "No recommendation found."
+    except requests.exceptions.RequestException as e:
+        print(f"API call failed: {e}")
+    return "Failed to get a recommendation after several retries."
+
+
+async def call_gemini_api_async(prompt, model_name="gemma-3-4b-it", cache_site="outfit_general", bypass_cache=False,
+                                deadline=None):
+    """Async call_gemini_api()."""
+    return await gemini_async_flight.do(
+        make_key(model_name, prompt, bypass_cache), _acall_gemini_api_with_retries,
+        prompt, model_name, cache_site, bypass_cache, deadline
+    )
+
+
+async def _acall_gemini_api_with_retries(prompt, model_name, cache_site, bypass_cache, deadline):
+    async def call():
+        return gemini_client.extract_text(
+            await gemini_client.agenerate_content_with_retries(prompt, model_name, deadline=deadline)
+        )
+
+    try:
+        return await llm_cache.acached_text(cache_site, model_name, prompt, call, bypass=bypass_cache) or "No recommendation found."
+    except requests.exceptions.RequestException as e:
+        print(f"API call failed: {e}")
     return "Failed to get a recommendation after several retries."
 
 
+def stream_gemini_api(prompt, model_name="gemma-3-4b-it", cache_site="outfit_general", deadline=None, bypass_cache=False):
+    """Yields the response text chunk by chunk as Gemini produces it (server-sent events).
+    A cached response is sent as a single chunk; a complete stream is cached."""
+    key = llm_cache.response_key(model_name, prompt)
+    cached = llm_cache.lookup(cache_site, key, bypass_cache)
+    if cached is not None:
+        yield cached
+        return
+
+    streamed_any = False
+    chunks = []
+    try:
+        for chunk in gemini_client.stream_generate_content(prompt, model_name):
+            streamed_any = True
+            chunks.append(chunk)
+            yield chunk
+        if chunks:
+            llm_cache.store(cache_site, key, "".join(chunks), bypass_cache)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        if streamed_any:
+            print(f"Streaming API call broke off midway: {e}")
+            return
+        # Nothing was sent yet, so fall back to the regular call with retries.
+        print(f"Streaming API call failed, falling back to a regular call: {e}")
+        yield call_gemini_api(prompt, model_name, cache_site, bypass_cache, deadline)
+
+
+CLOSET_FALLBACK_MARKER = "No suitable combination found in the closet"
+FALLBACK_INTRO = (
+    "I couldn't find a complete outfit for this occasion and style from your current closet items. "
+    "Here is a general outfit idea based on your preferences:\n\n"
+)
+
+
+def _gender_terms(gender):
+    if gender == 'man':
+        return "male", "Do not recommend clothing typically worn by a woman."
+    if gender == 'woman':
+        return "female", "Do not recommend clothing typically worn by a man."
+    return "person's", "Recommend a gender-neutral or appropriate outfit for a general person."
+
+
+def build_closet_prompt(user_closet, occasion, style, gender, disliked_outfit=None, trends=None):
+    gender_term, gender_constraint = _gender_terms(gender)
+    gemini_prompt_closet = (
+        f"You are a professional stylist. Recommend a stylish {gender_term} outfit strictly from this closet: "
+        f"{', '.join(user_closet)}. "
+        f"Occasion: '{occasion}', Style: '{style}'. {gender_constraint} "
+        "Only use items explicitly listed in the closet. If no combination fits the occasion, clearly state 'No suitable combination found in the closet.' as the ONLY response text."
+    )
+    if trends:
+        gemini_prompt_closet += f" Consider these current fashion trends: {', '.join(trends)}."
+
+    common_prompt_suffix = " Recommend a single complete outfit."
+    if disliked_outfit:
+        common_prompt_suffix += (
+            f" The previous recommendation, '{disliked_outfit}', was not liked. "
+            f"Provide a new recommendation that does not include items from the disliked outfit."
+        )
+    common_prompt_suffix += " Explain why this outfit is recommended concisely."
+
+    return gemini_prompt_closet + common_prompt_suffix
+
+
+def build_general_prompt(occasion, style, gender, disliked_outfit=None, trends=None):
+    gender_term, gender_constraint = _gender_terms(gender)
+    gemini_prompt = (
+        f"You are a professional stylist. Recommend a stylish {gender_term} outfit. "
+        f"For a '{occasion}' occasion and a '{style}' style. {gender_constraint}"
+    )
+    if trends:
+        gemini_prompt += f" Consider these current fashion trends: {', '.join(trends)}."
+
+    gemini_prompt += " Please recommend a single, complete, and stylish outfit including one top and one bottom."
+
+    if disliked_outfit:
+        gemini_prompt += (
+            f" The previous recommendation, '{disliked_outfit}', was not liked. "
+            f"Provide a new recommendation that does not include items from the disliked outfit."
+        )
+
+    return gemini_prompt + " Explain why this outfit is recommended concisely."
+
+
+def build_alternatives_prompt(closet, occasion, style, trends=None, insights="", base_outfit=""):
+    """Prompt for three alternatives to an outfit (shared with recommendationAgent's /recommend-outfits)."""
+    return f"""
+    You are a fashion recommendation agent.
+    The user closet: {', '.join(closet or [])}
+    Occasion: {occasion}
+    Style preference: {style}
+    Trends to consider: {', '.join(trends or [])}
+    Trend insights: {insights}
+    Already suggested outfit: {base_outfit}
+
+    Task:
+    Suggest 3 *different* alternative outfits (use closet items where possible).
+    Each outfit should be short, clear, and stylish. 
+    Format:
+    - Outfit 1: ...
+    - Outfit 2: ...
+    - Outfit 3: ...
+    """
+
+
+ALTERNATIVE_LINE_RE = re.compile(r"^[\s\-*#]*outfit\s*\d+\s*\**\s*:\s*(.*)$", re.IGNORECASE)
+
+
+def parse_alternatives(text):
+    """Splits the '- Outfit N: ...' lines of an alternatives answer into a list."""
+    alternatives = []
+    for line in (text or "").splitlines():
+        # Also handles markdown such as "- **Outfit 1:** ..."
+        match = ALTERNATIVE_LINE_RE.match(line)
+        if match and match.group(1).strip(" *"):
+            alternatives.append(match.group(1).strip(" *"))
+    return alternatives
+
+
+def generate_alternatives(closet, occasion, style, base_outfit, trends=None, insights=""):
+    """Three alternatives to `base_outfit`, as a list of outfit descriptions."""
+    text = call_gemini_api(
+        build_alternatives_prompt(closet, occasion, style, trends, insights, base_outfit), cache_site="recommend_outfits"
+    )
+    return parse_alternatives(text)
+
+
+def is_closet_fallback(recommendation_text):
+    return CLOSET_FALLBACK_MARKER in recommendation_text or "No recommendation found" in recommendation_text
+
+
+def start_speculative_general(occasion, style, gender, disliked_outfit=None, trends=None, deadline=None,
+                              regenerate=False):
+    """Sends the general prompt in the background when the speculation budget allows it;
+    returns the future, or None when this request doesn't speculate."""
+    if not _wants_speculation():
+        return None
+    OUTFIT_SPECULATIONS.inc(outcome="launched")
+    return _speculation_pool.submit(
+        call_gemini_api, build_general_prompt(occasion, style, gender, disliked_outfit, trends),
+        bypass_cache=regenerate, deadline=deadline
+    )
+
+
+def settle_speculation(future, needed):
+    """Returns the speculative general text if it is needed and succeeded, otherwise None
+    (and cancels it if it hasn't started yet)."""
+    if future is None:
+        return None
+    if not needed:
+        OUTFIT_SPECULATIONS.inc(outcome="cancelled" if future.cancel() else "wasted")
+        return None
+    try:
+        text = future.result()
+    except Exception as e:
+        print(f"Speculative general outfit call failed: {e}")
+        return None
+    OUTFIT_SPECULATIONS.inc(outcome="used")
+    return text
+
+
+async def settle_speculation_async(task, needed):
+    """Async settle_speculation() for a speculative asyncio task."""
+    if task is None:
+        return None
+    if not needed:
+        # Unlike a pool future, a task that already started can still be cancelled
+        OUTFIT_SPECULATIONS.inc(outcome="cancelled" if task.cancel() else "wasted")
+        return None
+    try:
+        text = await task
+    except Exception as e:
+        print(f"Speculative general outfit call failed: {e}")
+        return None
+    OUTFIT_SPECULATIONS.inc(outcome="used")
+    return text
+
+
+def _wants_speculation():
+    return OUTFIT_SPECULATION_BUDGET > 0 and random.random() < OUTFIT_SPECULATION_BUDGET
+
+
+def apply_preferences(recommendation_text, preferences, recommendation_type, user_closet):
+    context = {"type": recommendation_type, "closet": user_closet if recommendation_type == 'closet' else []}
+    adjusted = adjust_outfit_with_preferences(recommendation_text, preferences, context)
+    return format_adjusted(adjusted)
+
+
+async def apply_preferences_async(recommendation_text, preferences, recommendation_type, user_closet):
+    context = {"type": recommendation_type, "closet": user_closet if recommendation_type == 'closet' else []}
+    return format_adjusted(await adjust_outfit_with_preferences_async(recommendation_text, preferences, context))
+
+
+def format_adjusted(adjusted):
+    final_outfit = adjusted["outfit"]
+    reasons = adjusted["reasons"]
+
+    final_output = f"{final_outfit}\n\n(This recommendation considers your saved preferences.)"
+    if reasons:
+        final_output += "\n\nPreference-based reasoning:\n" + "\n".join(reasons)
+    return final_output
+
+
+@timed(STAGE_SECONDS, STAGE_ERRORS, stage="generate_outfit_recommendation")
 def generate_outfit_recommendation(
     user_closet,
     occasion,
@@ -61,93 +300,187 @@ def generate_outfit_recommendation(
     disliked_outfit=None,
     recommendation_type="closet",
     trends=None,
-    preferences=None
+    preferences=None,
+    regenerate=False
 ):
-    """Generates an outfit recommendation based on the provided parameters."""
+    """Generates an outfit recommendation based on the provided parameters.
 
-    # --- Gender handling ---
-    if gender == 'man':
-        gender_term = "male"
-        gender_constraint = "Do not recommend clothing typically worn by a woman."
-    elif gender == 'woman':
-        gender_term = "female"
-        gender_constraint = "Do not recommend clothing typically worn by a man."
-    else:
-        gender_term = "person's"
-        gender_constraint = "Recommend a gender-neutral or appropriate outfit for a general person."
+    regenerate=True asks Gemini again instead of answering from the response cache,
+    for a user who wants a different outfit for the same request."""
 
     # Flag to track if we fell back to a general recommendation
     is_fallback = False
+    # One Gemini budget for the closet attempt and the fallback together
+    deadline = gemini_client.new_deadline()
 
     # --- Build Gemini prompt (Initial Attempt: Closet) ---
     if recommendation_type == 'closet':
         if not user_closet:
             return "Your closet is empty. Please add some items first or switch to 'General outfit idea'!"
 
-        gemini_prompt_closet = (
-            f"You are a professional stylist. Recommend a stylish {gender_term} outfit strictly from this closet: "
-            f"{', '.join(user_closet)}. "
-            f"Occasion: '{occasion}', Style: '{style}'. {gender_constraint} "
-            "Only use items explicitly listed in the closet. If no combination fits the occasion, clearly state 'No suitable combination found in the closet.' as the ONLY response text."
-        )
-        if trends:
-            gemini_prompt_closet += f" Consider these current fashion trends: {', '.join(trends)}."
-
-        common_prompt_suffix = " Recommend a single complete outfit."
-        if disliked_outfit:
-            common_prompt_suffix += (
-                f" The previous recommendation, '{disliked_outfit}', was not liked. "
-                f"Provide a new recommendation that does not include items from the disliked outfit."
+        speculative = start_speculative_general(occasion, style, gender, disliked_outfit, trends, deadline, regenerate)
+        try:
+            recommendation_text = call_gemini_api(
+                build_closet_prompt(user_closet, occasion, style, gender, disliked_outfit, trends), cache_site="outfit_closet",
+                bypass_cache=regenerate, deadline=deadline
             )
-        common_prompt_suffix += " Explain why this outfit is recommended concisely."
+        except Exception:
+            settle_speculation(speculative, needed=False)
+            raise
 
-        gemini_prompt_closet += common_prompt_suffix
-
-        recommendation_text = call_gemini_api(gemini_prompt_closet)
-
-        if "No suitable combination found in the closet" in recommendation_text or "No recommendation found" in recommendation_text:
+        if is_closet_fallback(recommendation_text):
             is_fallback = True
             recommendation_type = 'general'
-        else:
-            pass
+        general_text = settle_speculation(speculative, needed=is_fallback)
 
     # --- Build Gemini prompt (General Outfit Idea / Fallback) ---
     if recommendation_type == 'general' or is_fallback:
-        gemini_prompt = (
-            f"You are a professional stylist. Recommend a stylish {gender_term} outfit. "
-            f"For a '{occasion}' occasion and a '{style}' style. {gender_constraint}"
-        )
-        if trends:
-            gemini_prompt += f" Consider these current fashion trends: {', '.join(trends)}."
+        if is_fallback and general_text is not None:
+            recommendation_text = general_text
+        else:
+            recommendation_text = call_gemini_api(
+                build_general_prompt(occasion, style, gender, disliked_outfit, trends), bypass_cache=regenerate, deadline=deadline
+            )
 
-        gemini_prompt += " Please recommend a single, complete, and stylish outfit including one top and one bottom."
+        if is_fallback:
+            recommendation_text = FALLBACK_INTRO + recommendation_text
 
-        if disliked_outfit:
-            gemini_prompt += (
-                f" The previous recommendation, '{disliked_outfit}', was not liked. "
-                f"Provide a new recommendation that does not include items from the disliked outfit."
-            )
+    # --- Adjust with preferences ---
+    if preferences:
+        return apply_preferences(recommendation_text, preferences, recommendation_type, user_closet)
 
-        gemini_prompt += " Explain why this outfit is recommended concisely."
+    return recommendation_text or "Could not generate a text recommendation. Please try again."
 
-        recommendation_text = call_gemini_api(gemini_prompt)
 
-        if is_fallback:
-            recommendation_text = (
-                "I couldn't find a complete outfit for this occasion and style from your current closet items. "
-                "Here is a general outfit idea based on your preferences:\n\n" + recommendation_text
+@timed(STAGE_SECONDS, STAGE_ERRORS, stage="generate_outfit_recommendation")
+async def generate_outfit_recommendation_async(
+    user_closet,
+    occasion,
+    style,
+    gender,
+    disliked_outfit=None,
+    recommendation_type="closet",
+    trends=None,
+    preferences=None,
+    regenerate=False
+):
+    """Async generate_outfit_recommendation(); same prompts, fallback and speculation."""
+    is_fallback = False
+    speculative = None
+    deadline = gemini_client.new_deadline()
+    general_prompt = build_general_prompt(occasion, style, gender, disliked_outfit, trends)
+
+    if recommendation_type == 'closet':
+        if not user_closet:
+            return "Your closet is empty. Please add some items first or switch to 'General outfit idea'!"
+
+        if _wants_speculation():
+            OUTFIT_SPECULATIONS.inc(outcome="launched")
+            speculative = asyncio.ensure_future(call_gemini_api_async(general_prompt, bypass_cache=regenerate, deadline=deadline))
+        try:
+            recommendation_text = await call_gemini_api_async(
+                build_closet_prompt(user_closet, occasion, style, gender, disliked_outfit, trends), cache_site="outfit_closet",
+                bypass_cache=regenerate, deadline=deadline
             )
+        except BaseException:
+            if speculative is not None:
+                OUTFIT_SPECULATIONS.inc(outcome="cancelled" if speculative.cancel() else "wasted")
+            raise
 
-    # --- Adjust with preferences ---
-    if preferences:
-        context = {"type": recommendation_type, "closet": user_closet if recommendation_type == 'closet' else []}
-        adjusted = adjust_outfit_with_preferences(recommendation_text, preferences, context)
-        final_outfit = adjusted["outfit"]
-        reasons = adjusted["reasons"]
+        if is_closet_fallback(recommendation_text):
+            is_fallback = True
+            recommendation_type = 'general'
+
+        general_text = await settle_speculation_async(speculative, needed=is_fallback)
 
-        final_output = f"{final_outfit}\n\n(This recommendation considers your saved preferences.)"
-        if reasons:
-            final_output += "\n\nPreference-based reasoning:\n" + "\n".join(reasons)
-        return final_output
+    if recommendation_type == 'general':
+        if is_fallback and general_text is not None:
+            recommendation_text = general_text
+        else:
+            recommendation_text = await call_gemini_api_async(general_prompt, bypass_cache=regenerate, deadline=deadline)
+
+    if is_fallback:
+        recommendation_text = FALLBACK_INTRO + recommendation_text
+
+    if preferences:
+        return await apply_preferences_async(recommendation_text, preferences, recommendation_type, user_closet)
 
     return recommendation_text or "Could not generate a text recommendation. Please try again."
+
+
+def stream_outfit_recommendation(
+    user_closet,
+    occasion,
+    style,
+    gender,
+    disliked_outfit=None,
+    recommendation_type="closet",
+    trends=None,
+    preferences=None,
+    regenerate=False
+):
+    """Streaming counterpart of generate_outfit_recommendation.
+
+    Yields ("token", text) while Gemini is writing, ("reset", None) if already streamed
+    closet text turned out to be a fallback and is replaced by a general outfit, and
+    finally ("outfit", full_text) with the same text generate_outfit_recommendation returns.
+    """
+    is_fallback = False
+    recommendation_text = ""
+    deadline = gemini_client.new_deadline()
+
+    if recommendation_type == 'closet':
+        if not user_closet:
+            yield "outfit", "Your closet is empty. Please add some items first or switch to 'General outfit idea'!"
+            return
+
+        # Hold tokens back while the text could still be the "no combination" marker,
+        # so the user doesn't see it flash up before the general outfit replaces it.
+        speculative = start_speculative_general(occasion, style, gender, disliked_outfit, trends, deadline, regenerate)
+        streaming = False
+        try:
+            for chunk in stream_gemini_api(build_closet_prompt(user_closet, occasion, style, gender, disliked_outfit, trends),
+                                           cache_site="outfit_closet", deadline=deadline, bypass_cache=regenerate):
+                recommendation_text += chunk
+                if streaming:
+                    yield "token", chunk
+                    continue
+                candidate = recommendation_text.lstrip()
+                if candidate.startswith(CLOSET_FALLBACK_MARKER):
+                    break
+                if not CLOSET_FALLBACK_MARKER.startswith(candidate):
+                    streaming = True
+                    yield "token", recommendation_text
+        except BaseException:
+            # Includes the client going away (GeneratorExit)
+            settle_speculation(speculative, needed=False)
+            raise
+
+        if not recommendation_text.strip() or is_closet_fallback(recommendation_text):
+            is_fallback = True
+            recommendation_type = 'general'
+            if streaming:
+                yield "reset", None
+        general_text = settle_speculation(speculative, needed=is_fallback)
+
+    if recommendation_type == 'general' or is_fallback:
+        recommendation_text = ""
+        if is_fallback:
+            yield "token", FALLBACK_INTRO
+        if is_fallback and general_text is not None:
+            # Already generated alongside the closet attempt
+            recommendation_text = general_text
+            yield "token", general_text
+        else:
+            for chunk in stream_gemini_api(build_general_prompt(occasion, style, gender, disliked_outfit, trends),
+                                           deadline=deadline, bypass_cache=regenerate):
+                recommendation_text += chunk
+                yield "token", chunk
+        if is_fallback:
+            recommendation_text = FALLBACK_INTRO + recommendation_text
+
+    if preferences:
+        yield "outfit", apply_preferences(recommendation_text, preferences, recommendation_type, user_closet)
+        return
+
+    yield "outfit", recommendation_text or "Could not generate a text recommendation. Please try again."
@@ -0,0 +1,53 @@
+# agents/llm_registry.py
+# Process-wide registry of shared chat-model clients.
+#
+# Each agent used to construct its own ChatGoogleGenerativeAI at import time, which
+# made importing the backend pull in LangChain and the Google SDK before serving
+# anything. Clients are now created on first use, one per model/temperature, and
+# shared by every agent that asks for the same pair.
+
+import os
+import threading
+
+DEFAULT_MODEL = "gemma-3-4b-it"
+
+_llms = {}
+_lock = threading.Lock()
+
+
+def get_llm(model=DEFAULT_MODEL, temperature=None, cache_site="chat"):
+    """Returns the shared chat model for (model, temperature), creating it on first use.
+
+    `temperature=None` keeps the model's default. Responses go through the persistent
+    LLM cache under `cache_site` (see llm_cache.py); the first caller's site is used
+    for a pair, and today every pair has a single caller.
+    """
+    key = (model, temperature)
+    llm = _llms.get(key)
+    if llm is None:
+        with _lock:
+            llm = _llms.get(key)
+            if llm is None:
+                from langchain_google_genai import ChatGoogleGenerativeAI
+                from llm_cache import response_cache
+
+                params = {} if temperature is None else {"temperature": temperature}
+                llm = ChatGoogleGenerativeAI(
+                    model=model,
+                    google_api_key=os.getenv("GEMINI_API_KEY"),
+                    cache=response_cache(cache_site),
+                    **params
+                )
+                _llms[key] = llm
+    return llm
+
+
+def set_llm(model, temperature, llm):
+    """Installs `llm` for (model, temperature), e.g. a fake model in the benchmarks."""
+    with _lock:
+        _llms[(model, temperature)] = llm
+
+
+def reset_llms():
+    with _lock:
+        _llms.clear()
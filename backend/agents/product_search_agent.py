@@ -1,53 +1,274 @@
 # agents/product_search_agent.py
 import os
 import re
+import asyncio
+import httpx
 import requests  # Added to validate URLs
 from flask import Blueprint, request, jsonify
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import PydanticOutputParser
-from langchain.agents import create_tool_calling_agent, AgentExecutor
-from pydantic import BaseModel
-from tools import tools, SHOPPING_SITES 
+from urllib.parse import quote_plus
+from tools import get_tools, SHOPPING_SITES, search_site_links, run_search
+from agents.registry import register_agent, get_agent, AGENT_VERBOSE
+from agents.llm_registry import DEFAULT_MODEL, get_llm
+from cache import TTLCache
+from closet_index import CATEGORY_KEYWORDS
+from fanout import fan_out, fan_out_async
+from kvstore import KVStore
+from singleflight import SingleFlight, AsyncSingleFlight
+from metrics import GARMENT_SEARCHES
 
 load_dotenv()
 
 # ------------------------------------------------
 # Helper to validate real, reachable product links 
 # ------------------------------------------------
+LINK_CHECK_TIMEOUT = float(os.getenv("LINK_CHECK_TIMEOUT", 5))
+LINK_CHECK_CONCURRENCY = int(os.getenv("LINK_CHECK_CONCURRENCY", 8))
+LINK_VALID_TTL = int(os.getenv("LINK_VALID_TTL", 6 * 3600))
+# Failures are often transient (rate limits, timeouts), so they are re-checked sooner.
+LINK_INVALID_TTL = int(os.getenv("LINK_INVALID_TTL", 15 * 60))
+
+# Validity per URL, shared by every request (the same search links show up for many users)
+link_cache = TTLCache(maxsize=int(os.getenv("LINK_CACHE_SIZE", 4096)), ttl=LINK_VALID_TTL, name="link_validity")
+link_session = requests.Session()
+
+def check_link(url):
+    """HEADs the URL and caches whether it is a reachable HTML page."""
+    try:
+        res = link_session.head(url, allow_redirects=True, timeout=LINK_CHECK_TIMEOUT)
+        valid = res.status_code == 200 and "text/html" in res.headers.get("Content-Type", "")
+    except Exception:
+        valid = False
+    link_cache.set(url, valid, ttl=LINK_VALID_TTL if valid else LINK_INVALID_TTL)
+    return valid
+
 def validate_links(links):
-    valid_links = []
-    for url in links:
+    # Skip unknown sites and duplicates, then check whatever is not cached concurrently
+    candidates = [
+        url for url in dict.fromkeys(links)
+        if any(site in url for site in SHOPPING_SITES)
+    ]
+    results = {url: link_cache.get(url) for url in candidates}
+    unchecked = [url for url, valid in results.items() if valid is None]
+    if unchecked:
+        results.update(fan_out(
+            {url: (lambda url=url: check_link(url)) for url in unchecked},
+            max_workers=LINK_CHECK_CONCURRENCY,
+            timeout=LINK_CHECK_TIMEOUT + 1
+        ))
+    return [url for url in candidates if results.get(url)]
+
+
+# Created on first use, inside the async app's event loop
+async_link_session = None
+
+def get_async_link_session():
+    global async_link_session
+    if async_link_session is None:
+        async_link_session = httpx.AsyncClient(timeout=LINK_CHECK_TIMEOUT, follow_redirects=True)
+    return async_link_session
+
+async def aclose():
+    """Closes the async link-check client (on async app shutdown)."""
+    global async_link_session
+    if async_link_session is not None:
+        await async_link_session.aclose()
+        async_link_session = None
+
+async def check_link_async(url, semaphore):
+    async with semaphore:
         try:
-            if not any(site in url for site in SHOPPING_SITES):
-                continue  # Skip unknown sites
-            res = requests.head(url, allow_redirects=True, timeout=5)
-            if res.status_code == 200 and "text/html" in res.headers.get("Content-Type", ""):
-                valid_links.append(url)
+            res = await get_async_link_session().head(url)
+            valid = res.status_code == 200 and "text/html" in res.headers.get("Content-Type", "")
         except Exception:
+            valid = False
+    link_cache.set(url, valid, ttl=LINK_VALID_TTL if valid else LINK_INVALID_TTL)
+    return valid
+
+async def validate_links_async(links):
+    """Async validate_links(); shares the validity cache with the sync path."""
+    candidates = [
+        url for url in dict.fromkeys(links)
+        if any(site in url for site in SHOPPING_SITES)
+    ]
+    results = {url: link_cache.get(url) for url in candidates}
+    unchecked = [url for url, valid in results.items() if valid is None]
+    if unchecked:
+        semaphore = asyncio.Semaphore(LINK_CHECK_CONCURRENCY)
+        results.update(await fan_out_async(
+            {url: (lambda url=url: check_link_async(url, semaphore)) for url in unchecked},
+            timeout=LINK_CHECK_TIMEOUT + 1
+        ))
+    return [url for url in candidates if results.get(url)]
+
+
+# ------------------------------------------------
+# Per-garment search, cached across all users
+# ------------------------------------------------
+# Outfits keep repeating the same items ("white sneakers", "black slim jeans"), so the
+# outfit text is split into garments and the links are cached per garment. The search
+# load then grows with the number of distinct garments, not with the number of requests.
+GARMENT_CACHE_TTL = int(os.getenv("GARMENT_CACHE_TTL", 24 * 3600))
+# Only a search-page fallback was found (often a transient search failure), so retry sooner
+GARMENT_FALLBACK_TTL = int(os.getenv("GARMENT_FALLBACK_TTL", 15 * 60))
+# Cached garments (one row each); the oldest are evicted every GARMENT_CACHE_TRIM_EVERY writes
+GARMENT_CACHE_MAX_ENTRIES = int(os.getenv("GARMENT_CACHE_MAX_ENTRIES", 20000))
+GARMENT_CACHE_TRIM_EVERY = int(os.getenv("GARMENT_CACHE_TRIM_EVERY", 100))
+GARMENT_SEARCH_TIMEOUT = float(os.getenv("GARMENT_SEARCH_TIMEOUT", 15))
+MAX_GARMENTS = int(os.getenv("MAX_GARMENTS", 6))
+GARMENT_LINKS_PER_ITEM = int(os.getenv("GARMENT_LINKS_PER_ITEM", 2))
+
+GARMENT_WORDS = {word for category, words in CATEGORY_KEYWORDS.items() for word in words
+                 if category != "accessories"} | {
+    "bag", "belt", "scarf", "hat", "beanie", "watch", "necklace", "earrings", "bracelet", "sunglasses", "tote", "clutch",
+    "suit", "cardigan", "kimono", "overalls", "bodysuit", "boots", "stilettos", "tights",
+}
+# Words that end a garment phrase when reading backwards from the garment noun
+PHRASE_STOPWORDS = {
+    "a", "an", "the", "with", "and", "or", "of", "for", "in", "on", "to", "by", "your", "this", "that", "these", "those",
+    "some", "pair", "wear", "try", "add", "plus", "over", "under", "paired", "layered", "topped", "finish", "complete",
+    "it", "its", "is", "are", "as", "like", "into", "at", "from", "style", "styled", "choose", "opt", "go", "via",
+}
+_TOKEN_RE = re.compile(r"[A-Za-z][A-Za-z'\-]*|[^\sA-Za-z]")
+# Markdown section labels in Gemini's answers ("**Top:**", "__Shoes__:")
+_LABEL_RE = re.compile(r"(?:\*\*|__)[^*_\n]{1,40}?(?::\s*(?:\*\*|__)|(?:\*\*|__)\s*:)")
+# Category names that are labels, not something to shop for, when they stand alone ("Shoes: ...")
+CATEGORY_LABELS = {"top", "tops", "shoes", "footwear", "outerwear", "accessories"}
+
+garment_link_cache = KVStore("garment_links")
+_garment_writes = 0
+garment_flight = SingleFlight(name="garment_search")
+garment_async_flight = AsyncSingleFlight(name="garment_search_async")
+
+
+def _is_garment(token):
+    word = token.lower()
+    return word in GARMENT_WORDS or (word.endswith("s") and word[:-1] in GARMENT_WORDS)
+
+def _is_modifier(token):
+    return token[0].isalpha() and token.lower() not in PHRASE_STOPWORDS and not _is_garment(token)
+
+def normalize_garment(garment):
+    return " ".join(re.findall(r"[a-z0-9\-]+", garment.lower()))
+
+def extract_garments(outfit_text, limit=None):
+    """Picks garment phrases ("black slim jeans", "beige trench coat") out of an outfit
+    description: a garment noun plus up to three words describing it. The first
+    phrase per garment noun wins, so later mentions ("the jeans") don't add searches.
+    Section labels ("**Top:**", or a bare "Shoes") are skipped."""
+    limit = limit or MAX_GARMENTS
+    tokens = _TOKEN_RE.findall(_LABEL_RE.sub(" ", outfit_text))
+    garments = {}
+    i = 0
+    while i < len(tokens) and len(garments) < limit:
+        if not _is_garment(tokens[i]):
+            i += 1
             continue
-    return valid_links
+        end = i
+        while end + 1 < len(tokens) and _is_garment(tokens[end + 1]):
+            end += 1
+        start = i
+        while start > 0 and i - start < 3 and _is_modifier(tokens[start - 1]):
+            start -= 1
+        head = tokens[end].lower()
+        garment = normalize_garment(" ".join(tokens[start:end + 1]))
+        if head not in garments and garment not in CATEGORY_LABELS:
+            garments[head] = garment
+        i = end + 1
+    return list(garments.values())
 
+def search_page_link(garment):
+    """A working search link on the first shopping site, for garments without product links."""
+    return f"{SHOPPING_SITES[0].rstrip('/')}/s?k={quote_plus(garment)}"
 
-# Define Product Search Response Schema
-# --- CHANGE START ---
-class ProductSearchResponse(BaseModel):
-    # This field will now hold the complete, descriptive text of the recommended outfit
-    full_outfit_description: str
-    shopping_links: list[str]
-# --- CHANGE END ---
+def _garment_result(garment, valid_links):
+    global _garment_writes
+    links = valid_links[:GARMENT_LINKS_PER_ITEM] or [search_page_link(garment)]
+    garment_link_cache.set(garment, links, ttl=GARMENT_CACHE_TTL if valid_links else GARMENT_FALLBACK_TTL)
+    _garment_writes += 1
+    if _garment_writes % GARMENT_CACHE_TRIM_EVERY == 0:
+        garment_link_cache.trim(GARMENT_CACHE_MAX_ENTRIES)
+    return links
+
+def _search_garment(garment):
+    results = fan_out(
+        {site: (lambda site=site: search_site_links(site, garment)) for site in SHOPPING_SITES},
+        timeout=GARMENT_SEARCH_TIMEOUT
+    )
+    return _garment_result(garment, validate_links([url for site in SHOPPING_SITES for url in results.get(site, [])]))
+
+async def _search_garment_async(garment):
+    results = await fan_out_async(
+        {site: (lambda site=site: run_search(search_site_links, site, garment)) for site in SHOPPING_SITES},
+        timeout=GARMENT_SEARCH_TIMEOUT
+    )
+    links = [url for site in SHOPPING_SITES for url in results.get(site, [])]
+    return _garment_result(garment, await validate_links_async(links))
+
+def garment_links(garment):
+    """Shopping links for one normalized garment, searched at most once per TTL across all users."""
+    links = garment_link_cache.get(garment)
+    if links is not None:
+        GARMENT_SEARCHES.inc(result="hit")
+        return links
+    GARMENT_SEARCHES.inc(result="miss")
+    return garment_flight.do(garment, _search_garment, garment)
 
+async def garment_links_async(garment):
+    links = garment_link_cache.get(garment)
+    if links is not None:
+        GARMENT_SEARCHES.inc(result="hit")
+        return links
+    GARMENT_SEARCHES.inc(result="miss")
+    return await garment_async_flight.do(garment, _search_garment_async, garment)
 
-# Initialize Gemini
-llm = ChatGoogleGenerativeAI(
-    model="gemma-3-4b-it",
-    temperature=0.4,
-    google_api_key=os.getenv("GEMINI_API_KEY")
-)
+def _garment_response(outfit_text, garments, results):
+    found = [{"name": garment, "links": results[garment]} for garment in garments if garment in results]
+    return {
+        "outfit": outfit_text,
+        "shopping_links": list(dict.fromkeys(link for item in found for link in item["links"])),
+        "sources": [],
+        "garments": found,
+    }
 
-# Parser
-parser = PydanticOutputParser(pydantic_object=ProductSearchResponse)
+def search_outfit_garments(outfit_text):
+    """Searches every garment in the outfit in parallel; returns None when no garment
+    could be picked out of the text (callers then fall back to the agent)."""
+    garments = extract_garments(outfit_text)
+    if not garments:
+        return None
+    results = fan_out(
+        {garment: (lambda garment=garment: garment_links(garment)) for garment in garments},
+        timeout=GARMENT_SEARCH_TIMEOUT + LINK_CHECK_TIMEOUT + 1
+    )
+    return _garment_response(outfit_text, garments, results)
+
+async def search_outfit_garments_async(outfit_text):
+    """Async search_outfit_garments()."""
+    garments = extract_garments(outfit_text)
+    if not garments:
+        return None
+    results = await fan_out_async(
+        {garment: (lambda garment=garment: garment_links_async(garment)) for garment in garments},
+        timeout=GARMENT_SEARCH_TIMEOUT + LINK_CHECK_TIMEOUT + 1
+    )
+    return _garment_response(outfit_text, garments, results)
+
+
+# Define Product Search Response Schema
+PRODUCT_SEARCH_TEMPERATURE = 0.4
+
+# Parser (ProductSearchResponse lives in agents/schemas.py); LangChain and pydantic
+# are imported when the parser or the agent is first needed
+_parser = None
+
+def get_parser():
+    global _parser
+    if _parser is None:
+        from langchain_core.output_parsers import PydanticOutputParser
+        from agents.schemas import ProductSearchResponse
+        _parser = PydanticOutputParser(pydantic_object=ProductSearchResponse)
+    return _parser
 
 # Dynamic site list for prompt
 site_list = "\n".join([f"- {site}" for site in SHOPPING_SITES])
@@ -55,8 +276,8 @@ site_list = "\n".join([f"- {site}" for site in SHOPPING_SITES])
 # ----------------------------------------------
 # Prompt (UPDATED: explicitly force tool use)
 # ----------------------------------------------
-prompt = ChatPromptTemplate.from_messages(
-    [
+# Plain (role, template) pairs, turned into a ChatPromptTemplate when the agent is built
+prompt_messages = [
         (
             "system",
             f"""
@@ -72,7 +293,7 @@ prompt = ChatPromptTemplate.from_messages(
             - If no matching products are found, omit the link entirely.
             - At least one link per clothing item if available.
             - Links must be full product pages, not category or ad links.
-            - Output MUST follow this JSON schema, ensuring the '{ProductSearchResponse.model_fields['full_outfit_description'].alias or 'full_outfit_description'}' field contains the complete descriptive outfit text:
+            - Output MUST follow this JSON schema, ensuring the 'full_outfit_description' field contains the complete descriptive outfit text:
             
             {{format_instructions}}
 
@@ -81,16 +302,48 @@ prompt = ChatPromptTemplate.from_messages(
         ),
         ("human", "{outfit_description}"),
     ]
-).partial(format_instructions=parser.get_format_instructions())
 
-# Create Agent Executor with Tools
-def get_product_search_agent():
+def build_prompt():
+    from langchain_core.prompts import ChatPromptTemplate
+    return ChatPromptTemplate.from_messages(prompt_messages).partial(
+        format_instructions=get_parser().get_format_instructions()
+    )
+
+# Create Agent Executor with Tools (built once, shared across requests)
+def build_product_search_agent():
+    from langchain.agents import create_tool_calling_agent, AgentExecutor
+
+    tools = get_tools()
     agent = create_tool_calling_agent(
-        llm=llm,
-        prompt=prompt,
+        llm=get_llm(DEFAULT_MODEL, PRODUCT_SEARCH_TEMPERATURE, cache_site="product_agent"),
+        prompt=build_prompt(),
         tools=tools
     )
-    return AgentExecutor(agent=agent, tools=tools, verbose=True)
+    return AgentExecutor(agent=agent, tools=tools, verbose=AGENT_VERBOSE)
+
+register_agent("product_search", build_product_search_agent)
+
+def get_product_search_agent():
+    return get_agent("product_search")
+
+
+async def search_products_async(outfit_description):
+    """Async counterpart of the /search_products view: per-garment search, or the agent
+    with validated links when no garments are recognised."""
+    garment_result = await search_outfit_garments_async(outfit_description)
+    if garment_result is not None:
+        return {"full_outfit_description": outfit_description, "shopping_links": garment_result["shopping_links"],
+                "garments": garment_result["garments"]}
+
+    agent_executor = get_product_search_agent()
+    raw_response = await agent_executor.ainvoke({"outfit_description": outfit_description})
+
+    output = raw_response.get("output", "")
+    clean_output = re.sub(r"```(?:json)?\n?|\n?```", "", output).strip()
+    structured_response = get_parser().parse(clean_output)
+
+    structured_response.shopping_links = await validate_links_async(structured_response.shopping_links)
+    return structured_response.model_dump()
 
 
 # Blueprint
@@ -105,6 +358,13 @@ def search_products():
         if not outfit_description:
             return jsonify({"error": "Missing 'outfit' in request"}), 400
 
+        # Search each garment (cached across users); the agent only handles text without recognisable garments
+        garment_result = search_outfit_garments(outfit_description)
+        if garment_result is not None:
+            return jsonify({"full_outfit_description": outfit_description,
+                            "shopping_links": garment_result["shopping_links"],
+                            "garments": garment_result["garments"]}), 200
+
         # Run agent with tools
         agent_executor = get_product_search_agent()
         raw_response = agent_executor.invoke({"outfit_description": outfit_description})
@@ -112,7 +372,7 @@ def search_products():
         # Parse and clean
         output = raw_response.get("output", "")
         clean_output = re.sub(r"```(?:json)?\n?|\n?```", "", output).strip()
-        structured_response = parser.parse(clean_output)
+        structured_response = get_parser().parse(clean_output)
 
         #Validate and filter links
         structured_response.shopping_links = validate_links(structured_response.shopping_links)
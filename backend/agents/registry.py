@@ -0,0 +1,39 @@
+# agents/registry.py
+# Process-wide registry of prebuilt agent executors.
+#
+# Building an AgentExecutor (binding tools to the LLM, rendering the prompt) is pure
+# setup work, so each agent type is built once on first use and shared by every
+# request. AgentExecutor keeps no per-run state on the instance, so one executor can
+# serve concurrent requests.
+
+import os
+import threading
+
+AGENT_VERBOSE = os.getenv("AGENT_VERBOSE", "false").lower() in ("1", "true", "yes")
+
+_builders = {}
+_executors = {}
+_lock = threading.Lock()
+
+
+def register_agent(name, builder):
+    """Registers a zero-argument function that builds the executor for `name`."""
+    _builders[name] = builder
+
+
+def get_agent(name):
+    """Returns the shared executor for `name`, building it on first use."""
+    executor = _executors.get(name)
+    if executor is None:
+        with _lock:
+            executor = _executors.get(name)
+            if executor is None:
+                executor = _builders[name]()
+                _executors[name] = executor
+    return executor
+
+
+def reset_agents():
+    """Drops every prebuilt executor so the next call rebuilds it (e.g. after config changes)."""
+    with _lock:
+        _executors.clear()
@@ -0,0 +1,19 @@
+# agents/schemas.py
+# Structured outputs of the agents. Imported when an agent or parser is first built,
+# so pydantic isn't loaded at startup.
+
+from pydantic import BaseModel
+
+
+class TrendAnalysisResponse(BaseModel):
+    trend_topic: str
+    current_trends: list[str]
+    insights: str
+    sources: list[str]
+    tools_used: list[str]
+
+
+class ProductSearchResponse(BaseModel):
+    # This field will now hold the complete, descriptive text of the recommended outfit
+    full_outfit_description: str
+    shopping_links: list[str]
@@ -2,60 +2,114 @@
 import os
 import re
 from dotenv import load_dotenv
-from pydantic import BaseModel
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import PydanticOutputParser
-from langchain.agents import create_tool_calling_agent, AgentExecutor
-from tools import tools 
+from tools import get_trend_tools
+from cache import TTLCache
+from keywords import trend_matcher
+from singleflight import SingleFlight, AsyncSingleFlight
+from metrics import timed, STAGE_SECONDS, STAGE_ERRORS
+from agents.registry import register_agent, get_agent, AGENT_VERBOSE
+from agents.llm_registry import DEFAULT_MODEL, get_llm
 
 load_dotenv()
 
-class TrendAnalysisResponse(BaseModel):
-    trend_topic: str
-    current_trends: list[str]
-    insights: str
-    sources: list[str]
-    tools_used: list[str]
-
-llm = ChatGoogleGenerativeAI(
-    model="gemma-3-4b-it",
-    temperature=0.2,
-    google_api_key=os.getenv("GEMINI_API_KEY")
-)
-
-parser = PydanticOutputParser(pydantic_object=TrendAnalysisResponse)
-
-prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system", """You are a Trend Analyzer Agent...{format_instructions}"""),
-        ("placeholder", "{chat_history}"),
-        ("human", "{query}"),
-        ("placeholder", "{agent_scratchpad}"),
-    ]
-).partial(format_instructions=parser.get_format_instructions())
+TREND_CACHE_TTL = int(os.getenv("TREND_CACHE_TTL", 3600))
+TREND_CACHE_SIZE = int(os.getenv("TREND_CACHE_SIZE", 512))
 
-def get_trend_agent():
+trend_cache = TTLCache(maxsize=TREND_CACHE_SIZE, ttl=TREND_CACHE_TTL, name="trend_analysis")
+trend_flight = SingleFlight(name="trend_analysis")
+trend_async_flight = AsyncSingleFlight(name="trend_analysis_async")
+
+TREND_TEMPERATURE = 0.2
+
+# LangChain and pydantic are imported when the agent or parser is first needed
+_parser = None
+
+def get_parser():
+    global _parser
+    if _parser is None:
+        from langchain_core.output_parsers import PydanticOutputParser
+        from agents.schemas import TrendAnalysisResponse
+        _parser = PydanticOutputParser(pydantic_object=TrendAnalysisResponse)
+    return _parser
+
+def build_trend_agent():
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain.agents import create_tool_calling_agent, AgentExecutor
+
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", """You are a Trend Analyzer Agent...{format_instructions}"""),
+            ("placeholder", "{chat_history}"),
+            ("human", "{query}"),
+            ("placeholder", "{agent_scratchpad}"),
+        ]
+    ).partial(format_instructions=get_parser().get_format_instructions())
+    trend_tools = get_trend_tools()
     agent = create_tool_calling_agent(
-        llm=llm,
+        llm=get_llm(DEFAULT_MODEL, TREND_TEMPERATURE, cache_site="trend_agent"),
         prompt=prompt,
-        tools=tools
+        tools=trend_tools
     )
-    return AgentExecutor(agent=agent, tools=tools, verbose=True)
+    return AgentExecutor(agent=agent, tools=trend_tools, verbose=AGENT_VERBOSE)
+
+register_agent("trend", build_trend_agent)
+
+def get_trend_agent():
+    return get_agent("trend")
 
 def parse_trend_response(raw_response):
     output = raw_response.get("output", "")
     clean_output = re.sub(r"```(?:json)?\n?|\n?```", "", output).strip()
-    structured_response = parser.parse(clean_output)
-
-    FASHION_KEYWORDS = ["fashion", "style", "outfit", "ootd", "wear", "clothing", "look"]
-    structured_response.current_trends = [
-        t for t in structured_response.current_trends
-        if any(word in t.lower() for word in FASHION_KEYWORDS)
-    ]
-    structured_response.sources = [
-        s for s in structured_response.sources
-        if any(word in s.lower() for word in FASHION_KEYWORDS)
-    ]
+    structured_response = get_parser().parse(clean_output)
+
+    structured_response.current_trends = trend_matcher.filter(structured_response.current_trends)
+    structured_response.sources = trend_matcher.filter(structured_response.sources)
 
     return structured_response
+
+
+def normalize_query(query):
+    """Makes queries that only differ by case, word order or spacing share a cache entry."""
+    return " ".join(sorted(query.lower().split()))
+
+def analyze_trends(query):
+    """Returns the trend analysis for `query` as a dict, running the agent only on a cache miss."""
+    key = normalize_query(query)
+    cached = trend_cache.get(key)
+    if cached is not None:
+        print(f"Trend cache hit for '{key}' ({trend_cache.stats()['hit_rate']:.0%} hit rate)")
+        return cached
+
+    # Concurrent requests for the same trends wait on one agent run
+    return trend_flight.do(key, _run_trend_agent, key, query)
+
+def refresh_trends(query):
+    """Runs the agent even if the analysis is cached (for the background refresher)."""
+    key = normalize_query(query)
+    return trend_flight.do(key, _run_trend_agent, key, query)
+
+@timed(STAGE_SECONDS, STAGE_ERRORS, stage="trend_agent")
+def _run_trend_agent(key, query):
+    agent_executor = get_trend_agent()
+    raw_response = agent_executor.invoke({"query": query})
+    result = parse_trend_response(raw_response).dict()
+    trend_cache.set(key, result)
+    return result
+
+async def analyze_trends_async(query):
+    """Async analyze_trends(); shares the cache with the sync path."""
+    key = normalize_query(query)
+    cached = trend_cache.get(key)
+    if cached is not None:
+        print(f"Trend cache hit for '{key}' ({trend_cache.stats()['hit_rate']:.0%} hit rate)")
+        return cached
+
+    return await trend_async_flight.do(key, _arun_trend_agent, key, query)
+
+@timed(STAGE_SECONDS, STAGE_ERRORS, stage="trend_agent")
+async def _arun_trend_agent(key, query):
+    agent_executor = get_trend_agent()
+    raw_response = await agent_executor.ainvoke({"query": query})
+    result = parse_trend_response(raw_response).dict()
+    trend_cache.set(key, result)
+    return result
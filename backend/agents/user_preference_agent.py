@@ -1,28 +1,71 @@
 from flask import Blueprint, request, jsonify, session
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage
+import hashlib
 import os
+import re
 from dotenv import load_dotenv
+from closet_index import CATEGORY_KEYWORDS, COLORS
+from keywords import KeywordMatcher, bright_color_matcher, deep_skin_tone_matcher
+from kvstore import KVStore
+from singleflight import SingleFlight, AsyncSingleFlight, make_key
+from metrics import timed, STAGE_SECONDS, STAGE_ERRORS, PREFERENCE_VERDICTS
+from agents.llm_registry import DEFAULT_MODEL, get_llm
 
 load_dotenv()
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-llm = ChatGoogleGenerativeAI(model="gemma-3-4b-it", google_api_key=GEMINI_API_KEY)
 
 user_pref_bp = Blueprint("user_pref_bp", __name__)
 
+notes_flight = SingleFlight(name="preference_notes")
+notes_async_flight = AsyncSingleFlight(name="preference_notes_async")
 
-def adjust_outfit_with_preferences(outfit, preferences, context=None):
-    print(" [DEBUG] User Preference Agent Invoked")
-    print(" Preferences received:", preferences)
-    print(" Initial outfit suggestion:", outfit)
+# MATCH/ADJUST verdicts per (notes, outfit); dropped when the user changes their notes
+NOTES_VERDICT_TTL = int(os.getenv("NOTES_VERDICT_TTL", 7 * 24 * 3600))
+NOTES_VERDICT_MAX_ENTRIES = int(os.getenv("NOTES_VERDICT_MAX_ENTRIES", 20000))
+NOTES_VERDICT_TRIM_EVERY = int(os.getenv("NOTES_VERDICT_TRIM_EVERY", 100))
+notes_verdicts = KVStore("preference_verdicts")
+_verdict_writes = 0
+
+# Notes made only of these words ("loves black jeans and white sneakers") can be checked without the LLM
+notes_term_matcher = KeywordMatcher(
+    COLORS + [word for category, words in CATEGORY_KEYWORDS.items() for word in words], whole_word=True
+)
+NOTES_TERM_WORDS = {word for term in notes_term_matcher.keywords for word in re.findall(r"[a-z'-]+", term)}
+# Words that only say the user wants the terms. Anything else ("only", "no", "nothing too
+# tight", "allergic to wool") may change the meaning, so those notes go to the LLM.
+NOTES_FILLER_WORDS = {"i", "i'm", "im", "i'd", "me", "my", "a", "an", "the", "and", "or", "with", "in", "of", "to",
+                      "love", "loves", "like", "likes", "prefer", "prefers", "want", "wants", "enjoy", "enjoys",
+                      "wear", "wears", "wearing", "favorite", "favourite", "colors", "colours", "color", "colour",
+                      "clothes", "outfits", "pieces", "please", "really", "always", "more", "lots", "lot", "some"}
+
+
+def get_notes_llm():
+    """The chat model for the notes check (model default temperature), created on first use."""
+    return get_llm(DEFAULT_MODEL, cache_site="preference_notes")
 
-    reasons = []
-    context = context or {"type": "general", "closet": []}
-    recommendation_type = context["type"]
 
-    # --- Rule-based feedback ---
-    skin_color = preferences.get("skin_color", "").lower()
-    if skin_color and any(c in outfit.lower() for c in ["white", "bright", "coral"]) and ("tan" in skin_color or "dark" in skin_color or "olive" in skin_color):
+def invoke_llm(prompt):
+    """Invokes the LLM; concurrent calls with the same prompt share one request."""
+    from langchain_core.messages import HumanMessage
+    llm = get_notes_llm()
+    key = make_key(llm.model, prompt, temperature=llm.temperature)
+    return notes_flight.do(key, lambda: llm.invoke([HumanMessage(content=prompt)]).content.strip())
+
+
+async def ainvoke_llm(prompt):
+    """Async invoke_llm()."""
+    from langchain_core.messages import HumanMessage
+    llm = get_notes_llm()
+
+    async def run():
+        return (await llm.ainvoke([HumanMessage(content=prompt)])).content.strip()
+
+    key = make_key(llm.model, prompt, temperature=llm.temperature)
+    return await notes_async_flight.do(key, run)
+
+
+def rule_based_reasons(outfit, preferences):
+    """Feedback from skin tone, height and weight that needs no LLM."""
+    reasons = []
+    if bright_color_matcher.search(outfit) and deep_skin_tone_matcher.search(preferences.get("skin_color", "")):
         reasons.append("White or bright/vibrant colors complement your skin tone beautifully.")
 
     try:
@@ -38,23 +81,93 @@ def adjust_outfit_with_preferences(outfit, preferences, context=None):
             reasons.append("Suggesting a more flowy top for comfort and a flattering fit.")
     except (ValueError, TypeError):
         pass
+    return reasons
 
-    # --- CLOSET mode: strictly no adjustment ---
-    if recommendation_type == 'closet':
-        additional_notes = preferences.get("additional_notes", "")
-        if additional_notes:
-            reasons.append(f"Notes received but not used: '{additional_notes}'. Closet items are strictly enforced.")
-        return {"outfit": outfit, "reasons": reasons}
 
-    # --- LLM adjustment for general recommendations ---
-    additional_notes = preferences.get("additional_notes", "")
+def _digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:24]
+
+
+def normalize_outfit(outfit):
+    """Lowercased outfit text without punctuation or extra spaces, so reworded whitespace
+    and capitalization don't count as a different outfit."""
+    return " ".join(re.findall(r"[a-z0-9#'-]+", outfit.lower()))
+
+
+def verdict_key(additional_notes, outfit):
+    return f"{_digest(additional_notes.strip().lower())}:{_digest(normalize_outfit(outfit))}"
+
+
+def forget_notes_verdicts(additional_notes):
+    """Drops the cached verdicts for these notes (called when a user changes them)."""
     if additional_notes:
-        closet_items = context.get("closet", [])
-        adjustment_constraint = (
-            "You can suggest different items, but the new outfit must be a complete combination (top+bottom or dress/jumpsuit)."
-        )
+        notes_verdicts.delete_prefix(_digest(additional_notes.strip().lower()) + ":")
+
+
+def rule_based_verdict(outfit, additional_notes):
+    """A MATCH answer when the notes only ask for colors/garments the outfit already has;
+    None when the LLM has to decide (any word the rules don't understand, e.g. restrictions)."""
+    notes_words = set(re.findall(r"[a-z'-]+", additional_notes.lower()))
+    if not notes_words <= NOTES_TERM_WORDS | NOTES_FILLER_WORDS:
+        return None
+    wanted = notes_term_matcher.find_all(additional_notes)
+    if not wanted:
+        return None
+    present = set(notes_term_matcher.find_all(outfit))
+    if not all(term in present for term in wanted):
+        return None
+    return f"MATCH|The outfit already includes what your notes ask for ({', '.join(sorted(wanted))})."
+
+
+def cached_verdict(outfit, additional_notes):
+    """The verdict from the rules or the cache, or (None, key) when the LLM is needed."""
+    rule_verdict = rule_based_verdict(outfit, additional_notes)
+    if rule_verdict is not None:
+        PREFERENCE_VERDICTS.inc(source="rules")
+        return rule_verdict, None
+    key = verdict_key(additional_notes, outfit)
+    verdict = notes_verdicts.get(key)
+    if verdict is not None:
+        PREFERENCE_VERDICTS.inc(source="cached")
+        return verdict, None
+    PREFERENCE_VERDICTS.inc(source="llm")
+    return None, key
+
+
+def store_verdict(key, response):
+    global _verdict_writes
+    # Only well-formed answers are kept; anything else is retried next time
+    if response.startswith(("MATCH|", "ADJUST|")):
+        notes_verdicts.set(key, response, ttl=NOTES_VERDICT_TTL)
+        _verdict_writes += 1
+        if _verdict_writes % NOTES_VERDICT_TRIM_EVERY == 0:
+            notes_verdicts.trim(NOTES_VERDICT_MAX_ENTRIES)
+
+
+def notes_verdict(outfit, additional_notes):
+    """MATCH|... or ADJUST|... for the outfit, from the rules, the cache or the LLM."""
+    verdict, key = cached_verdict(outfit, additional_notes)
+    if verdict is None:
+        verdict = invoke_llm(notes_prompt(outfit, additional_notes))
+        store_verdict(key, verdict)
+    return verdict
+
 
-        prompt = f"""
+async def notes_verdict_async(outfit, additional_notes):
+    """Async notes_verdict()."""
+    verdict, key = cached_verdict(outfit, additional_notes)
+    if verdict is None:
+        verdict = await ainvoke_llm(notes_prompt(outfit, additional_notes))
+        store_verdict(key, verdict)
+    return verdict
+
+
+def notes_prompt(outfit, additional_notes):
+    adjustment_constraint = (
+        "You can suggest different items, but the new outfit must be a complete combination (top+bottom or dress/jumpsuit)."
+    )
+
+    return f"""
         You are a virtual stylist. I have an outfit suggestion and a user's free-text preferences.
         Analyze the Proposed Outfit against the User Notes.
         
@@ -65,15 +178,62 @@ def adjust_outfit_with_preferences(outfit, preferences, context=None):
         1. MATCH|Reason if outfit is fine.
         2. ADJUST|New complete outfit. {adjustment_constraint}
         """
+
+
+def apply_notes_response(response, outfit, reasons):
+    """Applies a MATCH|... or ADJUST|... answer; returns the (possibly new) outfit."""
+    if response.startswith("MATCH|"):
+        llm_reason = response.split("|", 1)[1].strip()
+        reasons.append(f"Style Notes Check: {llm_reason}")
+    elif response.startswith("ADJUST|"):
+        new_outfit = response.split("|", 1)[1].strip()
+        reasons.append("Style Notes Check: Adjusted the outfit to better fit your notes.")
+        outfit = new_outfit
+    return outfit
+
+
+def _closet_mode_result(outfit, preferences, reasons):
+    # --- CLOSET mode: strictly no adjustment ---
+    additional_notes = preferences.get("additional_notes", "")
+    if additional_notes:
+        reasons.append(f"Notes received but not used: '{additional_notes}'. Closet items are strictly enforced.")
+    return {"outfit": outfit, "reasons": reasons}
+
+
+@timed(STAGE_SECONDS, STAGE_ERRORS, stage="adjust_outfit_with_preferences")
+def adjust_outfit_with_preferences(outfit, preferences, context=None):
+    print(" [DEBUG] User Preference Agent Invoked")
+    print(" Preferences received:", preferences)
+    print(" Initial outfit suggestion:", outfit)
+
+    context = context or {"type": "general", "closet": []}
+    reasons = rule_based_reasons(outfit, preferences)
+    if context["type"] == 'closet':
+        return _closet_mode_result(outfit, preferences, reasons)
+
+    # --- LLM adjustment for general recommendations ---
+    additional_notes = preferences.get("additional_notes", "")
+    if additional_notes:
+        try:
+            outfit = apply_notes_response(notes_verdict(outfit, additional_notes), outfit, reasons)
+        except Exception:
+            reasons.append("Error processing style notes with LLM.")
+
+    return {"outfit": outfit, "reasons": reasons}
+
+
+@timed(STAGE_SECONDS, STAGE_ERRORS, stage="adjust_outfit_with_preferences")
+async def adjust_outfit_with_preferences_async(outfit, preferences, context=None):
+    """Async adjust_outfit_with_preferences()."""
+    context = context or {"type": "general", "closet": []}
+    reasons = rule_based_reasons(outfit, preferences)
+    if context["type"] == 'closet':
+        return _closet_mode_result(outfit, preferences, reasons)
+
+    additional_notes = preferences.get("additional_notes", "")
+    if additional_notes:
         try:
-            response = llm.invoke([HumanMessage(content=prompt)]).content.strip()
-            if response.startswith("MATCH|"):
-                llm_reason = response.split("|", 1)[1].strip()
-                reasons.append(f"Style Notes Check: {llm_reason}")
-            elif response.startswith("ADJUST|"):
-                new_outfit = response.split("|", 1)[1].strip()
-                reasons.append("Style Notes Check: Adjusted the outfit to better fit your notes.")
-                outfit = new_outfit
+            outfit = apply_notes_response(await notes_verdict_async(outfit, additional_notes), outfit, reasons)
         except Exception:
             reasons.append("Error processing style notes with LLM.")
 
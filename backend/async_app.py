@@ -0,0 +1,222 @@
+# async_app.py
+# asyncio serving mode for the LLM-bound routes.
+#
+# /generate-outfit, /analyze_trends and /search_products are served by FastAPI with
+# async agents, tools and Gemini calls, so a request waiting on Gemini, DDGS or a blog
+# costs a coroutine instead of an OS thread. Every other route (pages, closet, auth,
+# preferences, metrics, /generate-outfit/stream) falls through to the Flask app in
+# main.py, and the Flask session cookie is read directly so logins carry over.
+#
+# Run (from backend/):
+#   uvicorn async_app:app --host 127.0.0.1 --port 5000
+#
+# Firestore reads still use the sync client, on asyncio's default thread pool; they
+# are short and mostly served from the per-user caches.
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Form, Request
+from fastapi.middleware.wsgi import WSGIMiddleware
+from fastapi.responses import JSONResponse
+from itsdangerous import BadSignature
+
+import main
+import gemini_client
+import tools
+from agents import product_search_agent
+from agents.OutfitGenerator import generate_outfit_recommendation_async
+from trend_snapshots import get_trends_async, trend_query
+from agents.product_search_agent import (
+    get_product_search_agent, get_parser as get_product_parser, search_outfit_garments_async, search_products_async
+)
+from pipeline import AsyncStagePipeline, StageTimeout
+from metrics import timed, STAGE_SECONDS, STAGE_ERRORS
+
+# Requests allowed to be in flight at once, and how long one may wait for a slot
+ASYNC_MAX_INFLIGHT = int(os.environ.get("ASYNC_MAX_INFLIGHT", 256))
+ASYNC_QUEUE_TIMEOUT = float(os.environ.get("ASYNC_QUEUE_TIMEOUT", 5))
+
+flask_app = main.app
+_inflight = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global _inflight
+    _inflight = asyncio.Semaphore(ASYNC_MAX_INFLIGHT)
+    yield
+    await gemini_client.aclose()
+    await tools.aclose()
+    await product_search_agent.aclose()
+
+
+app = FastAPI(title="Virtual Stylist (async)", lifespan=lifespan)
+
+
+def session_uid(request):
+    """Returns the uid from the Flask session cookie, or None."""
+    cookie = request.cookies.get(flask_app.config["SESSION_COOKIE_NAME"])
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    if not cookie or serializer is None:
+        return None
+    try:
+        data = serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+    return data.get("uid")
+
+
+class ServerBusy(Exception):
+    """No in-flight slot became free within ASYNC_QUEUE_TIMEOUT."""
+
+
+@asynccontextmanager
+async def inflight_slot():
+    """Bounds concurrent work (and memory); raises ServerBusy when the server is saturated."""
+    try:
+        await asyncio.wait_for(_inflight.acquire(), timeout=ASYNC_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise ServerBusy()
+    try:
+        yield
+    finally:
+        _inflight.release()
+
+
+def busy_response():
+    return JSONResponse({"message": "The Stylist is very busy right now. Please try again in a moment."}, status_code=503)
+
+
+@timed(STAGE_SECONDS, STAGE_ERRORS, stage="product_search_agent")
+async def search_outfit_products_async(core_outfit_description):
+    """Async main.search_outfit_products()."""
+    garment_result = await search_outfit_garments_async(core_outfit_description)
+    if garment_result is not None:
+        return garment_result
+
+    agent_executor = get_product_search_agent()
+    raw_response = await agent_executor.ainvoke({"outfit_description": core_outfit_description})
+    output = raw_response.get("output", "")
+
+    try:
+        return get_product_parser().parse(output).dict()
+    except Exception:
+        return {"outfit": core_outfit_description, "shopping_links": [], "sources": []}
+
+
+@app.post("/generate-outfit")
+async def generate_outfit(
+    request: Request,
+    occasion: str = Form(""),
+    style_preference: str = Form(""),
+    disliked_outfit: str = Form(None),
+    recommendation_type: str = Form("closet"),
+    gender: str = Form("person"),
+    regenerate: bool = Form(False),
+):
+    uid = session_uid(request)
+    if uid is None:
+        return JSONResponse({"message": "Unauthorized"}, status_code=401)
+    try:
+        async with inflight_slot():
+            return await _generate_outfit(uid, occasion, style_preference, disliked_outfit, recommendation_type, gender,
+                                          regenerate)
+    except ServerBusy:
+        return busy_response()
+
+
+async def _generate_outfit(uid, occasion, style, disliked_outfit, recommendation_type, form_gender, regenerate=False):
+    # Same stages and responses as main.generate_outfit
+    pipeline = AsyncStagePipeline("generate-outfit-async")
+    context_task = pipeline.start("closet", asyncio.to_thread, main.get_outfit_context, uid, occasion, style, disliked_outfit)
+    trends_task = pipeline.start("trends", get_trends_async, trend_query(occasion, style))
+    try:
+        trend_response = await pipeline.result("trends", trends_task, main.TREND_STAGE_TIMEOUT, default=None)
+        trends = []
+        if trend_response:
+            insights = trend_response.get("insights", "").lower()
+            if "not about fashion" in insights or "cannot fulfill this request" in insights:
+                return JSONResponse({
+                    "recommendation_text": main.NON_FASHION_MESSAGE,
+                    "reasons": [],
+                    "trends_considered": [],
+                    "shopping_links": [],
+                    "sources": []
+                }, status_code=400)
+            trends = trend_response.get("current_trends", [])[:3]
+
+        try:
+            user_closet, preferences = await pipeline.result("closet", context_task, main.FIRESTORE_STAGE_TIMEOUT)
+        except Exception:
+            return JSONResponse({"message": "We couldn't load your closet right now. Please try again."}, status_code=503)
+
+        gender = preferences.get("gender", form_gender)
+
+        try:
+            recommendation_text = await pipeline.run(
+                "outfit", generate_outfit_recommendation_async,
+                user_closet, occasion, style, gender,
+                disliked_outfit, recommendation_type, trends, preferences,
+                regenerate=regenerate, timeout=main.OUTFIT_STAGE_TIMEOUT
+            )
+        except StageTimeout:
+            return JSONResponse({"message": "The Stylist is taking too long to respond. Please try again."}, status_code=504)
+
+        if "Your closet is empty" in recommendation_text and recommendation_type == "closet":
+            return JSONResponse({"message": recommendation_text}, status_code=400)
+
+        core_outfit_description, reasons = main.split_recommendation_text(recommendation_text)
+        structured_response = await pipeline.run(
+            "product_search", search_outfit_products_async, core_outfit_description,
+            timeout=main.PRODUCT_SEARCH_STAGE_TIMEOUT,
+            default={"outfit": core_outfit_description, "shopping_links": [], "sources": []}
+        )
+
+        return JSONResponse({
+            "recommendation_text": recommendation_text,
+            "reasons": reasons,
+            "trends_considered": trends,
+            "shopping_links": structured_response.get("shopping_links", []),
+            "sources": structured_response.get("sources", [])
+        })
+    finally:
+        pipeline.cancel_pending(context_task, trends_task)
+        pipeline.log_timings()
+
+
+@app.post("/analyze_trends")
+async def analyze_trends(request: Request):
+    if session_uid(request) is None:
+        return JSONResponse({"message": "Unauthorized"}, status_code=401)
+    try:
+        async with inflight_slot():
+            data = await request.json()
+            query = data.get("query", "current fashion trends")
+            return JSONResponse(await get_trends_async(query))
+    except ServerBusy:
+        return busy_response()
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.post("/search_products")
+async def search_products(request: Request):
+    if session_uid(request) is None:
+        return JSONResponse({"message": "Unauthorized"}, status_code=401)
+    try:
+        async with inflight_slot():
+            data = await request.json()
+            outfit_description = data.get("outfit", "")
+            if not outfit_description:
+                return JSONResponse({"error": "Missing 'outfit' in request"}, status_code=400)
+            return JSONResponse(await search_products_async(outfit_description))
+    except ServerBusy:
+        return busy_response()
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+# Everything else is served by the Flask app
+app.mount("/", WSGIMiddleware(flask_app))
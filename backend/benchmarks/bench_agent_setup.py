@@ -0,0 +1,37 @@
+# benchmarks/bench_agent_setup.py
+# Measures the per-request cost of building an agent executor versus reusing the
+# prebuilt one from agents.registry. No network calls are made.
+#
+# Usage (from backend/):  python benchmarks/bench_agent_setup.py [iterations]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("GEMINI_API_KEY", "benchmark-key")
+
+from agents.registry import get_agent
+from agents.trendanalyzer import build_trend_agent
+from agents.product_search_agent import build_product_search_agent
+
+
+def time_per_call(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"{'agent':<16}{'build per request':>20}{'shared executor':>20}{'speedup':>10}")
+    for name, builder in (("trend", build_trend_agent), ("product_search", build_product_search_agent)):
+        get_agent(name)  # warm the registry
+        before = time_per_call(builder, iterations)
+        after = time_per_call(lambda: get_agent(name), iterations)
+        print(f"{name:<16}{before * 1e3:>17.3f} ms{after * 1e6:>17.3f} us{before / after:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# benchmarks/bench_blog_parse.py
+# Measures the parse time per blog page: a full BeautifulSoup parse (the old path)
+# versus tools.extract_anchors, which stops once it has the first 10 anchors.
+# Also checks that both return the same anchors. No network calls are made.
+#
+# Usage (from backend/):  python benchmarks/bench_blog_parse.py [iterations]
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("STYLIST_DATA_DIR", tempfile.mkdtemp(prefix="stylist-bench-"))
+
+from bs4 import BeautifulSoup
+
+import fakes
+from tools import BLOG_MAX_ANCHORS, extract_anchors
+
+# (label, html): pages of different sizes, anchors near the top like a blog's nav bar
+PAGES = [
+    ("small (40 anchors, 50 paragraphs)", fakes.fake_blog_html(anchors=40, filler_paragraphs=50)),
+    ("medium (40 anchors, 400 paragraphs)", fakes.fake_blog_html(anchors=40, filler_paragraphs=400)),
+    ("large (200 anchors, 4000 paragraphs)", fakes.fake_blog_html(anchors=200, filler_paragraphs=4000)),
+]
+
+
+def soup_anchors(html):
+    soup = BeautifulSoup(html, "html.parser")
+    return [(link.get_text(strip=True), link["href"]) for link in soup.find_all("a", href=True)[:BLOG_MAX_ANCHORS]]
+
+
+def time_per_call(fn, html, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn(html)
+    return (time.perf_counter() - started) / iterations
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(f"{'page':<38}{'size':>9}{'BeautifulSoup':>16}{'extract_anchors':>18}{'speedup':>10}{'same':>6}")
+    for label, html in PAGES:
+        same = soup_anchors(html) == extract_anchors(html)
+        before = time_per_call(soup_anchors, html, iterations)
+        after = time_per_call(extract_anchors, html, iterations)
+        print(f"{label:<38}{len(html) // 1024:>7}KB{before * 1e3:>13.2f} ms{after * 1e3:>15.3f} ms"
+              f"{before / after:>9.0f}x{'yes' if same else 'NO':>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# benchmarks/bench_keywords.py
+# Measures filtering result lists of thousands of entries: the old per-keyword scan
+# (`any(word in text.lower() ...)`, which lowercases the text once per keyword)
+# against keywords.KeywordMatcher, plus the alternatives the matcher chose between.
+# Also checks that the matcher keeps the same entries. No network calls are made.
+#
+# Usage (from backend/):  python benchmarks/bench_keywords.py [entries]
+
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from closet_index import CATEGORY_KEYWORDS, COLORS
+from keywords import FASHION_KEYWORDS, PRODUCT_KEYWORDS, KeywordMatcher
+
+FILLER = ("the new season drop is here with summer trends on tiktok and lots of deals from the best "
+          "stores this week shop now free shipping limited time").split()
+GARMENT_KEYWORDS = [word for words in CATEGORY_KEYWORDS.values() for word in words] + COLORS
+
+
+def make_results(count, keywords, seed=7):
+    rng = random.Random(seed)
+    results = []
+    for i in range(count):
+        words = [rng.choice(FILLER) for _ in range(30)]
+        if i % 3 == 0:
+            words.insert(rng.randrange(len(words)), rng.choice(keywords).capitalize())
+        results.append(" ".join(words))
+    return results
+
+
+def old_filter(texts, keywords):
+    return [t for t in texts if any(word in t.lower() for word in keywords)]
+
+
+def regex_filter(texts, keywords):
+    # A single combined regex, case-insensitive: what the matcher does not use in substring mode
+    pattern = re.compile("|".join(map(re.escape, sorted(keywords, key=len, reverse=True))), re.IGNORECASE)
+    return [t for t in texts if pattern.search(t)]
+
+
+def time_call(fn, iterations=5):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        result = fn()
+    return (time.perf_counter() - started) / iterations, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    print(f"{'keywords':<22}{'mode':<12}{'old scan':>12}{'regex':>12}{'matcher':>12}{'speedup':>10}{'same':>6}")
+    for label, keywords in [("fashion (6)", FASHION_KEYWORDS), ("product (9)", PRODUCT_KEYWORDS),
+                            (f"garment ({len(GARMENT_KEYWORDS)})", GARMENT_KEYWORDS)]:
+        texts = make_results(count, keywords)
+        before, expected = time_call(lambda: old_filter(texts, keywords))
+        regex, _ = time_call(lambda: regex_filter(texts, keywords))
+        for mode, whole_word in [("substring", False), ("whole word", True)]:
+            matcher = KeywordMatcher(keywords, whole_word=whole_word)
+            after, kept = time_call(lambda: matcher.filter(texts))
+            # Whole-word matching may keep fewer entries ("top" in "stop"), so only substring must be identical
+            same = "yes" if kept == expected else ("-" if whole_word else "NO")
+            print(f"{label:<22}{mode:<12}{before * 1e3:>9.2f} ms{regex * 1e3:>9.2f} ms{after * 1e3:>9.2f} ms"
+                  f"{before / after:>9.1f}x{same:>6}")
+
+
+if __name__ == "__main__":
+    main()
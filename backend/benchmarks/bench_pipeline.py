@@ -0,0 +1,240 @@
+# benchmarks/bench_pipeline.py
+# Offline load benchmark for the Flask app in main.py.
+#
+# Drives /generate-outfit, /add-item, /closet/<category> and /analyze_trends through
+# Flask's test client, with every external service replaced by the latency-controlled
+# fakes in benchmarks/fakes.py. Reports throughput and p50/p95/p99 latency for each
+# combination of concurrency level and closet size, and saves the results as JSON so
+# runs before and after a change can be compared.
+#
+# Usage (from backend/):
+#   python benchmarks/bench_pipeline.py --concurrency 1,8,32 --closet-sizes 20,300
+#   python benchmarks/bench_pipeline.py --compare benchmarks/results/pipeline-<before>.json
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakes
+
+SCENARIOS = ["generate-outfit", "add-item", "closet-page", "analyze-trends", "generate-week"]
+OCCASIONS = ["party", "office", "wedding guest", "date night", "brunch", "festival", "interview", "beach"]
+STYLES = ["streetwear", "minimalist", "boho", "classic", "preppy", "edgy", "romantic", "sporty"]
+
+
+def load_app(args):
+    """Installs the fakes and imports main.py; returns (main module, fake Firestore)."""
+    os.environ.setdefault("FIREBASE_SERVICE_ACCOUNT_JSON", "{}")
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark-key")
+    # Keep persistent stores out of backend/.cache and the refresher from adding load
+    os.environ.setdefault("STYLIST_DATA_DIR", tempfile.mkdtemp(prefix="stylist-bench-"))
+    os.environ.setdefault("TREND_REFRESHER_ENABLED", "false")
+
+    import firebase_admin
+    import requests
+    from firebase_admin import credentials, firestore
+
+    fake_db = fakes.FakeFirestore(latency=args.firestore_latency)
+    credentials.Certificate = lambda *a, **k: None
+    firebase_admin.initialize_app = lambda *a, **k: None
+    firestore.client = lambda *a, **k: fake_db
+
+    # Blog pages are fetched with requests.get; nothing else in this process needs the network.
+    requests.get = fakes.make_fake_get(args.blog_latency)
+
+    import gemini_client
+    import tools
+    gemini_client.session = fakes.FakeGeminiSession(latency=args.gemini_latency)
+    tools.DDGS = fakes.make_fake_ddgs(args.ddgs_latency)
+
+    from llm_cache import response_cache
+    from agents import llm_registry, product_search_agent, registry, trendanalyzer
+    product_search_agent.link_session = fakes.FakeLinkSession(latency=args.link_latency)
+    # The agents take their chat models from the registry, so the fakes are installed there
+    # (with each call site's response cache, so cached runs behave like the real models)
+    for temperature, site in [(trendanalyzer.TREND_TEMPERATURE, "trend_agent"),
+                              (product_search_agent.PRODUCT_SEARCH_TEMPERATURE, "product_agent"),
+                              (None, "preference_notes")]:
+        llm_registry.set_llm(llm_registry.DEFAULT_MODEL, temperature, fakes.FakeChatModel(
+            latency=args.llm_latency, temperature=0.7 if temperature is None else temperature, cache=response_cache(site)
+        ))
+    registry.reset_agents()
+
+    import main
+    return main, fake_db
+
+
+def reset_caches():
+    """Clears every in-process TTL cache and persistent store so each run starts cold."""
+    from cache import TTLCache
+    from kvstore import KVStore
+    for module in list(sys.modules.values()):
+        if not getattr(module, "__file__", None) or not module.__file__.startswith(BACKEND_DIR):
+            continue
+        for value in list(vars(module).values()):
+            if isinstance(value, (TTLCache, KVStore)):
+                value.clear()
+
+
+def seed_users(fake_db, count, closet_size):
+    for n in range(count):
+        uid = f"bench-user-{n}"
+        fake_db.docs[("closets", uid)] = fakes.make_closet(closet_size)
+        fake_db.docs[("users", uid)] = {"preferences": {"gender": "woman", "additional_notes": "prefers neutral colors"}}
+
+
+def make_request(scenario, client, worker, i, query_pool):
+    combo = (worker * 7 + i) % query_pool
+    occasion, style = OCCASIONS[combo % len(OCCASIONS)], STYLES[(combo // len(OCCASIONS) + combo) % len(STYLES)]
+    if scenario == "generate-outfit":
+        return client.post("/generate-outfit", data={
+            "occasion": occasion, "style_preference": style, "recommendation_type": "closet"
+        })
+    if scenario == "generate-week":
+        # One batch request for a week of outfits (compare with 7 x generate-outfit)
+        return client.post("/generate-outfit/batch", json={"entries": [
+            {"occasion": OCCASIONS[(combo + day) % len(OCCASIONS)], "style_preference": style} for day in range(7)
+        ]})
+    if scenario == "add-item":
+        return client.post("/add-item", data={"itemInput": f"bench item {worker}-{i}", "category": "tops"})
+    if scenario == "closet-page":
+        return client.get("/closet/tops")
+    if scenario == "analyze-trends":
+        return client.post("/analyze_trends", json={"query": f"{occasion} {style} fashion trends"})
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(app, scenario, concurrency, total_requests, query_pool):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    per_worker = max(1, total_requests // concurrency)
+
+    def worker(n):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["uid"] = f"bench-user-{n}"
+        for i in range(per_worker):
+            started = time.perf_counter()
+            response = make_request(scenario, client, n, i, query_pool)
+            response.get_data()
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code >= 400:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "mean_ms": round(1000 * sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        "p50_ms": round(1000 * percentile(latencies, 50), 2),
+        "p95_ms": round(1000 * percentile(latencies, 95), 2),
+        "p99_ms": round(1000 * percentile(latencies, 99), 2),
+    }
+
+
+def print_table(results, previous=None):
+    header = (f"{'scenario':<16}{'closet':>7}{'conc':>6}{'reqs':>6}{'err':>5}{'rps':>9}"
+              f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'fs rt':>7}{'fs kB':>8}")
+    print(header)
+    print("-" * len(header))
+    for row in results:
+        line = (f"{row['scenario']:<16}{row['closet_size']:>7}{row['concurrency']:>6}{row['requests']:>6}"
+                f"{row['errors']:>5}{row['throughput_rps']:>9.1f}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+                f"{row['p99_ms']:>10.1f}{row['firestore_round_trips']:>7}{row.get('firestore_kb_read', 0):>8.1f}")
+        before = (previous or {}).get((row["scenario"], row["closet_size"], row["concurrency"]))
+        if before:
+            line += (f"   vs before: rps {row['throughput_rps'] - before['throughput_rps']:+.1f},"
+                     f" p50 {row['p50_ms'] - before['p50_ms']:+.1f}, p99 {row['p99_ms'] - before['p99_ms']:+.1f}")
+        print(line)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--closet-sizes", default="20,200", help="comma-separated closet sizes")
+    parser.add_argument("--requests", type=int, default=32, help="requests per run")
+    parser.add_argument("--query-pool", type=int, default=8, help="distinct occasion/style combinations")
+    parser.add_argument("--gemini-latency", type=float, default=0.2, help="seconds per Gemini REST call")
+    parser.add_argument("--llm-latency", type=float, default=0.1, help="seconds per ChatGoogleGenerativeAI call")
+    parser.add_argument("--ddgs-latency", type=float, default=0.1, help="seconds per DuckDuckGo search")
+    parser.add_argument("--blog-latency", type=float, default=0.1, help="seconds per blog page fetch")
+    parser.add_argument("--link-latency", type=float, default=0.05, help="seconds per product link check")
+    parser.add_argument("--firestore-latency", type=float, default=0.01, help="seconds per Firestore round trip")
+    parser.add_argument("--output", help="where to save the JSON results (default: benchmarks/results/)")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--verbose", action="store_true", help="show the app's own log output")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    concurrency_levels = [int(c) for c in args.concurrency.split(",")]
+    closet_sizes = [int(c) for c in args.closet_sizes.split(",")]
+
+    app_module, fake_db = load_app(args)
+    app = app_module.app
+    results = []
+    for scenario in scenarios:
+        for closet_size in closet_sizes:
+            for concurrency in concurrency_levels:
+                seed_users(fake_db, concurrency, closet_size)
+                reset_caches()
+                round_trips_before, bytes_before = fake_db.round_trips, fake_db.bytes_read
+                quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+                with quiet:
+                    stats = run_scenario(app, scenario, concurrency, args.requests, args.query_pool)
+                stats["firestore_round_trips"] = fake_db.round_trips - round_trips_before
+                stats["firestore_kb_read"] = round((fake_db.bytes_read - bytes_before) / 1024, 1)
+                results.append(dict(scenario=scenario, closet_size=closet_size, concurrency=concurrency, **stats))
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = {(r["scenario"], r["closet_size"], r["concurrency"]): r for r in json.load(f)["results"]}
+    print_table(results, previous)
+
+    output = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "results", f"pipeline-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "verbose")}
+    with open(output, "w") as f:
+        json.dump({"timestamp": datetime.now().isoformat(timespec="seconds"), "config": config, "results": results}, f, indent=2)
+    print(f"\nSaved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
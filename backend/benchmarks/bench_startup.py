@@ -0,0 +1,101 @@
+# benchmarks/bench_startup.py
+# Measures cold start of the backend: the time to `import main` in a fresh interpreter,
+# the peak RSS afterwards, and which heavy dependencies were loaded by the import.
+# Then times the first use of each lazily loaded dependency (Firestore client, chat
+# model, agents), which is what the first request that needs it pays.
+# Uses placeholder credentials; no network calls are made. The trend refresher runs with
+# its default setting, as in production (its first pass is delayed past the measurement).
+#
+# Usage (from backend/):  python benchmarks/bench_startup.py [runs]
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Modules that should only be imported when first needed
+HEAVY_MODULES = ["langchain", "langchain_google_genai", "langchain_core", "firebase_admin",
+                 "google.cloud.firestore", "pydantic", "duckduckgo_search", "bs4"]
+
+IMPORT_SCRIPT = """
+import json, resource, sys, time
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+print(json.dumps({
+    "seconds": elapsed,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modules": len(sys.modules),
+    "loaded": [name for name in %r if name in sys.modules],
+}))
+"""
+
+FIRST_USE_SCRIPT = """
+import json, time
+import datastore, main
+from agents import llm_registry, registry
+timings = {}
+for label, fn in [("firestore client", datastore.get_db),
+                  ("chat model", llm_registry.get_llm),
+                  ("trend agent", lambda: registry.get_agent("trend")),
+                  ("product search agent", lambda: registry.get_agent("product_search"))]:
+    started = time.perf_counter()
+    fn()
+    timings[label] = time.perf_counter() - started
+print(json.dumps(timings))
+"""
+
+# A syntactically valid service account, so firebase_admin accepts it without network access
+FAKE_SERVICE_ACCOUNT = {
+    "type": "service_account", "project_id": "stylist-bench", "private_key_id": "bench",
+    "client_email": "bench@stylist-bench.iam.gserviceaccount.com", "client_id": "0",
+    "token_uri": "https://oauth2.googleapis.com/token",
+}
+
+
+def fake_private_key():
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                             serialization.NoEncryption()).decode()
+
+
+def bench_env():
+    env = dict(os.environ)
+    env["FIREBASE_SERVICE_ACCOUNT_JSON"] = json.dumps(dict(FAKE_SERVICE_ACCOUNT, private_key=fake_private_key()))
+    env.setdefault("GEMINI_API_KEY", "bench")
+    env["STYLIST_DATA_DIR"] = tempfile.mkdtemp(prefix="stylist-bench-")
+    return env
+
+
+def run(script, env):
+    result = subprocess.run([sys.executable, "-c", script], cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    env = bench_env()
+    results = [run(IMPORT_SCRIPT % HEAVY_MODULES, env) for _ in range(runs)]
+    seconds = [r["seconds"] for r in results]
+    print(f"import main ({runs} runs)")
+    print(f"  median      {statistics.median(seconds) * 1e3:>9.1f} ms   (min {min(seconds) * 1e3:.1f} ms)")
+    print(f"  max RSS     {max(r['max_rss_mb'] for r in results):>9.1f} MB")
+    print(f"  modules     {results[-1]['modules']:>9}")
+    print(f"  heavy deps  {', '.join(results[-1]['loaded']) or 'none'}")
+
+    print("first use after import")
+    for label, elapsed in run(FIRST_USE_SCRIPT, env).items():
+        print(f"  {label:<22}{elapsed * 1e3:>9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
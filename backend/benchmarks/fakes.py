@@ -0,0 +1,348 @@
+# benchmarks/fakes.py
+# In-process stand-ins for every external service the outfit pipeline talks to:
+# Firestore, the Gemini REST API, ChatGoogleGenerativeAI, DuckDuckGo search and the
+# fashion blog pages. Each fake sleeps for a configurable latency so the benchmarks
+# exercise the real request path without touching the network.
+
+import asyncio
+import json
+import threading
+import time
+
+from google.api_core.exceptions import AlreadyExists, NotFound
+from google.cloud.firestore_v1.transforms import ArrayRemove, ArrayUnion
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+CLOSET_CATEGORIES = ["tops", "bottoms", "dresses", "outerwear", "shoes", "accessories"]
+COLORS = ["white", "black", "navy", "red", "beige", "olive", "grey", "pink"]
+GARMENTS = {
+    "tops": ["shirt", "tee", "blouse", "sweater"],
+    "bottoms": ["jeans", "trousers", "skirt", "shorts"],
+    "dresses": ["slip dress", "maxi dress", "wrap dress"],
+    "outerwear": ["jacket", "coat", "blazer"],
+    "shoes": ["sneakers", "boots", "loafers", "heels"],
+    "accessories": ["belt", "scarf", "tote bag", "watch"],
+}
+
+
+def make_closet(size):
+    """Builds a deterministic closet with `size` items spread over every category."""
+    closet = {category: [] for category in CLOSET_CATEGORIES}
+    for i in range(size):
+        category = CLOSET_CATEGORIES[i % len(CLOSET_CATEGORIES)]
+        garments = GARMENTS[category]
+        name = f"{COLORS[i % len(COLORS)]} {garments[(i // len(CLOSET_CATEGORIES)) % len(garments)]} #{i}"
+        closet[category].append(name)
+    return closet
+
+
+# ---------------------------
+# Firestore
+# ---------------------------
+class FakeSnapshot:
+    def __init__(self, reference, data, field_paths=None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        if data is not None and field_paths is not None:
+            data = {key: value for key, value in data.items() if key in field_paths}
+        # What a field mask leaves of the document, as it would come over the wire
+        self._payload = json.dumps(data) if data is not None else ""
+        self.size = len(self._payload)
+
+    def to_dict(self):
+        return json.loads(self._payload) if self.exists else None
+
+    def get(self, field):
+        return (self.to_dict() or {}).get(field)
+
+
+class FakeDocument:
+    def __init__(self, db, collection, doc_id):
+        self._db = db
+        self.id = doc_id
+        self.key = (collection, doc_id)
+        self.path = f"{collection}/{doc_id}"
+
+    def get(self, field_paths=None, **kwargs):
+        self._db.round_trip()
+        with self._db.lock:
+            snapshot = FakeSnapshot(self, self._db.docs.get(self.key), field_paths)
+            self._db.bytes_read += snapshot.size
+        return snapshot
+
+    def create(self, data):
+        self._db.round_trip()
+        with self._db.lock:
+            if self.key in self._db.docs:
+                raise AlreadyExists(f"Document already exists: {self.path}")
+            self._db.docs[self.key] = json.loads(json.dumps(data))
+
+    def set(self, data, merge=False):
+        self._db.round_trip()
+        self._db.apply_set(self.key, data, merge)
+
+    def update(self, data):
+        self._db.round_trip()
+        self._db.apply_update(self.key, data)
+
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self._db = db
+        self._name = name
+
+    def document(self, doc_id):
+        return FakeDocument(self._db, self._name, doc_id)
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(lambda: self._db.apply_set(reference.key, data, merge))
+
+    def update(self, reference, data):
+        self._writes.append(lambda: self._db.apply_update(reference.key, data))
+
+    def commit(self):
+        self._db.round_trip()
+        for write in self._writes:
+            write()
+
+
+class FakeFirestore:
+    """Dict-backed Firestore client supporting the calls the backend makes."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.docs = {}
+        self.lock = threading.Lock()
+        self.round_trips = 0
+        self.bytes_read = 0
+
+    def round_trip(self):
+        with self.lock:
+            self.round_trips += 1
+        time.sleep(self.latency)
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def get_all(self, references, field_paths=None, **kwargs):
+        references = list(references)
+        self.round_trip()
+        with self.lock:
+            snapshots = [FakeSnapshot(ref, self.docs.get(ref.key), field_paths) for ref in references]
+            self.bytes_read += sum(snapshot.size for snapshot in snapshots)
+        yield from snapshots
+
+    @staticmethod
+    def _apply(doc, data):
+        for field, value in data.items():
+            if isinstance(value, ArrayUnion):
+                current = doc.setdefault(field, [])
+                current.extend(item for item in value.values if item not in current)
+            elif isinstance(value, ArrayRemove):
+                doc[field] = [item for item in doc.get(field, []) if item not in value.values]
+            else:
+                doc[field] = value
+
+    def apply_set(self, key, data, merge):
+        with self.lock:
+            if not merge or key not in self.docs:
+                self.docs[key] = {}
+            self._apply(self.docs[key], data)
+
+    def apply_update(self, key, data):
+        with self.lock:
+            if key not in self.docs:
+                raise NotFound(f"No document to update: {key}")
+            self._apply(self.docs[key], data)
+
+
+# ---------------------------
+# Gemini REST API (gemini_client.session)
+# ---------------------------
+def fake_outfit_text(prompt):
+    if "alternative outfits" in prompt:
+        return ("- Outfit 1: Navy blazer with grey trousers and loafers.\n"
+                "- Outfit 2: Black midi dress with white sneakers.\n"
+                "- Outfit 3: Cream knit sweater with olive chinos and boots.")
+    if "strictly from this closet" in prompt:
+        items = prompt.split("strictly from this closet: ", 1)[1].split(". Occasion", 1)[0].split(", ")
+        picks = " with ".join(items[:3])
+        return f"Wear the {picks}. This combination balances comfort and polish for the occasion."
+    return ("Wear a white linen shirt with black slim jeans, white sneakers and a beige trench coat. "
+            "It is relaxed but put together and follows this season's neutral palette.")
+
+
+class FakeGeminiResponse:
+    def __init__(self, text, stream=False):
+        self.status_code = 200
+        self.headers = {"Content-Type": "application/json"}
+        self._text = text
+        self._stream = stream
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"candidates": [{"content": {"parts": [{"text": self._text}]}}]}
+
+    def iter_lines(self, decode_unicode=False):
+        for word in self._text.split(" "):
+            yield "data: " + json.dumps({"candidates": [{"content": {"parts": [{"text": word + " "}]}}]})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeGeminiSession:
+    """Replaces gemini_client.session; answers generateContent and streamGenerateContent."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.headers = {}
+        self.calls = 0
+
+    def post(self, url, params=None, json=None, stream=False, timeout=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        prompt = json["contents"][0]["parts"][0]["text"]
+        return FakeGeminiResponse(fake_outfit_text(prompt), stream=stream)
+
+
+# ---------------------------
+# ChatGoogleGenerativeAI
+# ---------------------------
+class FakeChatModel(BaseChatModel):
+    """Chat model that drives the trend and product-search agents through one tool call
+    and answers the preference-notes check, sleeping `latency` seconds per call."""
+
+    latency: float = 0.0
+    model: str = "models/fake-gemini"
+    temperature: float = 0.2
+
+    @property
+    def _llm_type(self):
+        return "fake-gemini"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+    def _respond(self, messages):
+        system = next((m.content for m in messages if isinstance(m, SystemMessage)), "")
+        # The product-search prompt renders its scratchpad into the system message as text
+        tool_was_called = any(isinstance(m, ToolMessage) for m in messages) or "ToolMessage(" in system
+        question = messages[-1].content if messages else ""
+
+        if "Trend Analyzer" in system:
+            if not tool_was_called:
+                return AIMessage(content="", tool_calls=[
+                    {"name": "fashion_trend_search", "args": {"__arg1": question}, "id": "call_trends"}
+                ])
+            return AIMessage(content=json.dumps({
+                "trend_topic": question,
+                "current_trends": ["oversized blazer style", "quiet luxury outfit", "denim on denim look"],
+                "insights": "Relaxed tailoring and neutral palettes dominate this season.",
+                "sources": ["https://www.vogue.com/fashion/trends"],
+                "tools_used": ["fashion_trend_search"],
+            }))
+
+        if "Product Search Agent" in system:
+            if not tool_was_called:
+                return AIMessage(content="", tool_calls=[
+                    {"name": "shopping_site_search", "args": {"__arg1": question}, "id": "call_shop"}
+                ])
+            return AIMessage(content=json.dumps({
+                "full_outfit_description": question,
+                "shopping_links": ["https://www.amazon.com/s?k=white+sneakers", "https://www.amazon.com/s?k=black+jeans"],
+            }))
+
+        # Preference-notes check from user_preference_agent
+        return AIMessage(content="MATCH|The outfit already fits your notes.")
+
+
+# ---------------------------
+# DuckDuckGo search and blog pages (used by tools.py)
+# ---------------------------
+def make_fake_ddgs(latency=0.0):
+    class FakeDDGS:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def text(self, query, max_results=10):
+            time.sleep(latency)
+            return [
+                {"body": f"Trending fashion outfit idea {i}: shirt and jeans for {query}",
+                 "href": f"https://www.amazon.com/s?k=item{i}"}
+                for i in range(max_results)
+            ]
+
+    return FakeDDGS
+
+
+def fake_blog_html(anchors=40, filler_paragraphs=400):
+    links = "".join(f'<li><a href="/fashion/story-{i}">Fashion look {i}: what to wear now</a></li>' for i in range(anchors))
+    filler = "".join(f"<p>Paragraph {i} about runway collections and street style.</p>" for i in range(filler_paragraphs))
+    return f"<html><head><title>Fashion</title></head><body><nav><ul>{links}</ul></nav>{filler}</body></html>"
+
+
+FAKE_PAGE_ETAG = '"fake-etag"'
+
+
+class FakePageResponse:
+    def __init__(self, text, status_code=200):
+        self.status_code = status_code
+        self.text = text
+        self.content = text.encode("utf-8")
+        self.headers = {"Content-Type": "text/html", "ETag": FAKE_PAGE_ETAG}
+
+    def raise_for_status(self):
+        pass
+
+
+def make_fake_get(latency=0.0):
+    page = fake_blog_html()
+
+    def fake_get(url, headers=None, timeout=None, **kwargs):
+        time.sleep(latency)
+        # Pages never change, so a revalidation always gets 304 Not Modified
+        if (headers or {}).get("If-None-Match") == FAKE_PAGE_ETAG:
+            return FakePageResponse("", status_code=304)
+        return FakePageResponse(page)
+
+    return fake_get
+
+
+class FakeLinkSession:
+    """Stands in for product_search_agent.link_session: every product page is reachable."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def head(self, url, **kwargs):
+        time.sleep(self.latency)
+        return FakePageResponse("")
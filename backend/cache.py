@@ -0,0 +1,107 @@
+# cache.py
+# Small in-process TTL + LRU cache shared by the agents and routes.
+
+import threading
+import time
+import weakref
+from collections import OrderedDict
+import metrics
+
+_MISSING = object()
+_all_caches = weakref.WeakSet()
+
+
+class TTLCache:
+    """Thread-safe cache whose entries expire after `ttl` seconds, holding at most `maxsize` entries.
+
+    When full, the least recently used entry is evicted. Hit/miss counters are kept
+    so callers can report how well the cache is doing.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, name="cache"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        _all_caches.add(self)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key, default=None):
+        """Like get(), but doesn't count towards the stats or refresh the LRU order."""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[1] > time.monotonic():
+                return entry[0]
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def all_caches():
+    """Every live TTLCache in the process, sorted by name."""
+    return sorted(_all_caches, key=lambda cache: cache.name)
+
+
+def _collect_cache_metrics():
+    stats = [cache.stats() for cache in all_caches()]
+    return [
+        ("stylist_cache_hits_total", "counter", "Cache lookups that found a fresh entry.",
+         [({"cache": s["name"]}, s["hits"]) for s in stats]),
+        ("stylist_cache_misses_total", "counter", "Cache lookups that found nothing or an expired entry.",
+         [({"cache": s["name"]}, s["misses"]) for s in stats]),
+        ("stylist_cache_evictions_total", "counter", "Entries evicted to stay within the size bound.",
+         [({"cache": s["name"]}, s["evictions"]) for s in stats]),
+        ("stylist_cache_entries", "gauge", "Entries currently held by the cache.",
+         [({"cache": s["name"]}, s["size"]) for s in stats]),
+    ]
+
+
+metrics.register_collector(_collect_cache_metrics)
@@ -0,0 +1,189 @@
+# closet_index.py
+# Local, deterministic pre-filter that keeps outfit prompts small for large closets.
+#
+# Closet items are indexed by category, color, formality and season keywords. For a
+# given occasion/style we score every item and pick a bounded, balanced subset (at
+# least one top, bottom, pair of shoes and outer layer when the closet has them),
+# so the Gemini prompt stays roughly the same size however big the closet grows.
+
+import math
+import os
+import re
+
+CLOSET_PROMPT_MAX_ITEMS = int(os.environ.get("CLOSET_PROMPT_MAX_ITEMS", 24))
+
+# Categories every outfit should be able to draw from, in the order they are filled
+CORE_CATEGORIES = ["tops", "bottoms", "dresses", "shoes", "outerwear", "accessories"]
+REQUIRED_CATEGORIES = ["tops", "bottoms", "shoes", "outerwear"]
+
+# Used to place items when the closet comes as a flat list
+CATEGORY_KEYWORDS = {
+    "tops": ["shirt", "tee", "t-shirt", "top", "blouse", "sweater", "jumper", "hoodie", "cardigan", "tank",
+             "camisole", "polo", "turtleneck", "sweatshirt", "crop"],
+    "bottoms": ["jeans", "trousers", "pants", "skirt", "shorts", "chinos", "leggings", "joggers", "culottes"],
+    "dresses": ["dress", "gown", "jumpsuit", "romper", "playsuit"],
+    "outerwear": ["jacket", "coat", "blazer", "parka", "trench", "puffer", "vest", "gilet", "poncho", "windbreaker"],
+    "shoes": ["shoes", "sneakers", "trainers", "boots", "heels", "loafers", "sandals", "flats", "pumps", "oxfords",
+              "mules", "espadrilles", "slippers"],
+    "accessories": ["bag", "belt", "scarf", "hat", "cap", "watch", "necklace", "earrings", "bracelet", "sunglasses",
+                    "tote", "clutch", "tie", "ring"],
+}
+
+COLORS = ["black", "white", "grey", "gray", "navy", "blue", "red", "green", "olive", "khaki", "beige", "cream",
+          "brown", "tan", "camel", "pink", "purple", "lilac", "yellow", "orange", "gold", "silver", "burgundy",
+          "maroon", "denim", "ivory", "teal", "coral", "mint", "nude", "charcoal"]
+
+FORMALITY_KEYWORDS = {
+    "formal": ["blazer", "suit", "tailored", "silk", "satin", "gown", "heels", "pumps", "loafers", "oxfords",
+               "pencil", "tie", "trousers", "blouse", "clutch", "velvet", "cashmere", "pleated", "midi"],
+    "casual": ["tee", "t-shirt", "jeans", "denim", "hoodie", "sneakers", "shorts", "sweatshirt", "joggers", "cap",
+               "flannel", "canvas", "sandals", "tank", "graphic", "cargo"],
+    "sporty": ["leggings", "trainers", "track", "running", "athletic", "sports", "windbreaker", "performance"],
+}
+
+SEASON_KEYWORDS = {
+    "summer": ["linen", "shorts", "sandals", "tank", "sleeveless", "short-sleeve", "espadrilles", "swim",
+               "sundress", "straw", "cotton", "crop"],
+    "winter": ["wool", "knit", "sweater", "boots", "coat", "cashmere", "puffer", "thermal", "fleece", "turtleneck",
+               "scarf", "parka", "corduroy", "velvet"],
+}
+
+# How occasions and styles map to the formality and season they call for
+OCCASION_FORMALITY = {
+    "formal": ["wedding", "interview", "office", "work", "business", "gala", "formal", "meeting", "conference",
+               "ceremony", "funeral", "church", "cocktail", "classic", "elegant", "chic", "minimalist", "preppy"],
+    "casual": ["casual", "brunch", "weekend", "streetwear", "street", "coffee", "shopping", "travel", "picnic",
+               "beach", "festival", "concert", "boho", "grunge", "relaxed"],
+    "sporty": ["gym", "sport", "sporty", "athleisure", "hike", "hiking", "running", "yoga", "workout"],
+}
+OCCASION_SEASON = {
+    "summer": ["summer", "beach", "pool", "tropical", "vacation", "festival", "picnic", "spring", "sunny", "hot"],
+    "winter": ["winter", "ski", "snow", "christmas", "holiday", "autumn", "fall", "cold", "rainy"],
+}
+
+_WORD_RE = re.compile(r"[a-z][a-z\-]*")
+
+
+def _words(text):
+    return set(_WORD_RE.findall(text.lower()))
+
+
+def _matching_labels(words, table):
+    return {label for label, keywords in table.items() if words.intersection(keywords)}
+
+
+def infer_category(item):
+    words = _words(item)
+    # Dresses first: "shirt dress" is a dress, not a top
+    for category in ["dresses", "outerwear", "shoes", "bottoms", "tops", "accessories"]:
+        if words.intersection(CATEGORY_KEYWORDS[category]):
+            return category
+    return "accessories"
+
+
+class ClosetIndex:
+    """Closet items indexed by category, color, formality and season."""
+
+    def __init__(self, closet):
+        self.items = []
+        self.by_category = {}
+        self.by_color = {}
+        self.by_formality = {}
+        self.by_season = {}
+
+        if isinstance(closet, dict):
+            entries = [(category, item) for category, items in closet.items() if isinstance(items, list)
+                       for item in items]
+        else:
+            entries = [(infer_category(item), item) for item in closet]
+
+        for position, (category, item) in enumerate(entries):
+            if not isinstance(item, str) or not item.strip():
+                continue
+            words = _words(item)
+            entry = {
+                "position": position,
+                "name": item,
+                "category": category,
+                "words": words,
+                "colors": words.intersection(COLORS),
+                "formality": _matching_labels(words, FORMALITY_KEYWORDS),
+                "seasons": _matching_labels(words, SEASON_KEYWORDS),
+            }
+            self.items.append(entry)
+            self.by_category.setdefault(category, []).append(entry)
+            for color in entry["colors"]:
+                self.by_color.setdefault(color, []).append(entry)
+            for label in entry["formality"]:
+                self.by_formality.setdefault(label, []).append(entry)
+            for season in entry["seasons"]:
+                self.by_season.setdefault(season, []).append(entry)
+
+    def __len__(self):
+        return len(self.items)
+
+    def select(self, occasion, style, limit=None, disliked_outfit=None):
+        """Returns at most `limit` item names that best fit the occasion/style, balanced across categories."""
+        limit = limit or CLOSET_PROMPT_MAX_ITEMS
+        if len(self.items) <= limit:
+            return [entry["name"] for entry in self.items]
+
+        query_words = _words(f"{occasion} {style}")
+        wanted_formality = _matching_labels(query_words, OCCASION_FORMALITY)
+        wanted_seasons = _matching_labels(query_words, OCCASION_SEASON)
+        wanted_colors = query_words.intersection(COLORS)
+        disliked_words = _words(disliked_outfit or "")
+
+        scores = {}
+        for entry in self.items:
+            score = 0.0
+            score += 2.0 * len(entry["formality"] & wanted_formality)
+            score -= 1.0 * len(entry["formality"] - wanted_formality) if wanted_formality else 0.0
+            score += 1.5 * len(entry["seasons"] & wanted_seasons)
+            score -= 1.0 * len(entry["seasons"] - wanted_seasons) if wanted_seasons else 0.0
+            score += 1.5 * len(entry["colors"] & wanted_colors)
+            score += 0.5 * len(entry["words"] & query_words)
+            if disliked_outfit and entry["name"].lower() in disliked_outfit.lower():
+                score -= 5.0
+            elif disliked_words:
+                score -= 0.25 * len(entry["words"] & disliked_words - set(COLORS))
+            scores[entry["position"]] = score
+
+        # Best items first within each category; ties keep closet order so the result is deterministic
+        ranked = {
+            category: sorted(entries, key=lambda e: (-scores[e["position"]], e["position"]))
+            for category, entries in self.by_category.items()
+        }
+        categories = [c for c in CORE_CATEGORIES if c in ranked] + sorted(c for c in ranked if c not in CORE_CATEGORIES)
+
+        selected = []
+        taken = {category: 0 for category in categories}
+
+        def take(category):
+            entries = ranked[category]
+            if taken[category] < len(entries) and len(selected) < limit:
+                selected.append(entries[taken[category]])
+                taken[category] += 1
+
+        # One of each essential first, then fill round-robin so no category crowds out the rest
+        for category in REQUIRED_CATEGORIES:
+            if category in ranked:
+                take(category)
+        per_category = math.ceil(limit / len(categories))
+        while len(selected) < limit:
+            before = len(selected)
+            for category in categories:
+                if taken[category] < per_category:
+                    take(category)
+            if len(selected) == before:
+                per_category += 1
+                if all(taken[c] >= len(ranked[c]) for c in categories):
+                    break
+
+        # Keep the closet's own order in the prompt
+        return [entry["name"] for entry in sorted(selected, key=lambda e: e["position"])]
+
+
+def select_closet_candidates(closet, occasion, style, limit=None, disliked_outfit=None):
+    """Shortcut for ClosetIndex(closet).select(...)."""
+    return ClosetIndex(closet).select(occasion, style, limit=limit, disliked_outfit=disliked_outfit)
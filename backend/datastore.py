@@ -0,0 +1,246 @@
+# datastore.py
+# Firestore reads and writes for closets (closets/{uid}) and profiles (users/{uid}).
+#
+# Routes used to download whole documents one at a time: a category page fetched the
+# entire closet to show one array, and generating an outfit read the closet and the
+# profile in two round trips. Reads here ask only for the fields they use (a field
+# mask), fetch the closet and the profile together in one get_all() call, and go
+# through per-process TTL caches. Writes from this process update or drop the cached
+# copies; the TTL bounds how stale another process's copy can get.
+
+import json
+import os
+import threading
+
+from cache import TTLCache
+from closet_index import CORE_CATEGORIES
+from metrics import FIRESTORE_READS, STAGE_SECONDS
+
+CLOSET_CACHE_TTL = int(os.environ.get("CLOSET_CACHE_TTL", 300))
+PREFERENCES_CACHE_TTL = int(os.environ.get("PREFERENCES_CACHE_TTL", 300))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10000))
+
+# The fields a closet read asks for; items can only be added to these categories
+CLOSET_FIELDS = list(CORE_CATEGORIES)
+
+closet_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=CLOSET_CACHE_TTL, name="closet")
+# Single categories read by the closet pages when the full closet isn't cached, keyed (uid, category)
+category_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=CLOSET_CACHE_TTL, name="closet_category")
+preferences_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=PREFERENCES_CACHE_TTL, name="preferences")
+_closet_write_lock = threading.Lock()
+
+# firebase_admin and the Firestore client (gRPC, protobuf) are a large part of startup,
+# so they are loaded by the first request that needs them.
+_db = None
+_db_lock = threading.Lock()
+
+
+def get_db():
+    """Returns the Firestore client, initializing Firebase on first use."""
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                import firebase_admin
+                from firebase_admin import credentials, firestore
+
+                cred = credentials.Certificate(json.loads(os.environ["FIREBASE_SERVICE_ACCOUNT_JSON"]))
+                try:
+                    app_firebase = firebase_admin.initialize_app(cred)
+                except ValueError:
+                    app_firebase = firebase_admin.get_app()
+                _db = firestore.client(app=app_firebase)
+    return _db
+
+
+def closet_ref(uid):
+    return get_db().collection("closets").document(uid)
+
+
+def profile_ref(uid):
+    return get_db().collection("users").document(uid)
+
+
+# ---------------------------
+# Reads
+# ---------------------------
+def _snapshot_dict(snapshot):
+    if snapshot is None or not snapshot.exists:
+        return {}
+    return snapshot.to_dict() or {}
+
+
+def _copy_closet(closet_data):
+    # Lists are copied so callers can't modify the cached closet
+    return {cat: list(items) if isinstance(items, list) else items for cat, items in closet_data.items()}
+
+
+def _read_closet(uid):
+    with STAGE_SECONDS.time(stage="firestore_closet_read"):
+        snapshot = closet_ref(uid).get(field_paths=CLOSET_FIELDS)
+    FIRESTORE_READS.inc(kind="projected")
+    closet_data = _snapshot_dict(snapshot)
+    closet_cache.set(uid, closet_data)
+    return closet_data
+
+
+def _read_preferences(uid):
+    with STAGE_SECONDS.time(stage="firestore_preferences_read"):
+        snapshot = profile_ref(uid).get(field_paths=["preferences"])
+    FIRESTORE_READS.inc(kind="projected")
+    preferences = _snapshot_dict(snapshot).get("preferences", {})
+    preferences_cache.set(uid, preferences)
+    return preferences
+
+
+def get_closet(uid):
+    """The user's closet as {category: [items]}."""
+    closet_data = closet_cache.get(uid)
+    if closet_data is None:
+        closet_data = _read_closet(uid)
+    return _copy_closet(closet_data)
+
+
+def get_closet_category(uid, category):
+    """The items of one category, reading only that array when the closet isn't cached."""
+    closet_data = closet_cache.peek(uid)
+    if closet_data is not None:
+        return list(closet_data.get(category, []))
+    items = category_cache.get((uid, category))
+    if items is None:
+        with STAGE_SECONDS.time(stage="firestore_category_read"):
+            snapshot = closet_ref(uid).get(field_paths=[category])
+        FIRESTORE_READS.inc(kind="projected")
+        items = _snapshot_dict(snapshot).get(category, [])
+        category_cache.set((uid, category), items)
+    return list(items)
+
+
+def get_preferences(uid):
+    """The preferences saved in the user's profile."""
+    preferences = preferences_cache.get(uid)
+    if preferences is None:
+        preferences = _read_preferences(uid)
+    return dict(preferences)
+
+
+def get_closet_and_preferences(uid):
+    """(closet, preferences) for the user; whatever isn't cached is read in one round trip."""
+    closet_data = closet_cache.get(uid)
+    preferences = preferences_cache.get(uid)
+    if closet_data is None and preferences is None:
+        closet, profile = closet_ref(uid), profile_ref(uid)
+        with STAGE_SECONDS.time(stage="firestore_user_read"):
+            # get_all takes one field mask for every document: the categories and the preferences
+            snapshots = {
+                snapshot.reference.path: snapshot
+                for snapshot in get_db().get_all([closet, profile], field_paths=CLOSET_FIELDS + ["preferences"])
+            }
+        FIRESTORE_READS.inc(kind="batched")
+        closet_data = _snapshot_dict(snapshots.get(closet.path))
+        preferences = _snapshot_dict(snapshots.get(profile.path)).get("preferences", {})
+        closet_cache.set(uid, closet_data)
+        preferences_cache.set(uid, preferences)
+    elif closet_data is None:
+        closet_data = _read_closet(uid)
+    elif preferences is None:
+        preferences = _read_preferences(uid)
+    return _copy_closet(closet_data), dict(preferences)
+
+
+def has_cached_item(uid, category, item):
+    """True if a cached copy of the closet already holds `item`; never reads Firestore."""
+    closet_data = closet_cache.peek(uid)
+    items = closet_data.get(category, []) if closet_data is not None else category_cache.peek((uid, category), [])
+    return item in items
+
+
+def find_item(uid, category, item):
+    """True if the closet holds `item` in `category`, False if not, None if the user has no
+    closet. A cached copy that has the item answers; otherwise only that array is read,
+    so a stale cache can't turn into a wrong "not found"."""
+    if has_cached_item(uid, category, item):
+        return True
+    with STAGE_SECONDS.time(stage="firestore_category_read"):
+        snapshot = closet_ref(uid).get(field_paths=[category])
+    FIRESTORE_READS.inc(kind="projected")
+    if not snapshot.exists:
+        return None
+    items = _snapshot_dict(snapshot).get(category, [])
+    category_cache.set((uid, category), items)
+    return item in items
+
+
+# ---------------------------
+# Writes
+# ---------------------------
+def create_closet(uid, categories):
+    """Creates an empty closet for a new user in one write; returns False if it already exists."""
+    from google.api_core.exceptions import AlreadyExists
+    try:
+        closet_ref(uid).create({cat: [] for cat in categories})
+    except AlreadyExists:
+        return False
+    return True
+
+
+def update_cached_closet(uid, to_add=None, to_remove=None):
+    """Applies a write we just made to the cached closet, mirroring ArrayUnion/ArrayRemove."""
+
+    def apply(items, category):
+        items = list(items)
+        items.extend(item for item in (to_add or {}).get(category, []) if item not in items)
+        removed = (to_remove or {}).get(category, [])
+        return [item for item in items if item not in removed]
+
+    categories = set(to_add or {}) | set(to_remove or {})
+    with _closet_write_lock:
+        closet_data = closet_cache.peek(uid)
+        if closet_data is not None:
+            updated = dict(closet_data)
+            for category in categories:
+                updated[category] = apply(updated.get(category, []), category)
+            closet_cache.set(uid, updated)
+        for category in categories:
+            items = category_cache.peek((uid, category))
+            if items is not None:
+                category_cache.set((uid, category), apply(items, category))
+
+
+def add_items(uid, to_add):
+    """Adds {category: [items]} with ArrayUnion, which appends server-side in a single
+    round trip (and ignores duplicates), so concurrent edits can't overwrite each other."""
+    from firebase_admin import firestore
+    closet_ref(uid).set({cat: firestore.ArrayUnion(items) for cat, items in to_add.items()}, merge=True)
+    update_cached_closet(uid, to_add=to_add)
+
+
+def remove_items(uid, to_remove):
+    """Removes {category: [items]} with ArrayRemove; returns False if the closet doesn't exist."""
+    from firebase_admin import firestore
+    from google.api_core.exceptions import NotFound
+    try:
+        closet_ref(uid).update({cat: firestore.ArrayRemove(items) for cat, items in to_remove.items()})
+    except NotFound:
+        return False
+    update_cached_closet(uid, to_remove=to_remove)
+    return True
+
+
+def update_closet(uid, to_add, to_remove):
+    """Applies additions, then removals, in one batched, atomic write."""
+    from firebase_admin import firestore
+    ref = closet_ref(uid)
+    batch = get_db().batch()
+    if to_add:
+        batch.set(ref, {cat: firestore.ArrayUnion(items) for cat, items in to_add.items()}, merge=True)
+    if to_remove:
+        batch.set(ref, {cat: firestore.ArrayRemove(items) for cat, items in to_remove.items()}, merge=True)
+    batch.commit()
+    update_cached_closet(uid, to_add=to_add, to_remove=to_remove)
+
+
+def save_preferences(uid, preferences):
+    profile_ref(uid).set({"preferences": preferences}, merge=True)
+    # A merged write can keep fields we didn't send, so re-read on next access
+    preferences_cache.invalidate(uid)
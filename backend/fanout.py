@@ -0,0 +1,120 @@
+# fanout.py
+# Runs independent blocking calls (web searches, page fetches) concurrently so a
+# step takes as long as its slowest source instead of the sum of all of them.
+# fan_out_async() does the same for coroutines in the async app.
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from metrics import FANOUT_SECONDS
+
+FANOUT_MAX_WORKERS = int(os.environ.get("FANOUT_MAX_WORKERS", 8))
+FANOUT_SOURCE_TIMEOUT = float(os.environ.get("FANOUT_SOURCE_TIMEOUT", 10))
+# Threads shared by all fan-outs at one nesting level
+FANOUT_POOL_SIZE = int(os.environ.get("FANOUT_POOL_SIZE", 32))
+
+# One bounded pool per nesting level, so a fan-out started from inside a fan-out
+# (a tool that fans out over URLs inside a fan-out over tools) never waits for
+# workers held by its own parent.
+_pools = []
+_pools_lock = threading.Lock()
+_local = threading.local()
+
+
+def _pool(depth):
+    with _pools_lock:
+        while len(_pools) <= depth:
+            _pools.append(ThreadPoolExecutor(max_workers=FANOUT_POOL_SIZE,
+                                             thread_name_prefix=f"fanout-{len(_pools)}"))
+        return _pools[depth]
+
+
+def _at_depth(fn, depth):
+    def run():
+        _local.depth = depth
+        return fn()
+    return run
+
+
+def fan_out(calls, max_workers=None, timeout=None):
+    """Runs the named zero-argument callables concurrently and returns what finished in time.
+
+    `calls` maps a source name to a callable. The result maps each source name to its
+    return value. Sources that raise or miss the deadline are left out, so callers get
+    partial results instead of waiting on (or failing because of) a single slow source.
+    At most `max_workers` of them run at once.
+    """
+    if not calls:
+        return {}
+
+    max_workers = min(len(calls), max_workers or FANOUT_MAX_WORKERS)
+    timeout = FANOUT_SOURCE_TIMEOUT if timeout is None else timeout
+    depth = getattr(_local, "depth", -1) + 1
+    executor = _pool(depth)
+
+    started = time.perf_counter()
+    pending = list(calls.items())
+    futures = {}
+    running = set()
+    try:
+        while True:
+            while pending and len(running) < max_workers:
+                name, fn = pending.pop(0)
+                future = executor.submit(_at_depth(fn, depth))
+                futures[future] = name
+                running.add(future)
+            remaining = timeout - (time.perf_counter() - started)
+            if not running or remaining <= 0:
+                break
+            _, running = wait(running, timeout=remaining, return_when=FIRST_COMPLETED)
+
+        results = {}
+        for future, name in futures.items():
+            if future in running:
+                continue
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                print(f"Source '{name}' failed: {e}")
+        for future in running:
+            print(f"Source '{futures[future]}' missed the {timeout:.1f}s deadline, skipping it.")
+        for name, _ in pending:
+            print(f"Source '{name}' wasn't started before the {timeout:.1f}s deadline, skipping it.")
+        return results
+    finally:
+        # Late sources keep running in the background; we just stop waiting for them.
+        for future in running:
+            future.cancel()
+        FANOUT_SECONDS.observe(time.perf_counter() - started, mode="thread")
+
+
+async def fan_out_async(calls, timeout=None):
+    """Async fan_out(): `calls` maps a source name to a zero-argument coroutine function.
+
+    Sources that raise or miss the deadline are left out; late ones are cancelled.
+    """
+    if not calls:
+        return {}
+
+    timeout = FANOUT_SOURCE_TIMEOUT if timeout is None else timeout
+    started = time.perf_counter()
+    tasks = {asyncio.ensure_future(fn()): name for name, fn in calls.items()}
+    try:
+        done, late = await asyncio.wait(tasks, timeout=timeout)
+
+        results = {}
+        for task in done:
+            name = tasks[task]
+            try:
+                results[name] = task.result()
+            except Exception as e:
+                print(f"Source '{name}' failed: {e}")
+        for task in late:
+            print(f"Source '{tasks[task]}' missed the {timeout:.1f}s deadline, skipping it.")
+        return results
+    finally:
+        for task in tasks:
+            task.cancel()
+        FANOUT_SECONDS.observe(time.perf_counter() - started, mode="async")
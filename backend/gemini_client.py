@@ -0,0 +1,404 @@
+# gemini_client.py
+# Shared HTTP client for the Gemini REST API.
+#
+# All Gemini REST calls go through one pooled requests.Session, so connections (and
+# their TLS handshakes) are reused across calls. Every call has connect/read timeouts
+# so a hung upstream can't block a worker forever, and per-model latency is recorded
+# in the stylist_gemini_request_seconds histogram.
+#
+# generate_content_with_retries() retries transient failures (timeouts, connection
+# errors, 429 and 5xx) with jittered backoff, honors Retry-After and never sleeps past
+# the caller's deadline. Callers that make several calls for one request (a closet
+# attempt and its general fallback) share one deadline from new_deadline(), so retries
+# can't add up past the request's budget. A circuit breaker shared by every call fails fast while Gemini
+# keeps failing, so a degraded upstream can't tie up all the workers.
+#
+# agenerate_content() and agenerate_content_with_retries() are the asyncio versions
+# used by async_app.py; they go through a pooled httpx.AsyncClient and raise the same
+# requests exceptions, so error handling and the breaker are shared with the sync path.
+
+import os
+import asyncio
+import json
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+import metrics
+from metrics import GEMINI_REQUEST_SECONDS, GEMINI_ERRORS, GEMINI_RETRIES, GEMINI_CIRCUIT_REJECTIONS
+
+load_dotenv()
+
+GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta/models"
+GEMINI_CONNECT_TIMEOUT = float(os.environ.get("GEMINI_CONNECT_TIMEOUT", 5))
+GEMINI_READ_TIMEOUT = float(os.environ.get("GEMINI_READ_TIMEOUT", 60))
+GEMINI_POOL_SIZE = int(os.environ.get("GEMINI_POOL_SIZE", 32))
+
+# Retry policy
+GEMINI_MAX_ATTEMPTS = int(os.environ.get("GEMINI_MAX_ATTEMPTS", 4))
+GEMINI_RETRY_BASE_DELAY = float(os.environ.get("GEMINI_RETRY_BASE_DELAY", 0.5))
+GEMINI_RETRY_MAX_DELAY = float(os.environ.get("GEMINI_RETRY_MAX_DELAY", 8))
+# Seconds a request may spend on Gemini, across all its calls and retries
+GEMINI_CALL_DEADLINE = float(os.environ.get("GEMINI_CALL_DEADLINE", 25))
+# An attempt isn't started (or retried) with less time than this left before the deadline
+GEMINI_MIN_ATTEMPT_SECONDS = float(os.environ.get("GEMINI_MIN_ATTEMPT_SECONDS", 2))
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Circuit breaker
+GEMINI_BREAKER_FAILURES = int(os.environ.get("GEMINI_BREAKER_FAILURES", 5))
+GEMINI_BREAKER_RESET_TIMEOUT = float(os.environ.get("GEMINI_BREAKER_RESET_TIMEOUT", 30))
+
+session = requests.Session()
+session.headers.update({"Content-Type": "application/json"})
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=GEMINI_POOL_SIZE))
+
+# Created on first use, inside the async app's event loop
+async_session = None
+
+
+def get_async_session():
+    global async_session
+    if async_session is None:
+        async_session = httpx.AsyncClient(
+            headers={"Content-Type": "application/json"},
+            timeout=httpx.Timeout(GEMINI_READ_TIMEOUT, connect=GEMINI_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=GEMINI_POOL_SIZE * 4, max_keepalive_connections=GEMINI_POOL_SIZE),
+        )
+    return async_session
+
+
+async def aclose():
+    """Closes the async session (on async app shutdown)."""
+    global async_session
+    if async_session is not None:
+        await async_session.aclose()
+        async_session = None
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised without calling Gemini while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive upstream failures and rejects calls
+    for `reset_timeout` seconds; then lets a single probe call through (half-open) and
+    closes again if it succeeds."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=GEMINI_BREAKER_FAILURES, reset_timeout=GEMINI_BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print(f"Circuit breaker '{self.name}' closed again.")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"Circuit breaker '{self.name}' opened after {self.failures} failures.")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def release(self):
+        """Frees the half-open probe slot of a call that ended without an outcome
+        (cancelled), so the next call can probe; counts neither way."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def retry_in(self):
+        """Seconds until the next probe is allowed (0 unless open)."""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+
+breaker = CircuitBreaker("gemini")
+
+
+def _collect_breaker_metrics():
+    states = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+    return [
+        ("stylist_gemini_circuit_state", "gauge", "Gemini circuit breaker state (0 closed, 1 half-open, 2 open).",
+         [({"breaker": breaker.name}, states[breaker.state])]),
+    ]
+
+
+metrics.register_collector(_collect_breaker_metrics)
+
+
+def is_retryable(error):
+    """Timeouts, connection errors, 429 and 5xx responses are worth another attempt."""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return True
+    response = getattr(error, "response", None)
+    return response is not None and response.status_code in RETRYABLE_STATUS_CODES
+
+
+def retry_after_seconds(error):
+    """Returns the server's Retry-After hint in seconds, or None."""
+    response = getattr(error, "response", None)
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _acquire(model_name):
+    if not breaker.allow():
+        GEMINI_CIRCUIT_REJECTIONS.inc(model=model_name)
+        raise CircuitOpenError(f"Gemini circuit is open; retry in {breaker.retry_in():.0f}s")
+
+
+def _settle(error):
+    """Feeds the outcome of a call to the breaker. Client errors such as a 400 for a bad
+    prompt say nothing about upstream health, so they don't count as failures."""
+    if error is None or not is_retryable(error):
+        breaker.record_success()
+    else:
+        breaker.record_failure()
+
+
+def _record(model_name, seconds, ok, outcome=None):
+    GEMINI_REQUEST_SECONDS.observe(seconds, model=model_name, outcome=outcome or ("ok" if ok else "error"))
+    if not ok and outcome is None:
+        GEMINI_ERRORS.inc(model=model_name)
+
+
+def _payload(prompt):
+    return {"contents": [{"parts": [{"text": prompt}]}]}
+
+
+def extract_text(data):
+    """Returns the text of the first candidate, or None when Gemini returned no candidates."""
+    candidates = (data or {}).get("candidates") or []
+    if not candidates:
+        return None
+    parts = candidates[0].get("content", {}).get("parts", [])
+    return "".join(part.get("text", "") for part in parts) or None
+
+
+def generate_content(prompt, model_name="gemma-3-4b-it", api_key=None, read_timeout=None):
+    """Calls generateContent once and returns the decoded JSON body.
+
+    Raises requests.exceptions.RequestException on network errors, timeouts and
+    non-2xx responses (CircuitOpenError while the breaker is open); use
+    generate_content_with_retries() for retries.
+    """
+    _acquire(model_name)
+    api_url = f"{GEMINI_API_BASE}/{model_name}:generateContent"
+    started = time.perf_counter()
+    error = None
+    try:
+        response = session.post(
+            api_url,
+            params={"key": api_key or GEMINI_API_KEY},
+            json=_payload(prompt),
+            timeout=(GEMINI_CONNECT_TIMEOUT, read_timeout or GEMINI_READ_TIMEOUT),
+        )
+        response.raise_for_status()
+        return response.json()
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        _settle(error)
+        _record(model_name, time.perf_counter() - started, error is None)
+
+
+def _as_requests_error(error):
+    """Translates httpx errors into the requests exceptions the rest of the backend handles."""
+    if isinstance(error, httpx.TimeoutException):
+        return requests.exceptions.Timeout(str(error))
+    if isinstance(error, httpx.HTTPStatusError):
+        # httpx.Response has status_code and headers, which is all is_retryable() needs
+        return requests.exceptions.HTTPError(str(error), response=error.response)
+    return requests.exceptions.ConnectionError(str(error))
+
+
+async def agenerate_content(prompt, model_name="gemma-3-4b-it", api_key=None, read_timeout=None):
+    """Async generate_content()."""
+    _acquire(model_name)
+    api_url = f"{GEMINI_API_BASE}/{model_name}:generateContent"
+    started = time.perf_counter()
+    error = None
+    cancelled = False
+    try:
+        try:
+            response = await get_async_session().post(
+                api_url,
+                params={"key": api_key or GEMINI_API_KEY},
+                json=_payload(prompt),
+                timeout=httpx.Timeout(read_timeout or GEMINI_READ_TIMEOUT, connect=GEMINI_CONNECT_TIMEOUT),
+            )
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            raise _as_requests_error(e) from e
+    except BaseException as e:
+        # CancelledError (the caller gave up: deadline, disconnect) and other BaseExceptions
+        # say nothing about Gemini's health: the probe slot is freed without counting either way
+        if isinstance(e, Exception):
+            error = e
+        else:
+            cancelled = True
+        raise
+    finally:
+        if cancelled:
+            breaker.release()
+            _record(model_name, time.perf_counter() - started, False, outcome="cancelled")
+        else:
+            _settle(error)
+            _record(model_name, time.perf_counter() - started, error is None)
+
+
+def new_deadline(seconds=None):
+    """A deadline GEMINI_CALL_DEADLINE (or `seconds`) from now, to share between the calls of one request."""
+    return time.monotonic() + (GEMINI_CALL_DEADLINE if seconds is None else seconds)
+
+
+def _check_time_left(deadline, model_name):
+    """Raises Timeout when there is not enough time left before the deadline for another attempt."""
+    if deadline - time.monotonic() < GEMINI_MIN_ATTEMPT_SECONDS:
+        print(f"Not calling {model_name}: no time left before the deadline.")
+        raise requests.exceptions.Timeout("No time left before the deadline for another Gemini call")
+
+
+def _retry_delay(error, attempt, deadline, model_name):
+    """Returns how long to back off before the next attempt, or None when the error
+    should be raised (not retryable, out of attempts, or past the deadline)."""
+    if not is_retryable(error) or attempt >= GEMINI_MAX_ATTEMPTS:
+        return None
+    delay = random.uniform(0, min(GEMINI_RETRY_MAX_DELAY, GEMINI_RETRY_BASE_DELAY * 2 ** attempt))
+    server_delay = retry_after_seconds(error)
+    if server_delay is not None:
+        delay = max(delay, server_delay)
+    if time.monotonic() + delay + GEMINI_MIN_ATTEMPT_SECONDS > deadline:
+        print(f"Gemini call failed ({error}); no time left before the deadline to retry.")
+        return None
+    GEMINI_RETRIES.inc(model=model_name)
+    print(f"Gemini call failed ({error}); retrying in {delay:.2f} seconds...")
+    return delay
+
+
+def generate_content_with_retries(prompt, model_name="gemma-3-4b-it", api_key=None, deadline=None):
+    """generate_content() with retries on transient failures.
+
+    `deadline` is a time.monotonic() timestamp (default: new_deadline()), usually
+    shared by every call of a request. Backoff is exponential with full jitter, at least
+    as long as any Retry-After the server sent; when less than GEMINI_MIN_ATTEMPT_SECONDS
+    would be left for the next attempt, the last error is raised instead of sleeping,
+    and a call that starts with less than that left raises Timeout right away.
+    """
+    if deadline is None:
+        deadline = new_deadline()
+
+    attempt = 0
+    while True:
+        attempt += 1
+        _check_time_left(deadline, model_name)
+        remaining = deadline - time.monotonic()
+        try:
+            return generate_content(prompt, model_name, api_key=api_key,
+                                    read_timeout=max(1.0, min(GEMINI_READ_TIMEOUT, remaining)))
+        except requests.exceptions.RequestException as e:
+            delay = _retry_delay(e, attempt, deadline, model_name)
+            if delay is None:
+                raise
+            time.sleep(delay)
+
+
+async def agenerate_content_with_retries(prompt, model_name="gemma-3-4b-it", api_key=None, deadline=None):
+    """Async generate_content_with_retries(); backs off with asyncio.sleep."""
+    if deadline is None:
+        deadline = new_deadline()
+
+    attempt = 0
+    while True:
+        attempt += 1
+        _check_time_left(deadline, model_name)
+        remaining = deadline - time.monotonic()
+        try:
+            return await agenerate_content(prompt, model_name, api_key=api_key,
+                                           read_timeout=max(1.0, min(GEMINI_READ_TIMEOUT, remaining)))
+        except requests.exceptions.RequestException as e:
+            delay = _retry_delay(e, attempt, deadline, model_name)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+
+
+def stream_generate_content(prompt, model_name="gemma-3-4b-it", api_key=None):
+    """Calls streamGenerateContent and yields the text chunks as they arrive.
+
+    The read timeout applies to the gap between chunks, not to the whole response.
+    """
+    _acquire(model_name)
+    api_url = f"{GEMINI_API_BASE}/{model_name}:streamGenerateContent"
+    started = time.perf_counter()
+    error = None
+    try:
+        with session.post(
+            api_url,
+            params={"key": api_key or GEMINI_API_KEY, "alt": "sse"},
+            json=_payload(prompt),
+            stream=True,
+            timeout=(GEMINI_CONNECT_TIMEOUT, GEMINI_READ_TIMEOUT),
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                text = extract_text(json.loads(line[len("data:"):]))
+                if text:
+                    yield text
+    except GeneratorExit:
+        # The caller stopped reading early (e.g. it saw enough); that's not a failure.
+        raise
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        _settle(error)
+        _record(model_name, time.perf_counter() - started, error is None)
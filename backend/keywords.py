@@ -0,0 +1,89 @@
+# keywords.py
+# Shared keyword lists and a compiled matcher for the result filters.
+#
+# Every filter used to lowercase the text once per keyword and keep its own copy of
+# the word lists. A KeywordMatcher is built once per list and lowercases each text
+# once. How it matches depends on the mode, picking whatever measured fastest on
+# CPython (see benchmarks/bench_keywords.py):
+#   - substring (the default, as the filters always did): one C-level `in` scan per
+#     keyword, which beats a combined regex for lists of this size;
+#   - whole word, single-word keywords: one tokenizing pass, then a set lookup;
+#   - whole word, phrases: one combined \b(...)\b regex.
+
+import re
+
+# Trend search results, blog anchors and trend sources
+FASHION_KEYWORDS = ["fashion", "style", "outfit", "ootd", "clothing", "look"]
+# Trends returned by the trend agent may also just say what to "wear"
+TREND_KEYWORDS = FASHION_KEYWORDS + ["wear"]
+# Shopping results that mention a garment
+PRODUCT_KEYWORDS = ["shirt", "top", "dress", "jeans", "trousers", "jacket", "coat", "skirt", "sweater"]
+# Preference rules
+BRIGHT_COLORS = ["white", "bright", "coral"]
+DEEP_SKIN_TONES = ["tan", "dark", "olive"]
+
+_TOKEN_RE = re.compile(r"[\w'-]+")
+
+
+class KeywordMatcher:
+    """Matches a text against a fixed keyword list in one pass.
+
+    whole_word=False matches keywords anywhere in the text ("look" matches "lookbook");
+    whole_word=True only matches complete words or phrases. Matching ignores case
+    unless ignore_case=False.
+    """
+
+    def __init__(self, keywords, whole_word=False, ignore_case=True):
+        self.ignore_case = ignore_case
+        self.whole_word = whole_word
+        # Longest first, so a phrase wins over a keyword it contains
+        self.keywords = sorted({k.lower() if ignore_case else k for k in keywords}, key=len, reverse=True)
+        self._words = None
+        self._regex = None
+        if whole_word:
+            if all(_TOKEN_RE.fullmatch(k) for k in self.keywords):
+                self._words = frozenset(self.keywords)
+            else:
+                self._regex = re.compile(r"(?<![\w'-])(?:" + "|".join(map(re.escape, self.keywords)) + r")(?![\w'-])")
+
+    def _prepare(self, text):
+        return text.lower() if self.ignore_case else text
+
+    def search(self, text):
+        """True if any keyword occurs in `text`."""
+        if not text:
+            return False
+        text = self._prepare(text)
+        if self._words is not None:
+            return not self._words.isdisjoint(_TOKEN_RE.findall(text))
+        if self._regex is not None:
+            return self._regex.search(text) is not None
+        return any(keyword in text for keyword in self.keywords)
+
+    __call__ = search
+
+    def find_all(self, text):
+        """The keywords that occur in `text`, in keyword order (longest first)."""
+        if not text:
+            return []
+        text = self._prepare(text)
+        if self._words is not None:
+            found = self._words.intersection(_TOKEN_RE.findall(text))
+        elif self._regex is not None:
+            found = set(self._regex.findall(text))
+        else:
+            return [keyword for keyword in self.keywords if keyword in text]
+        return [keyword for keyword in self.keywords if keyword in found]
+
+    def filter(self, items, key=None):
+        """The items whose text (or key(item)) matches, in their original order."""
+        if key is None:
+            return [item for item in items if self.search(item)]
+        return [item for item in items if self.search(key(item))]
+
+
+fashion_matcher = KeywordMatcher(FASHION_KEYWORDS)
+trend_matcher = KeywordMatcher(TREND_KEYWORDS)
+product_matcher = KeywordMatcher(PRODUCT_KEYWORDS)
+bright_color_matcher = KeywordMatcher(BRIGHT_COLORS)
+deep_skin_tone_matcher = KeywordMatcher(DEEP_SKIN_TONES)
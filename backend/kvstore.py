@@ -0,0 +1,114 @@
+# kvstore.py
+# Small persistent key-value store on SQLite for data that should survive restarts
+# and be shared by every worker process on the machine (trend snapshots, caches).
+#
+# Each store is a table in a database file under STYLIST_DATA_DIR. Values are stored
+# as JSON along with when they were written and, optionally, when they expire.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+STYLIST_DATA_DIR = os.environ.get(
+    "STYLIST_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+)
+
+
+class KVStore:
+    """A JSON key-value table in a SQLite file; safe to use from many threads and processes."""
+
+    def __init__(self, name, filename="stylist.db"):
+        self.name = name
+        self.path = os.path.join(STYLIST_DATA_DIR, filename)
+        self._local = threading.local()
+        os.makedirs(STYLIST_DATA_DIR, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.name} ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " updated_at REAL NOT NULL, expires_at REAL)"
+            )
+
+    def _connect(self):
+        # One connection per thread; WAL lets readers and a writer work at the same time.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_entry(self, key):
+        """Returns {"value", "updated_at", "expires_at"} for `key`, or None. Expired entries are returned too."""
+        row = self._connect().execute(
+            f"SELECT value, updated_at, expires_at FROM {self.name} WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"value": json.loads(row[0]), "updated_at": row[1], "expires_at": row[2]}
+
+    def get(self, key, default=None):
+        """Returns the value for `key` unless it is missing or expired."""
+        entry = self.get_entry(key)
+        if entry is None or (entry["expires_at"] is not None and entry["expires_at"] <= time.time()):
+            return default
+        return entry["value"]
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.name} (key, value, updated_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now + ttl if ttl is not None else None),
+            )
+
+    def add(self, key, value, ttl):
+        """Writes `key` only if it is missing or expired, atomically across processes.
+        Returns True if this call wrote it (e.g. took a lease), False if a live entry exists."""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"INSERT INTO {self.name} (key, value, updated_at, expires_at) VALUES (?, ?, ?, ?)"
+                f" ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at,"
+                f" expires_at = excluded.expires_at WHERE {self.name}.expires_at <= ?",
+                (key, json.dumps(value), now, now + ttl, now),
+            )
+            return cursor.rowcount == 1
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM {self.name} WHERE key = ?", (key,))
+
+    def delete_prefix(self, prefix):
+        """Deletes every entry whose key starts with `prefix`."""
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM {self.name} WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+
+    def keys(self):
+        return [row[0] for row in self._connect().execute(f"SELECT key FROM {self.name}")]
+
+    def ages(self):
+        """Returns {key: seconds since it was written} for every entry."""
+        now = time.time()
+        return {key: now - updated_at for key, updated_at in
+                self._connect().execute(f"SELECT key, updated_at FROM {self.name}")}
+
+    def trim(self, max_entries):
+        """Deletes expired entries, then the oldest ones until at most `max_entries` remain."""
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM {self.name} WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+            conn.execute(
+                f"DELETE FROM {self.name} WHERE key IN ("
+                f" SELECT key FROM {self.name} ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (max_entries,),
+            )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM {self.name}")
+
+    def __len__(self):
+        return self._connect().execute(f"SELECT COUNT(*) FROM {self.name}").fetchone()[0]
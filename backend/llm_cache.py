@@ -0,0 +1,133 @@
+# llm_cache.py
+# Persistent cache for Gemini responses, shared by every worker and kept across restarts.
+#
+# Many prompts repeat exactly: general outfits for common occasions, the preference
+# notes check for unchanged notes, alternatives for the same base outfit. Responses
+# are stored in a KVStore keyed on the model, the prompt hash and the sampling
+# parameters, with a TTL per call site and a cap on the number of entries (the
+# oldest are evicted first).
+#
+# The REST helpers use cached_text()/acached_text(); the LangChain chat models get
+# response_cache(site) passed as `cache=`. Set LLM_CACHE_ENABLED=false to bypass it
+# everywhere, or pass bypass=True for a single call.
+
+import os
+import warnings
+
+import metrics
+from kvstore import KVStore
+from metrics import LLM_CACHE_LOOKUPS
+from singleflight import make_key
+
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 20000))
+# Evicting needs a count over the table, so it runs once every this many writes
+LLM_CACHE_TRIM_EVERY = int(os.environ.get("LLM_CACHE_TRIM_EVERY", 100))
+
+# Seconds a response is reused, per call site; override with e.g. LLM_CACHE_TTL_OUTFIT_GENERAL=600
+DEFAULT_TTLS = {
+    "outfit_general": 6 * 3600,
+    "outfit_closet": 3600,
+    "preference_notes": 24 * 3600,
+    "recommend_outfits": 6 * 3600,
+    "trend_agent": 3600,
+    "product_agent": 6 * 3600,
+}
+LLM_CACHE_DEFAULT_TTL = int(os.environ.get("LLM_CACHE_DEFAULT_TTL", 3600))
+
+# Cached LangChain generations are read back with langchain_core.load.loads, which is marked beta
+warnings.filterwarnings("ignore", message="The function `loads` is in beta")
+
+responses = KVStore("llm_responses")
+_writes = 0
+
+
+def ttl_for(site):
+    return int(os.environ.get(f"LLM_CACHE_TTL_{site.upper()}", DEFAULT_TTLS.get(site, LLM_CACHE_DEFAULT_TTL)))
+
+
+def response_key(model_name, prompt, temperature=None, **params):
+    return make_key(model_name, prompt, temperature=temperature, **params)
+
+
+def lookup(site, key, bypass=False):
+    """Returns the cached response for `key`, or None on a miss (or when bypassed)."""
+    if bypass or not LLM_CACHE_ENABLED:
+        LLM_CACHE_LOOKUPS.inc(site=site, result="bypass")
+        return None
+    value = responses.get(key)
+    LLM_CACHE_LOOKUPS.inc(site=site, result="miss" if value is None else "hit")
+    return value
+
+
+def store(site, key, value, bypass=False):
+    global _writes
+    if bypass or not LLM_CACHE_ENABLED:
+        return
+    responses.set(key, value, ttl=ttl_for(site))
+    _writes += 1
+    if _writes % LLM_CACHE_TRIM_EVERY == 0:
+        responses.trim(LLM_CACHE_MAX_ENTRIES)
+
+
+def cached_text(site, model_name, prompt, call, temperature=None, bypass=False):
+    """Returns the cached text for this model/prompt, or runs `call()` and caches what it
+    returns. A None result (no candidates, failed call) is not cached."""
+    key = response_key(model_name, prompt, temperature)
+    text = lookup(site, key, bypass)
+    if text is None:
+        text = call()
+        if text is not None:
+            store(site, key, text, bypass)
+    return text
+
+
+async def acached_text(site, model_name, prompt, call, temperature=None, bypass=False):
+    """Async cached_text(); `call` is a coroutine function."""
+    key = response_key(model_name, prompt, temperature)
+    text = lookup(site, key, bypass)
+    if text is None:
+        text = await call()
+        if text is not None:
+            store(site, key, text, bypass)
+    return text
+
+
+_cache_class = None
+
+
+def response_cache(site):
+    """LangChain cache backed by the same store, for ChatGoogleGenerativeAI(cache=...).
+
+    LangChain builds `llm_string` from the model's parameters (model, temperature, ...),
+    so the key covers the same things as the REST helpers. The class is defined on
+    first use so LangChain is only imported by processes that run an agent.
+    """
+    global _cache_class
+    if _cache_class is None:
+        from langchain_core.caches import BaseCache
+        from langchain_core.load import dumps, loads
+
+        class GeminiResponseCache(BaseCache):
+            def __init__(self, site):
+                self.site = site
+
+            def lookup(self, prompt, llm_string):
+                cached = lookup(self.site, make_key(llm_string, prompt))
+                return loads(cached) if cached is not None else None
+
+            def update(self, prompt, llm_string, return_val):
+                store(self.site, make_key(llm_string, prompt), dumps(return_val))
+
+            def clear(self, **kwargs):
+                responses.clear()
+
+        _cache_class = GeminiResponseCache
+    return _cache_class(site)
+
+
+def _collect_cache_metrics():
+    return [("stylist_llm_cache_entries", "gauge", "Cached LLM responses on disk.", [({}, len(responses))])]
+
+
+metrics.register_collector(_collect_cache_metrics)
@@ -1,16 +1,22 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, Response, render_template, request, redirect, url_for, session, jsonify
 from dotenv import load_dotenv
 
-# Firebase
-import firebase_admin
-from firebase_admin import credentials, auth, firestore
-
 # Import agents
-from agents.OutfitGenerator import generate_outfit_recommendation
-from agents.trendanalyzer import get_trend_agent, parse_trend_response
-from agents.product_search_agent import get_product_search_agent, parser as product_parser
-from agents.user_preference_agent import adjust_outfit_with_preferences
+from agents.OutfitGenerator import generate_outfit_recommendation, generate_alternatives, stream_outfit_recommendation
+from agents.product_search_agent import get_product_search_agent, get_parser as get_product_parser, search_outfit_garments
+from agents.user_preference_agent import adjust_outfit_with_preferences, forget_notes_verdicts
+from fanout import fan_out
+from pipeline import StagePipeline, StageTimeout
+from cache import all_caches
+from closet_index import select_closet_candidates
+import datastore
+import trend_snapshots
+from trend_snapshots import trend_query
+import metrics
+from metrics import timed, STAGE_SECONDS, STAGE_ERRORS
 
 # Load environment variables
 load_dotenv()
@@ -26,6 +32,17 @@ CLOSET_CATEGORIES = {
     'accessories': '💎'
 }
 DEFAULT_EMOJI = '✨'
+NON_FASHION_MESSAGE = "I'm sorry, that query does not seem related to fashion or clothing. Please try searching for an occasion or a style!"
+
+# Per-stage timeouts (seconds) for the /generate-outfit pipeline
+FIRESTORE_STAGE_TIMEOUT = float(os.environ.get("FIRESTORE_STAGE_TIMEOUT", 5))
+TREND_STAGE_TIMEOUT = float(os.environ.get("TREND_STAGE_TIMEOUT", 30))
+OUTFIT_STAGE_TIMEOUT = float(os.environ.get("OUTFIT_STAGE_TIMEOUT", 60))
+PRODUCT_SEARCH_STAGE_TIMEOUT = float(os.environ.get("PRODUCT_SEARCH_STAGE_TIMEOUT", 30))
+
+# /generate-outfit/batch: entries per request, and how many are generated at once
+BATCH_MAX_ENTRIES = int(os.environ.get("BATCH_MAX_ENTRIES", 14))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", 4))
 
 
 # ----------------- Firebase Initialization -----------------
@@ -43,22 +60,13 @@ DEFAULT_EMOJI = '✨'
 # db = firestore.client(app=app_firebase)
 
 import os, json
-from firebase_admin import credentials, auth, firestore
 
 firebase_json = os.environ.get("FIREBASE_SERVICE_ACCOUNT_JSON")
 
 if not firebase_json:
     raise ValueError("FIREBASE_SERVICE_ACCOUNT_JSON not set in environment")
 
-cred_dict = json.loads(firebase_json)
-cred = credentials.Certificate(cred_dict)
-
-try:
-    app_firebase = firebase_admin.initialize_app(cred)
-except ValueError:
-    app_firebase = firebase_admin.get_app()
-
-db = firestore.client(app=app_firebase)
+# The Firestore client itself is created on first use (see datastore.get_db).
 
 
 # ----------------- Flask Setup -----------------
@@ -66,13 +74,20 @@ template_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "fr
 app = Flask(__name__, template_folder=template_dir)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "supersecret")
 
+# Keeps popular trend analyses fresh in the background (TREND_REFRESHER_ENABLED=false to turn off)
+trend_snapshots.start_refresher()
+
 # ----------------- Utility Functions -----------------
+# Closet and profile reads go through datastore.py, which projects and batches them
+# and keeps the per-process caches.
 def get_user_closet_data(uid):
     """Retrieves all categorized items from the user's closet document."""
-    user_ref = db.collection("closets").document(uid)
-    doc = user_ref.get()
-    # Returns the full dict, where keys are categories and values are lists of items
-    return doc.to_dict() if doc.exists else {}
+    # Returns the full dict, where keys are categories and values are lists of items.
+    return datastore.get_closet(uid)
+
+def get_user_preferences(uid):
+    """Retrieves the saved preferences from the user's profile document."""
+    return datastore.get_preferences(uid)
 
 def get_all_closet_items_flat(uid):
     """Retrieves all items from all categories as a single, flat list for the Outfit Generator."""
@@ -83,6 +98,13 @@ def get_all_closet_items_flat(uid):
             all_items.extend(items_list)
     return all_items
 
+def get_outfit_context(uid, occasion, style, disliked_outfit=None):
+    """Retrieves the user's preferences and a bounded, balanced subset of the closet that fits
+    the occasion/style (so the outfit prompt stays small however many items the user owns).
+    Both documents are read in one round trip."""
+    closet_data, preferences = datastore.get_closet_and_preferences(uid)
+    return select_closet_candidates(closet_data, occasion, style, disliked_outfit=disliked_outfit), preferences
+
 # ----------------- ROUTES -----------------
 
 @app.route("/")
@@ -103,16 +125,14 @@ def login_page():
         if not id_token:
             return jsonify({"message": "No ID token provided."}), 400
         try:
+            from firebase_admin import auth
             decoded_token = auth.verify_id_token(id_token)
             uid = decoded_token.get("uid")
             if not uid:
                 return jsonify({"message": "Invalid ID token"}), 401
             session["uid"] = uid
-            user_ref = db.collection("closets").document(uid)
-            # Initialize with empty categories if it doesn't exist
-            if not user_ref.get().exists:
-                initial_closet = {cat: [] for cat in CLOSET_CATEGORIES}
-                user_ref.set(initial_closet)
+            # Initialize with empty categories if it doesn't exist (one write, no read)
+            datastore.create_closet(uid, CLOSET_CATEGORIES)
             return jsonify({"message": "Authentication successful!"}), 200
         except Exception as e:
             print("Login error:", e)
@@ -128,10 +148,8 @@ def closet_category_page(category):
         return redirect(url_for("home")) # Redirect to home if category is invalid
 
     uid = session["uid"]
-    closet_data = get_user_closet_data(uid)
-    
-    # Get the list of items for the specific category
-    category_items = closet_data.get(category, [])
+    # Get the list of items for the specific category (only that array is read)
+    category_items = datastore.get_closet_category(uid, category)
     
     return render_template(
         "closet_category.html", 
@@ -151,19 +169,14 @@ def add_item():
     if not item or not category or category not in CLOSET_CATEGORIES:
         return jsonify({"message": "Invalid item or category."}), 400
     
-    user_ref = db.collection("closets").document(uid)
-    doc = user_ref.get()
-    closet_data = doc.to_dict() if doc.exists else {}
-
-    # Get the list for the specific category or initialize it
-    items = closet_data.get(category, [])
-    if item not in items:
-        items.append(item)
-        user_ref.update({category: items})
-        return jsonify({"message": "Item added", "item": item}), 200
-    else:
+    # A cached copy that has the item answers without a read; otherwise only this
+    # category's array is read, so a cold or stale cache can't let a duplicate through
+    if datastore.find_item(uid, category, item):
         return jsonify({"message": "Item already in closet."}), 409
 
+    datastore.add_items(uid, {category: [item]})
+    return jsonify({"message": "Item added", "item": item}), 200
+
 
 @app.route("/delete-item", methods=["POST"])
 def delete_item():
@@ -176,20 +189,61 @@ def delete_item():
     if not item or not category or category not in CLOSET_CATEGORIES:
         return jsonify({"message": "Invalid item or category"}), 400
 
-    user_ref = db.collection("closets").document(uid)
-    doc = user_ref.get()
-    if not doc.exists:
+    # ArrayRemove doesn't say whether the item was there, so check first
+    found = datastore.find_item(uid, category, item)
+    if found is None:
         return jsonify({"message": "Closet not found"}), 404
-        
-    closet_data = doc.to_dict()
-    items = closet_data.get(category, [])
-    
-    try:
-        items.remove(item)
-        user_ref.update({category: items})
-        return jsonify({"message": "Item deleted", "item": item}), 200
-    except ValueError:
+    if not found:
         return jsonify({"message": "Item not found in this category"}), 404
+    if not datastore.remove_items(uid, {category: [item]}):
+        return jsonify({"message": "Closet not found"}), 404
+    return jsonify({"message": "Item deleted", "item": item}), 200
+
+
+def _parse_bulk_items(changes):
+    """Validates one side ("add" or "remove") of a bulk closet request into {category: [items]}."""
+    if not isinstance(changes, dict):
+        raise ValueError("Expected an object mapping categories to lists of items.")
+    parsed = {}
+    for category, items in changes.items():
+        if category not in CLOSET_CATEGORIES:
+            raise ValueError(f"Invalid category: {category}")
+        if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+            raise ValueError(f"Items for '{category}' must be a list of strings.")
+        cleaned = list(dict.fromkeys(item.strip() for item in items if item.strip()))
+        if cleaned:
+            parsed[category] = cleaned
+    return parsed
+
+
+@app.route("/closet/bulk", methods=["POST"])
+def bulk_update_closet():
+    """Adds and removes many items across categories in one batched, atomic write.
+
+    Body: {"add": {"tops": [...], ...}, "remove": {"shoes": [...], ...}}. Removals are
+    applied after additions, so an item listed in both ends up removed.
+    """
+    if "uid" not in session:
+        return jsonify({"message": "Unauthorized"}), 401
+    uid = session["uid"]
+    data = request.get_json(silent=True) or {}
+
+    try:
+        to_add = _parse_bulk_items(data.get("add", {}))
+        to_remove = _parse_bulk_items(data.get("remove", {}))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    if not to_add and not to_remove:
+        return jsonify({"message": "No items to add or remove."}), 400
+
+    datastore.update_closet(uid, to_add, to_remove)
+
+    return jsonify({
+        "message": "Closet updated",
+        "added": sum(len(items) for items in to_add.values()),
+        "removed": sum(len(items) for items in to_remove.values())
+    }), 200
 
 @app.route("/generate-outfit", methods=["POST"])
 def generate_outfit():
@@ -197,101 +251,371 @@ def generate_outfit():
         return jsonify({"message": "Unauthorized"}), 401
 
     uid = session["uid"]
-    # Now use the new function to get a flat list of all items
-    user_closet = get_all_closet_items_flat(uid)
-
-    # Get user preferences
-    user_doc = db.collection("users").document(uid).get()
-    preferences = user_doc.to_dict().get("preferences", {}) if user_doc.exists else {}
 
     # Read parameters from form
     occasion = request.form.get("occasion", "")
     style = request.form.get("style_preference", "")
     disliked_outfit = request.form.get("disliked_outfit", None)
     recommendation_type = request.form.get("recommendation_type", "closet")
-    
-    # Prioritize gender from saved preferences, then fallback to form, then default
-    gender = preferences.get("gender", request.form.get("gender", "person"))
+    form_gender = request.form.get("gender", "person")
+    # Set when the user asks again for the same occasion/style: skip the Gemini response cache
+    regenerate = request.form.get("regenerate", "").lower() in ("1", "true", "yes")
 
-    # Step 1: Analyze trends
+    # The closet, the preferences and the trend analysis don't depend on each other,
+    # so they run concurrently; generation and product search follow in order.
+    pipeline = StagePipeline("generate-outfit")
     try:
-        trend_response = analyze_trends_internal(f"{occasion} {style} fashion trends")
-        
-        # --- NEW LOGIC: Check if the trend analyzer indicated a non-fashion query ---
-        insights = trend_response.get("insights", "")
-        if "not about fashion" in insights.lower() or "cannot fulfill this request" in insights.lower():
-            # Return a clear message to the user and stop processing
-            return jsonify({
-                "recommendation_text": "I'm sorry, that query does not seem related to fashion or clothing. Please try searching for an occasion or a style!",
-                "reasons": [],
-                "trends_considered": [],
-                "shopping_links": [],
-                "sources": []
-            }), 400
-        # --- END NEW LOGIC ---
+        # The closet and the preferences come back from one batched Firestore read
+        context_future = pipeline.start("closet", get_outfit_context, uid, occasion, style, disliked_outfit)
+        trends_future = pipeline.start("trends", analyze_trends_internal, trend_query(occasion, style))
 
-        trends = trend_response.get("current_trends", [])[:3]
-    except Exception:
+        # Step 1: Analyze trends
+        trend_response = pipeline.result("trends", trends_future, TREND_STAGE_TIMEOUT, default=None)
         trends = []
+        if trend_response:
+            # --- NEW LOGIC: Check if the trend analyzer indicated a non-fashion query ---
+            insights = trend_response.get("insights", "")
+            if "not about fashion" in insights.lower() or "cannot fulfill this request" in insights.lower():
+                # Return a clear message to the user and stop processing
+                return jsonify({
+                    "recommendation_text": NON_FASHION_MESSAGE,
+                    "reasons": [],
+                    "trends_considered": [],
+                    "shopping_links": [],
+                    "sources": []
+                }), 400
+            # --- END NEW LOGIC ---
+            trends = trend_response.get("current_trends", [])[:3]
+
+        try:
+            # Only the closet items that fit the occasion/style go into the prompt
+            user_closet, preferences = pipeline.result("closet", context_future, FIRESTORE_STAGE_TIMEOUT)
+        except Exception:
+            return jsonify({"message": "We couldn't load your closet right now. Please try again."}), 503
 
-    # Step 2: Generate base outfit recommendation
-    recommendation_text = generate_outfit_recommendation(
-        user_closet, occasion, style, gender,
-        disliked_outfit, recommendation_type, trends
+        # Prioritize gender from saved preferences, then fallback to form, then default
+        gender = preferences.get("gender", form_gender)
+
+        # Step 2: Generate base outfit recommendation
+        try:
+            recommendation_text = pipeline.run(
+                "outfit", generate_outfit_recommendation,
+                user_closet, occasion, style, gender,
+                disliked_outfit, recommendation_type, trends, preferences,
+                regenerate=regenerate, timeout=OUTFIT_STAGE_TIMEOUT
+            )
+        except StageTimeout:
+            return jsonify({"message": "The Stylist is taking too long to respond. Please try again."}), 504
+
+        # --- MODIFIED LOGIC: Check for specific error messages from the agent ---
+        if "Your closet is empty" in recommendation_text and recommendation_type == "closet":
+            return jsonify({"message": recommendation_text}), 400
+
+        # If the recommendation starts with the fallback message, it's NOT an error,
+        # but a successful generation that needs a shopping link, so we continue.
+        # The string "I couldn't find a complete outfit" means a general recommendation was provided.
+
+        # Step 3: Adjust with user preferences
+        # The 'recommendation_text' already contains the preference adjustment if 'preferences' was passed,
+        # so we only separate the outfit description from the preference reasoning here.
+        core_outfit_description, reasons = split_recommendation_text(recommendation_text)
+
+        # Step 4: Product search agent
+        structured_response = pipeline.run(
+            "product_search", search_outfit_products, core_outfit_description,
+            timeout=PRODUCT_SEARCH_STAGE_TIMEOUT,
+            default={"outfit": core_outfit_description, "shopping_links": [], "sources": []}
+        )
+
+        # Return everything cleanly for frontend
+        return jsonify({
+            "recommendation_text": recommendation_text, # Full stylist text including warnings/preferences
+            "reasons": reasons,
+            "trends_considered": trends,
+            "shopping_links": structured_response.get("shopping_links", []),
+            "sources": structured_response.get("sources", [])
+        }), 200
+    finally:
+        pipeline.log_timings()
+
+
+def sse_event(event, data):
+    """Formats one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route("/generate-outfit/stream", methods=["POST"])
+def generate_outfit_stream():
+    """Streaming variant of /generate-outfit.
+
+    Sends server-sent events as each stage finishes: `trends`, `token` (outfit text as
+    Gemini writes it, with `reset` if it has to start over), `outfit`, `reasons`,
+    `shopping_links` and finally `done`. Failures are sent as an `error` event carrying
+    the message and the status code /generate-outfit would have returned.
+    """
+    if "uid" not in session:
+        return jsonify({"message": "Unauthorized"}), 401
+
+    uid = session["uid"]
+    occasion = request.form.get("occasion", "")
+    style = request.form.get("style_preference", "")
+    disliked_outfit = request.form.get("disliked_outfit", None)
+    recommendation_type = request.form.get("recommendation_type", "closet")
+    form_gender = request.form.get("gender", "person")
+    # Set when the user asks again for the same occasion/style: skip the Gemini response cache
+    regenerate = request.form.get("regenerate", "").lower() in ("1", "true", "yes")
+
+    def events():
+        pipeline = StagePipeline("generate-outfit-stream")
+        try:
+            context_future = pipeline.start("closet", get_outfit_context, uid, occasion, style, disliked_outfit)
+            trends_future = pipeline.start("trends", analyze_trends_internal, trend_query(occasion, style))
+
+            trend_response = pipeline.result("trends", trends_future, TREND_STAGE_TIMEOUT, default=None)
+            trends = []
+            if trend_response:
+                insights = trend_response.get("insights", "").lower()
+                if "not about fashion" in insights or "cannot fulfill this request" in insights:
+                    yield sse_event("error", {"message": NON_FASHION_MESSAGE, "status": 400})
+                    return
+                trends = trend_response.get("current_trends", [])[:3]
+            yield sse_event("trends", {"trends_considered": trends})
+
+            try:
+                user_closet, preferences = pipeline.result("closet", context_future, FIRESTORE_STAGE_TIMEOUT)
+            except Exception:
+                yield sse_event("error", {"message": "We couldn't load your closet right now. Please try again.", "status": 503})
+                return
+            gender = preferences.get("gender", form_gender)
+
+            recommendation_text = ""
+            started = time.perf_counter()
+            for kind, value in stream_outfit_recommendation(
+                user_closet, occasion, style, gender,
+                disliked_outfit, recommendation_type, trends, preferences, regenerate=regenerate
+            ):
+                if kind == "token":
+                    yield sse_event("token", {"text": value})
+                elif kind == "reset":
+                    yield sse_event("reset", {})
+                else:
+                    recommendation_text = value
+            pipeline.timings["outfit"] = time.perf_counter() - started
+
+            if "Your closet is empty" in recommendation_text and recommendation_type == "closet":
+                yield sse_event("error", {"message": recommendation_text, "status": 400})
+                return
+            yield sse_event("outfit", {"recommendation_text": recommendation_text})
+
+            core_outfit_description, reasons = split_recommendation_text(recommendation_text)
+            yield sse_event("reasons", {"reasons": reasons})
+
+            structured_response = pipeline.run(
+                "product_search", search_outfit_products, core_outfit_description,
+                timeout=PRODUCT_SEARCH_STAGE_TIMEOUT,
+                default={"outfit": core_outfit_description, "shopping_links": [], "sources": []}
+            )
+            yield sse_event("shopping_links", {
+                "shopping_links": structured_response.get("shopping_links", []),
+                "sources": structured_response.get("sources", [])
+            })
+            yield sse_event("done", {})
+        except Exception as e:
+            print("Streaming outfit generation error:", e)
+            yield sse_event("error", {"message": "Something went wrong while styling your outfit. Please try again.", "status": 500})
+        finally:
+            pipeline.log_timings()
+
+    # Disable proxy buffering so each event reaches the browser as soon as it is sent.
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def _parse_batch_entries(entries, default_type, default_regenerate=False):
+    """Validates the entries of a batch request into dicts with occasion, style,
+    recommendation_type, disliked_outfit and regenerate."""
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("Expected a non-empty list of entries.")
+    if len(entries) > BATCH_MAX_ENTRIES:
+        raise ValueError(f"At most {BATCH_MAX_ENTRIES} entries per batch.")
+    parsed = []
+    for entry in entries:
+        if not isinstance(entry, dict) or not str(entry.get("occasion", "")).strip():
+            raise ValueError("Every entry needs an 'occasion'.")
+        recommendation_type = entry.get("recommendation_type", default_type)
+        if recommendation_type not in ("closet", "general"):
+            raise ValueError(f"Invalid recommendation_type: {recommendation_type}")
+        parsed.append({
+            "label": entry.get("label"),
+            "occasion": str(entry["occasion"]).strip(),
+            "style": str(entry.get("style_preference", entry.get("style", ""))).strip(),
+            "recommendation_type": recommendation_type,
+            "disliked_outfit": entry.get("disliked_outfit"),
+            "regenerate": bool(entry.get("regenerate", default_regenerate)),
+        })
+    return parsed
+
+
+def generate_batch_entry(entry, closet_data, preferences, gender, trend_response, alternatives=False):
+    """Generates one outfit of a batch from data that was fetched once for the whole batch,
+    with the same stage timeouts as /generate-outfit. Returns the same fields
+    /generate-outfit does, plus `status` (and `message` on errors)."""
+    result = {"label": entry["label"], "occasion": entry["occasion"], "style_preference": entry["style"]}
+    trends = []
+    if trend_response:
+        insights = trend_response.get("insights", "").lower()
+        if "not about fashion" in insights or "cannot fulfill this request" in insights:
+            return {**result, "status": 400, "message": NON_FASHION_MESSAGE}
+        trends = trend_response.get("current_trends", [])[:3]
+
+    user_closet = select_closet_candidates(closet_data, entry["occasion"], entry["style"],
+                                           disliked_outfit=entry["disliked_outfit"])
+    pipeline = StagePipeline("generate-outfit-batch")
+    try:
+        recommendation_text = pipeline.run(
+            "outfit", generate_outfit_recommendation,
+            user_closet, entry["occasion"], entry["style"], gender,
+            entry["disliked_outfit"], entry["recommendation_type"], trends, preferences,
+            regenerate=entry["regenerate"], timeout=OUTFIT_STAGE_TIMEOUT
+        )
+    except StageTimeout:
+        return {**result, "status": 504, "message": "The Stylist is taking too long to respond. Please try again."}
+    if "Your closet is empty" in recommendation_text and entry["recommendation_type"] == "closet":
+        return {**result, "status": 400, "message": recommendation_text}
+
+    core_outfit_description, reasons = split_recommendation_text(recommendation_text)
+    structured_response = pipeline.run(
+        "product_search", search_outfit_products, core_outfit_description,
+        timeout=PRODUCT_SEARCH_STAGE_TIMEOUT,
+        default={"outfit": core_outfit_description, "shopping_links": [], "sources": []}
+    )
+    result.update({
+        "status": 200,
+        "recommendation_text": recommendation_text,
+        "reasons": reasons,
+        "trends_considered": trends,
+        "shopping_links": structured_response.get("shopping_links", []),
+        "sources": structured_response.get("sources", []),
+    })
+    if alternatives:
+        result["alternatives"] = generate_alternatives(
+            user_closet, entry["occasion"], entry["style"], core_outfit_description,
+            trends, (trend_response or {}).get("insights", "")
+        )
+    return result
+
+
+@app.route("/generate-outfit/batch", methods=["POST"])
+def generate_outfit_batch():
+    """Generates outfits for several occasions at once (e.g. a week of outfits).
+
+    Body: {"entries": [{"occasion", "style_preference", "recommendation_type"?, "disliked_outfit"?,
+    "label"?, "regenerate"?}, ...], "recommendation_type"?, "gender"?, "alternatives"?, "stream"?,
+    "regenerate"?}
+
+    The closet and preferences are read once and trends are analysed once per distinct
+    occasion/style; the outfits are then generated BATCH_MAX_CONCURRENCY at a time.
+    Returns {"results": [...]} in entry order, or with "stream": true one server-sent
+    `result` event per entry as soon as it is ready (each carries its `index`), then `done`.
+    """
+    if "uid" not in session:
+        return jsonify({"message": "Unauthorized"}), 401
+
+    uid = session["uid"]
+    data = request.get_json(silent=True) or {}
+    try:
+        entries = _parse_batch_entries(data.get("entries"), data.get("recommendation_type", "closet"),
+                                       bool(data.get("regenerate")))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    alternatives = bool(data.get("alternatives"))
+
+    pipeline = StagePipeline("generate-outfit-batch")
+    closet_future = pipeline.start("closet", datastore.get_closet_and_preferences, uid)
+    queries = list(dict.fromkeys(trend_query(e["occasion"], e["style"]) for e in entries))
+    trends_future = pipeline.start(
+        "trends", fan_out, {query: (lambda query=query: analyze_trends_internal(query)) for query in queries},
+        max_workers=BATCH_MAX_CONCURRENCY, timeout=TREND_STAGE_TIMEOUT
     )
-    
-    # --- MODIFIED LOGIC: Check for specific error messages from the agent ---
-    if "Your closet is empty" in recommendation_text and recommendation_type == "closet":
-        return jsonify({"message": recommendation_text}), 400
-    
-    # If the recommendation starts with the fallback message, it's NOT an error, 
-    # but a successful generation that needs a shopping link, so we continue.
-    # The string "I couldn't find a complete outfit" means a general recommendation was provided.
-    
-    # Step 3: Adjust with user preferences
-    # Preferences were already fetched
-    # The 'recommendation_text' already contains the preference adjustment if 'preferences' was passed.
-    
-    # The structure of recommendation_text now needs to be parsed if preferences were included
-    # to separate the outfit description from the preference reasoning.
-    
-    # For simplicity and to avoid overcomplicating parsing, we'll assume the final output 
-    # from the agent is the full text, and we'll extract the core outfit description 
-    # for the Product Search Agent.
 
-    # Extract the core outfit text for the Product Search Agent
+    try:
+        closet_data, preferences = pipeline.result("closet", closet_future, FIRESTORE_STAGE_TIMEOUT)
+    except Exception:
+        pipeline.log_timings()
+        return jsonify({"message": "We couldn't load your closet right now. Please try again."}), 503
+    gender = preferences.get("gender", data.get("gender", "person"))
+    trend_responses = pipeline.result("trends", trends_future, TREND_STAGE_TIMEOUT + 1, default={})
+
+    def run_entries():
+        """Yields (index, result) as each entry finishes."""
+        started = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=min(BATCH_MAX_CONCURRENCY, len(entries)), thread_name_prefix="batch")
+        try:
+            futures = {
+                executor.submit(generate_batch_entry, entry, closet_data, preferences, gender,
+                                trend_responses.get(trend_query(entry["occasion"], entry["style"])), alternatives): index
+                for index, entry in enumerate(entries)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Batch entry {index} failed: {e}")
+                    result = {"label": entries[index]["label"], "occasion": entries[index]["occasion"],
+                              "style_preference": entries[index]["style"], "status": 500,
+                              "message": "Something went wrong while styling this outfit. Please try again."}
+                yield index, result
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            pipeline.timings["outfits"] = time.perf_counter() - started
+            pipeline.log_timings()
+
+    if data.get("stream"):
+        def events():
+            for index, result in run_entries():
+                yield sse_event("result", {"index": index, **result})
+            yield sse_event("done", {})
+
+        return Response(events(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    results = [None] * len(entries)
+    for index, result in run_entries():
+        results[index] = result
+    return jsonify({"results": results}), 200
+
+
+def split_recommendation_text(recommendation_text):
+    """Separates the core outfit description (for the Product Search Agent) from the preference reasons."""
     # We look for the part before the preference-based reasoning, if it exists.
     core_outfit_description = recommendation_text.split("\n\n(This recommendation considers your saved preferences.)")[0].strip()
 
-    # We need to manually construct the structure that the frontend expects from the final text
-    # that already includes preference adjustments.
-    
     # Simple split to extract reasons
     reasons = []
     if "Preference-based reasoning" in recommendation_text:
         reason_part = recommendation_text.split("Preference-based reasoning:\n")[-1]
         reasons = [line.strip() for line in reason_part.split('\n') if line.strip()]
+    return core_outfit_description, reasons
+
+
+@timed(STAGE_SECONDS, STAGE_ERRORS, stage="product_search_agent")
+def search_outfit_products(core_outfit_description):
+    """Finds shopping links for each garment in the outfit (cached across users). Falls back to
+    the Product Search Agent when no garments can be picked out of the description."""
+    garment_result = search_outfit_garments(core_outfit_description)
+    if garment_result is not None:
+        return garment_result
 
-    # Step 4: Product search agent
     agent_executor = get_product_search_agent()
     # Use the core outfit description for a better search result
-    raw_response = agent_executor.invoke({"outfit_description": core_outfit_description}) 
+    raw_response = agent_executor.invoke({"outfit_description": core_outfit_description})
     output = raw_response.get("output", "")
 
-    structured_response = {}
     try:
-        structured_response = product_parser.parse(output).dict()
+        return get_product_parser().parse(output).dict()
     except Exception:
-        structured_response = {"outfit": core_outfit_description, "shopping_links": [], "sources": []}
-
-    # Return everything cleanly for frontend
-    return jsonify({
-        "recommendation_text": recommendation_text, # Full stylist text including warnings/preferences
-        "reasons": reasons,
-        "trends_considered": trends,
-        "shopping_links": structured_response.get("shopping_links", []),
-        "sources": structured_response.get("sources", [])
-    }), 200
+        return {"outfit": core_outfit_description, "shopping_links": [], "sources": []}
 
 
 @app.route("/analyze_trends", methods=["POST"])
@@ -306,9 +630,22 @@ def analyze_trends():
         return jsonify({"error": str(e)}), 500
 
 def analyze_trends_internal(query):
-    agent_executor = get_trend_agent()
-    raw_response = agent_executor.invoke({"query": query})
-    return parse_trend_response(raw_response).dict()
+    # Served from the background-refreshed snapshots; see trend_snapshots.py
+    return trend_snapshots.get_trends(query)
+
+@app.route("/cache-stats")
+def cache_stats():
+    if "uid" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify([cache.stats() for cache in all_caches()])
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus scrape endpoint. Set METRICS_TOKEN to require `Authorization: Bearer <token>`."""
+    token = os.environ.get("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route("/logout")
 def logout():
@@ -331,18 +668,14 @@ def user_profile():
     if "uid" not in session:
         return jsonify({"error": "Unauthorized"}), 401
     uid = session["uid"]
-    user_doc = db.collection("users").document(uid).get()
-    preferences = user_doc.to_dict().get("preferences", {}) if user_doc.exists else {}
-    return jsonify({"uid": uid, "preferences": preferences})
+    return jsonify({"uid": uid, "preferences": get_user_preferences(uid)})
 
 @app.route("/get_preferences", methods=["GET"])
 def get_preferences():
     if "uid" not in session:
         return jsonify({"error": "Unauthorized"}), 401
     uid = session["uid"]
-    user_doc = db.collection("users").document(uid).get()
-    preferences = user_doc.to_dict().get("preferences", {}) if user_doc.exists else {}
-    return jsonify(preferences), 200
+    return jsonify(get_user_preferences(uid)), 200
 
 @app.route("/save_preferences", methods=["POST"])
 def save_preferences():
@@ -352,7 +685,10 @@ def save_preferences():
     data = request.get_json()
     prefs = data.get("preferences", {})
     try:
-        db.collection("users").document(uid).set({"preferences": prefs}, merge=True)
+        previous_notes = get_user_preferences(uid).get("additional_notes", "") if "additional_notes" in prefs else None
+        datastore.save_preferences(uid, prefs)
+        if previous_notes is not None and previous_notes != prefs["additional_notes"]:
+            forget_notes_verdicts(previous_notes)
         return jsonify({"message": "Preferences saved successfully"}), 200
     except Exception as e:
         print("Error saving preferences:", e)
@@ -0,0 +1,228 @@
+# metrics.py
+# Lightweight Prometheus-style counters and histograms plus the text exposition
+# used by the /metrics endpoint.
+#
+# Recording a value is a lock, a dict lookup and a few additions, so the spans
+# around each stage are cheap enough to leave on in production.
+
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+_metrics = []
+_collectors = []
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing count, optionally split by labels."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        return self._values.get(key, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Counts observations (usually durations in seconds) into cumulative buckets."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes how long the `with` block took, even when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (bucket_counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labelnames, key, [("le", _format_value(float(bound)))])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+def timed(histogram, errors=None, **labels):
+    """Decorator recording the call duration in `histogram` and failures in the `errors` counter.
+    Works on plain functions and on coroutine functions."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception:
+                    if errors is not None:
+                        errors.inc(**labels)
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter() - started, **labels)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(**labels)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+        return wrapper
+    return decorator
+
+
+def register_collector(collector):
+    """Registers a function returning (name, type, help, [(labels dict, value), ...]) tuples,
+    for values that are tracked elsewhere (e.g. cache hit counters) and read at scrape time."""
+    _collectors.append(collector)
+
+
+def render():
+    """Returns every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        for name, metric_type, documentation, samples in collector():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------
+# Metrics shared across the backend
+# ---------------------------
+STAGE_SECONDS = Histogram(
+    "stylist_stage_seconds", "Time spent in each stage of outfit generation.", ["stage"]
+)
+STAGE_ERRORS = Counter(
+    "stylist_stage_errors_total", "Stages that raised an error.", ["stage"]
+)
+PIPELINE_STAGE_SECONDS = Histogram(
+    "stylist_pipeline_stage_seconds", "Duration of each request pipeline stage.", ["pipeline", "stage"]
+)
+PIPELINE_STAGE_FAILURES = Counter(
+    "stylist_pipeline_stage_failures_total", "Pipeline stages that failed or timed out.", ["pipeline", "stage", "reason"]
+)
+TOOL_SECONDS = Histogram(
+    "stylist_tool_seconds", "Duration of each search tool call.", ["tool"]
+)
+TOOL_ERRORS = Counter(
+    "stylist_tool_errors_total", "Search tool calls that raised an error.", ["tool"]
+)
+BLOG_PAGE_CACHE = Counter(
+    "stylist_blog_page_cache_total", "Blog page lookups by result (hit, revalidated, miss).", ["result"]
+)
+GARMENT_SEARCHES = Counter(
+    "stylist_garment_searches_total", "Per-garment product link lookups by result (hit, miss).", ["result"]
+)
+LLM_CACHE_LOOKUPS = Counter(
+    "stylist_llm_cache_lookups_total", "LLM response cache lookups by call site and result (hit, miss, bypass).",
+    ["site", "result"]
+)
+PREFERENCE_VERDICTS = Counter(
+    "stylist_preference_verdicts_total",
+    "Preference-notes checks by source (rules, cached, llm).", ["source"]
+)
+FIRESTORE_READS = Counter(
+    "stylist_firestore_reads_total",
+    "Firestore read round trips by kind (document, projected, batched).", ["kind"]
+)
+GEMINI_REQUEST_SECONDS = Histogram(
+    "stylist_gemini_request_seconds", "Duration of each Gemini REST request attempt (outcome ok, error or cancelled).", ["model", "outcome"]
+)
+GEMINI_RETRIES = Counter(
+    "stylist_gemini_retries_total", "Gemini REST calls that were retried.", ["model"]
+)
+GEMINI_ERRORS = Counter(
+    "stylist_gemini_errors_total", "Gemini REST attempts that failed.", ["model"]
+)
+GEMINI_CIRCUIT_REJECTIONS = Counter(
+    "stylist_gemini_circuit_rejections_total", "Gemini calls rejected while the circuit breaker was open.", ["model"]
+)
+TREND_SNAPSHOT_LOOKUPS = Counter(
+    "stylist_trend_snapshot_lookups_total", "Trend snapshot lookups by result (hit, stale, expired, miss).", ["result"]
+)
+TREND_SNAPSHOT_REFRESHES = Counter(
+    "stylist_trend_snapshot_refreshes_total", "Background trend snapshot refreshes by outcome.", ["outcome"]
+)
+FANOUT_SECONDS = Histogram(
+    "stylist_fanout_seconds", "Duration of each fan-out over independent sources.", ["mode"]
+)
+OUTFIT_SPECULATIONS = Counter(
+    "stylist_outfit_speculations_total",
+    "Speculative general-outfit calls by outcome (launched, used, wasted, cancelled).", ["outcome"]
+)
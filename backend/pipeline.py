@@ -0,0 +1,168 @@
+# pipeline.py
+# Runs the stages of a request on a shared thread pool so independent stages
+# (e.g. Firestore reads and trend analysis) overlap, gives every stage its own
+# timeout and logs how long each one took. AsyncStagePipeline does the same with
+# asyncio tasks for the async app.
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+import metrics
+from metrics import PIPELINE_STAGE_SECONDS, PIPELINE_STAGE_FAILURES
+
+PIPELINE_MAX_WORKERS = int(os.environ.get("PIPELINE_MAX_WORKERS", 32))
+# A stage that times out can't be interrupted and keeps its worker until it returns.
+# Once this many workers are held by abandoned stages, new stages are refused
+# (StageRejected) instead of queueing behind them.
+PIPELINE_MAX_ABANDONED = int(os.environ.get("PIPELINE_MAX_ABANDONED", PIPELINE_MAX_WORKERS // 2))
+
+_executor = ThreadPoolExecutor(max_workers=PIPELINE_MAX_WORKERS, thread_name_prefix="pipeline")
+_RAISE = object()
+_abandoned = set()
+_abandoned_lock = threading.Lock()
+
+
+class StageTimeout(Exception):
+    """Raised when a stage without a default does not finish within its timeout."""
+
+    def __init__(self, stage, timeout):
+        super().__init__(f"Stage '{stage}' did not finish within {timeout:.1f}s")
+        self.stage = stage
+        self.timeout = timeout
+
+
+class StageRejected(StageTimeout):
+    """Raised for a stage refused because timed-out stages still hold too many workers."""
+
+    def __init__(self, stage):
+        Exception.__init__(self, f"Stage '{stage}' was not started: the pipeline pool is saturated")
+        self.stage = stage
+        self.timeout = 0.0
+
+
+def _abandon(future):
+    """Tracks a timed-out stage that is still running until it finally returns."""
+    with _abandoned_lock:
+        _abandoned.add(future)
+    future.add_done_callback(_forget)
+
+
+def _forget(future):
+    with _abandoned_lock:
+        _abandoned.discard(future)
+
+
+def _collect_pipeline_metrics():
+    return [
+        ("stylist_pipeline_abandoned_stages", "gauge", "Timed-out stages still holding a pipeline worker.",
+         [({}, len(_abandoned))]),
+    ]
+
+
+metrics.register_collector(_collect_pipeline_metrics)
+
+
+class StagePipeline:
+    """Tracks the stages of a single request.
+
+    `start()` submits a stage to the pool and returns immediately; `result()` waits for
+    it, measuring the timeout from when the stage was started. A stage that fails or
+    times out returns `default` when one is given, otherwise the error is raised.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.timings = {}
+        self._started_at = {}
+        self._created_at = time.perf_counter()
+
+    def start(self, stage, fn, *args, **kwargs):
+        self._started_at[stage] = time.perf_counter()
+        if len(_abandoned) >= PIPELINE_MAX_ABANDONED:
+            rejected = Future()
+            rejected.set_exception(StageRejected(stage))
+            return rejected
+
+        def timed():
+            began = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.timings[stage] = time.perf_counter() - began
+                PIPELINE_STAGE_SECONDS.observe(self.timings[stage], pipeline=self.name, stage=stage)
+
+        return _executor.submit(timed)
+
+    def result(self, stage, future, timeout, default=_RAISE):
+        remaining = max(0.0, timeout - (time.perf_counter() - self._started_at[stage]))
+        try:
+            return future.result(timeout=remaining)
+        except FutureTimeout:
+            if not future.cancel():
+                _abandon(future)
+            PIPELINE_STAGE_FAILURES.inc(pipeline=self.name, stage=stage, reason="timeout")
+            print(f"[{self.name}] stage '{stage}' timed out after {timeout:.1f}s")
+            if default is _RAISE:
+                raise StageTimeout(stage, timeout)
+            return default
+        except Exception as e:
+            reason = "rejected" if isinstance(e, StageRejected) else "error"
+            PIPELINE_STAGE_FAILURES.inc(pipeline=self.name, stage=stage, reason=reason)
+            print(f"[{self.name}] stage '{stage}' failed: {e}")
+            if default is _RAISE:
+                raise
+            return default
+
+    def run(self, stage, fn, *args, timeout, default=_RAISE, **kwargs):
+        """Starts a stage and waits for it; for stages nothing else can overlap with."""
+        return self.result(stage, self.start(stage, fn, *args, **kwargs), timeout, default)
+
+    def log_timings(self):
+        total = time.perf_counter() - self._created_at
+        stages = " ".join(f"{stage}={seconds:.2f}s" for stage, seconds in list(self.timings.items()))
+        print(f"[{self.name}] {stages} total={total:.2f}s")
+
+
+class AsyncStagePipeline(StagePipeline):
+    """StagePipeline for coroutines: `start()` schedules a task on the running loop and
+    `result()`/`run()` are awaited. A stage that times out is cancelled."""
+
+    def start(self, stage, fn, *args, **kwargs):
+        self._started_at[stage] = time.perf_counter()
+
+        async def timed():
+            began = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                self.timings[stage] = time.perf_counter() - began
+                PIPELINE_STAGE_SECONDS.observe(self.timings[stage], pipeline=self.name, stage=stage)
+
+        return asyncio.ensure_future(timed())
+
+    async def result(self, stage, task, timeout, default=_RAISE):
+        remaining = max(0.0, timeout - (time.perf_counter() - self._started_at[stage]))
+        try:
+            return await asyncio.wait_for(task, timeout=remaining)
+        except asyncio.TimeoutError:
+            PIPELINE_STAGE_FAILURES.inc(pipeline=self.name, stage=stage, reason="timeout")
+            print(f"[{self.name}] stage '{stage}' timed out after {timeout:.1f}s")
+            if default is _RAISE:
+                raise StageTimeout(stage, timeout)
+            return default
+        except Exception as e:
+            PIPELINE_STAGE_FAILURES.inc(pipeline=self.name, stage=stage, reason="error")
+            print(f"[{self.name}] stage '{stage}' failed: {e}")
+            if default is _RAISE:
+                raise
+            return default
+
+    async def run(self, stage, fn, *args, timeout, default=_RAISE, **kwargs):
+        return await self.result(stage, self.start(stage, fn, *args, **kwargs), timeout, default)
+
+    def cancel_pending(self, *tasks):
+        """Cancels stages whose result is no longer needed (e.g. after an early return)."""
+        for task in tasks:
+            task.cancel()
@@ -1,8 +1,10 @@
 # recommendation_agent.py
 import os
-import requests
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Body
+import gemini_client
+import llm_cache
+from agents.OutfitGenerator import build_alternatives_prompt
 
 # Load API keys
 load_dotenv()
@@ -12,20 +14,13 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 app = FastAPI(title="Recommendation Agent")
 
 # --- Helper: Call Gemini API ---
-def call_gemini_api(prompt, model_name="gemma-3-4b-it"):
-    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent"
-
-    headers = {"Content-Type": "application/json"}
-    payload = {
-        "contents": [{"parts": [{"text": prompt}]}]
-    }
+def call_gemini_api(prompt, model_name="gemma-3-4b-it", bypass_cache=False):
+    def call():
+        data = gemini_client.generate_content_with_retries(prompt, model_name, api_key=GOOGLE_API_KEY)
+        return gemini_client.extract_text(data)
 
     try:
-        response = requests.post(api_url, headers=headers, params={"key": GOOGLE_API_KEY}, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        if data and "candidates" in data:
-            return data["candidates"][0]["content"]["parts"][0]["text"]
+        return llm_cache.cached_text("recommend_outfits", model_name, prompt, call, bypass=bypass_cache)
     except Exception as e:
         print("Gemini API error:", e)
     return None
@@ -44,30 +39,15 @@ def recommend_outfits(
     - Outfit Generator base outfit
     """
 
-    occasion = user_prefs.get("occasion", "")
-    style = user_prefs.get("style", "")
-    closet = ", ".join(user_prefs.get("closet", []))
-    trends = ", ".join(trend_info.get("current_trends", []))
-    insights = trend_info.get("insights", "")
-
-    # Prompt for Gemini
-    prompt = f"""
-    You are a fashion recommendation agent.
-    The user closet: {closet}
-    Occasion: {occasion}
-    Style preference: {style}
-    Trends to consider: {trends}
-    Trend insights: {insights}
-    Already suggested outfit: {base_outfit.get('recommendation')}
-
-    Task:
-    Suggest 3 *different* alternative outfits (use closet items where possible).
-    Each outfit should be short, clear, and stylish. 
-    Format:
-    - Outfit 1: ...
-    - Outfit 2: ...
-    - Outfit 3: ...
-    """
+    # Prompt for Gemini (shared with the batch endpoint's alternatives)
+    prompt = build_alternatives_prompt(
+        user_prefs.get("closet", []),
+        user_prefs.get("occasion", ""),
+        user_prefs.get("style", ""),
+        trend_info.get("current_trends", []),
+        trend_info.get("insights", ""),
+        base_outfit.get("recommendation"),
+    )
 
     rec_text = call_gemini_api(prompt)
 
@@ -0,0 +1,113 @@
+# singleflight.py
+# Collapses identical concurrent calls into one.
+#
+# When many users ask for the same thing at the same moment, only the first caller
+# (the "leader") runs the call; everyone else with the same key waits for it and
+# receives the same result (or the same exception).
+
+import asyncio
+import hashlib
+import json
+import threading
+import weakref
+import metrics
+
+_all_flights = weakref.WeakSet()
+
+
+def make_key(*parts, **params):
+    """Builds a stable key from e.g. the model name, the prompt and the call parameters."""
+    raw = json.dumps([parts, params], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time and shares its outcome with concurrent callers."""
+
+    def __init__(self, name="singleflight"):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.shared = 0
+        _all_flights.add(self)
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {"name": self.name, "executed": self.executed, "shared": self.shared, "in_flight": len(self._calls)}
+
+
+class AsyncSingleFlight:
+    """asyncio counterpart of SingleFlight: concurrent awaits of the same key share one coroutine run.
+
+    Must only be used from one event loop (the async app's).
+    """
+
+    def __init__(self, name="singleflight"):
+        self.name = name
+        self._calls = {}
+        self.executed = 0
+        self.shared = 0
+        _all_flights.add(self)
+
+    async def do(self, key, fn, *args, **kwargs):
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+            # shield() so one caller going away doesn't cancel the run for the others
+            return await asyncio.shield(future)
+
+        self.executed += 1
+        future = self._calls[key] = asyncio.ensure_future(fn(*args, **kwargs))
+        future.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(future)
+
+    def stats(self):
+        return {"name": self.name, "executed": self.executed, "shared": self.shared, "in_flight": len(self._calls)}
+
+
+def _collect_singleflight_metrics():
+    stats = sorted((flight.stats() for flight in _all_flights), key=lambda s: s["name"])
+    return [
+        ("stylist_singleflight_executed_total", "counter", "Calls that actually ran.",
+         [({"flight": s["name"]}, s["executed"]) for s in stats]),
+        ("stylist_singleflight_shared_total", "counter", "Callers that reused an identical in-flight call.",
+         [({"flight": s["name"]}, s["shared"]) for s in stats]),
+    ]
+
+
+metrics.register_collector(_collect_singleflight_metrics)
@@ -1,104 +1,356 @@
-from langchain.tools import Tool
+import os
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+import httpx
 import requests
-from bs4 import BeautifulSoup
-from duckduckgo_search import DDGS
+from fanout import fan_out, fan_out_async
+from kvstore import KVStore
+from keywords import fashion_matcher, product_matcher
+from metrics import timed, TOOL_SECONDS, TOOL_ERRORS, BLOG_PAGE_CACHE
+
+BLOG_FETCH_TIMEOUT = float(os.environ.get("BLOG_FETCH_TIMEOUT", 5))
+# Blog pages are used as-is for this long, then revalidated with ETag/Last-Modified
+BLOG_CACHE_TTL = int(os.environ.get("BLOG_CACHE_TTL", 1800))
+BLOG_MAX_ANCHORS = 10
+# duckduckgo_search has no async API, so the async tools run searches on this pool
+SEARCH_THREADS = int(os.environ.get("SEARCH_THREADS", 32))
+_search_pool = ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix="search")
+
+# duckduckgo_search (and LangChain, for the Tool objects) are imported on first use, to keep startup fast
+DDGS = None
+
+async def run_search(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_search_pool, fn, *args)
+
+def _ddgs():
+    global DDGS
+    if DDGS is None:
+        from duckduckgo_search import DDGS as ddgs_class
+        DDGS = ddgs_class
+    return DDGS()
 
 # ---------------------------
 # Trend Search Tools
 # ---------------------------
-FASHION_KEYWORDS = ["fashion", "style", "outfit", "ootd", "clothing", "look"]
-
 def filter_results(results):
-    return [
-        r["body"] + " -> " + r["href"]
-        for r in results
-        if any(word in r["body"].lower() for word in FASHION_KEYWORDS)
-    ]
+    return [r["body"] + " -> " + r["href"] for r in fashion_matcher.filter(results, key=lambda r: r["body"])]
 
+@timed(TOOL_SECONDS, TOOL_ERRORS, tool="instagram_fashion_search")
 def instagram_fashion_hashtags(query: str):
-    with DDGS() as ddgs:
+    with _ddgs() as ddgs:
         results = list(ddgs.text(f"Instagram #{query} fashion", max_results=10))
     return filter_results(results)
 
-instagram_tool = Tool(
-    name="instagram_fashion_search",
-    func=instagram_fashion_hashtags,
-    description="Search Instagram fashion hashtags."
-)
+async def instagram_fashion_hashtags_async(query: str):
+    return await run_search(instagram_fashion_hashtags, query)
 
+@timed(TOOL_SECONDS, TOOL_ERRORS, tool="tiktok_fashion_search")
 def tiktok_fashion_hashtags(query: str):
-    with DDGS() as ddgs:
+    with _ddgs() as ddgs:
         results = list(ddgs.text(f"TikTok #{query} fashion trend", max_results=10))
     return filter_results(results)
 
-tiktok_tool = Tool(
-    name="tiktok_fashion_search",
-    func=tiktok_fashion_hashtags,
-    description="Search TikTok fashion hashtags."
-)
+async def tiktok_fashion_hashtags_async(query: str):
+    return await run_search(tiktok_fashion_hashtags, query)
+
+FASHION_BLOG_URLS = [
+    "https://www.vogue.com/fashion",
+    "https://www.elle.com/fashion/",
+    "https://www.harpersbazaar.com/fashion/",
+    "https://www.un-fancy.com/",
+    "https://fashionjackson.com/"
+]
+
+# Created on first use, inside the async app's event loop
+async_http = None
+
+def get_async_http():
+    global async_http
+    if async_http is None:
+        async_http = httpx.AsyncClient(headers={"User-Agent": "Mozilla/5.0"}, timeout=BLOG_FETCH_TIMEOUT,
+                                       follow_redirects=True)
+    return async_http
+
+async def aclose():
+    """Closes the async HTTP client (on async app shutdown)."""
+    global async_http
+    if async_http is not None:
+        await async_http.aclose()
+        async_http = None
+
+class _AnchorExtractor(HTMLParser):
+    """Collects the text and href of the first `limit` <a href> elements and nothing else."""
+
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+        self.anchors = []  # [text pieces, href]
+        self.open = []     # index into anchors (None if not collected) per open <a>
+
+    @property
+    def done(self):
+        return len(self.anchors) >= self.limit and not self.open
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "a":
+            return
+        href = dict(attrs).get("href")
+        if href is not None and len(self.anchors) < self.limit:
+            self.anchors.append([[], href])
+            self.open.append(len(self.anchors) - 1)
+        else:
+            self.open.append(None)
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self.open:
+            self.open.pop()
+
+    def handle_data(self, data):
+        # Text counts towards every enclosing anchor, stripped like BeautifulSoup's get_text(strip=True)
+        for index in self.open:
+            if index is not None:
+                self.anchors[index][0].append(data.strip())
+
+
+def extract_anchors(html, limit=BLOG_MAX_ANCHORS, chunk_size=16384):
+    """Returns (text, href) for the first `limit` anchors with an href, parsing only as
+    much of the page as it takes to find them."""
+    extractor = _AnchorExtractor(limit)
+    for start in range(0, len(html), chunk_size):
+        extractor.feed(html[start:start + chunk_size])
+        if extractor.done:
+            break
+    else:
+        extractor.close()
+    return [("".join(pieces), href) for pieces, href in extractor.anchors]
+
+
+def parse_blog_articles(url, html):
+    articles = []
+    for text, href in extract_anchors(html):
+        if fashion_matcher.search(text):
+            if href.startswith("/"):
+                href = url.rstrip("/") + href
+            articles.append(f"{text} -> {href}")
+    return articles
+
 
+# Parsed articles per blog URL with the validators needed to revalidate them
+blog_page_cache = KVStore("blog_pages")
+
+def _cached_blog_page(url):
+    """Returns (fresh articles or None, cache entry or None)."""
+    entry = blog_page_cache.get_entry(url)
+    if entry is not None and entry["expires_at"] > time.time():
+        BLOG_PAGE_CACHE.inc(result="hit")
+        return entry["value"]["articles"], entry
+    return None, entry
+
+def _request_headers(entry):
+    headers = {"User-Agent": "Mozilla/5.0"}
+    if entry is not None:
+        if entry["value"].get("etag"):
+            headers["If-None-Match"] = entry["value"]["etag"]
+        if entry["value"].get("last_modified"):
+            headers["If-Modified-Since"] = entry["value"]["last_modified"]
+    return headers
+
+def _blog_articles_from_response(url, res, entry):
+    if res.status_code == 304 and entry is not None:
+        BLOG_PAGE_CACHE.inc(result="revalidated")
+        blog_page_cache.set(url, entry["value"], ttl=BLOG_CACHE_TTL)
+        return entry["value"]["articles"]
+    BLOG_PAGE_CACHE.inc(result="miss")
+    articles = parse_blog_articles(url, res.text)
+    if res.status_code == 200:
+        blog_page_cache.set(url, {
+            "etag": res.headers.get("ETag"),
+            "last_modified": res.headers.get("Last-Modified"),
+            "articles": articles,
+        }, ttl=BLOG_CACHE_TTL)
+    return articles
+
+@timed(TOOL_SECONDS, TOOL_ERRORS, tool="blog_fetch")
+def fetch_blog_articles(url):
+    articles, entry = _cached_blog_page(url)
+    if articles is not None:
+        return articles
+    try:
+        res = requests.get(url, headers=_request_headers(entry), timeout=BLOG_FETCH_TIMEOUT)
+        return _blog_articles_from_response(url, res, entry)
+    except Exception as e:
+        TOOL_ERRORS.inc(tool="blog_fetch")
+        return [f"Error fetching {url}: {str(e)}"]
+
+@timed(TOOL_SECONDS, TOOL_ERRORS, tool="blog_fetch")
+async def fetch_blog_articles_async(url):
+    articles, entry = _cached_blog_page(url)
+    if articles is not None:
+        return articles
+    try:
+        res = await get_async_http().get(url, headers=_request_headers(entry))
+        return _blog_articles_from_response(url, res, entry)
+    except Exception as e:
+        TOOL_ERRORS.inc(tool="blog_fetch")
+        return [f"Error fetching {url}: {str(e)}"]
+
+@timed(TOOL_SECONDS, TOOL_ERRORS, tool="fashion_blogs_search")
 def fashion_blogs_search(query: str):
-    urls = [
-        "https://www.vogue.com/fashion",
-        "https://www.elle.com/fashion/",
-        "https://www.harpersbazaar.com/fashion/",
-        "https://www.un-fancy.com/",
-        "https://fashionjackson.com/"
-    ]
+    # All blogs are fetched at once; a blog that misses the deadline is simply skipped.
+    results = fan_out(
+        {url: (lambda url=url: fetch_blog_articles(url)) for url in FASHION_BLOG_URLS},
+        timeout=BLOG_FETCH_TIMEOUT + 1
+    )
+    articles = []
+    for url in FASHION_BLOG_URLS:
+        articles.extend(results.get(url, []))
+    return articles
+
+@timed(TOOL_SECONDS, TOOL_ERRORS, tool="fashion_blogs_search")
+async def fashion_blogs_search_async(query: str):
+    results = await fan_out_async(
+        {url: (lambda url=url: fetch_blog_articles_async(url)) for url in FASHION_BLOG_URLS},
+        timeout=BLOG_FETCH_TIMEOUT + 1
+    )
     articles = []
-    for url in urls:
-        try:
-            res = requests.get(url, headers={"User-Agent": "Mozilla/5.0"})
-            soup = BeautifulSoup(res.text, "html.parser")
-            for link in soup.find_all("a", href=True)[:10]:
-                text = link.get_text(strip=True)
-                href = link["href"]
-                if text and any(word in text.lower() for word in FASHION_KEYWORDS):
-                    if href.startswith("/"):
-                        href = url.rstrip("/") + href
-                    articles.append(f"{text} -> {href}")
-        except Exception as e:
-            articles.append(f"Error fetching {url}: {str(e)}")
+    for url in FASHION_BLOG_URLS:
+        articles.extend(results.get(url, []))
     return articles
 
-blogs_tool = Tool(
-    name="fashion_blogs_search",
-    func=fashion_blogs_search,
-    description="Search fashion blogs for latest articles."
-)
+# ---------------------------
+# Combined Trend Search (concurrent fan-out)
+# ---------------------------
+TREND_SOURCES = {
+    "instagram": instagram_fashion_hashtags,
+    "tiktok": tiktok_fashion_hashtags,
+    "blogs": fashion_blogs_search,
+}
+TREND_SOURCES_ASYNC = {
+    "instagram": instagram_fashion_hashtags_async,
+    "tiktok": tiktok_fashion_hashtags_async,
+    "blogs": fashion_blogs_search_async,
+}
+TREND_SOURCE_TIMEOUT = float(os.environ.get("TREND_SOURCE_TIMEOUT", 12))
+
+@timed(TOOL_SECONDS, TOOL_ERRORS, tool="fashion_trend_search")
+def fashion_trend_search(query: str):
+    """Queries every trend source at the same time and returns whatever arrived before the deadline."""
+    results = fan_out(
+        {name: (lambda fn=fn: fn(query)) for name, fn in TREND_SOURCES.items()},
+        timeout=TREND_SOURCE_TIMEOUT
+    )
+    combined = []
+    for name in TREND_SOURCES:
+        combined.extend(results.get(name, []))
+    return combined
+
+@timed(TOOL_SECONDS, TOOL_ERRORS, tool="fashion_trend_search")
+async def fashion_trend_search_async(query: str):
+    results = await fan_out_async(
+        {name: (lambda fn=fn: fn(query)) for name, fn in TREND_SOURCES_ASYNC.items()},
+        timeout=TREND_SOURCE_TIMEOUT
+    )
+    combined = []
+    for name in TREND_SOURCES_ASYNC:
+        combined.extend(results.get(name, []))
+    return combined
 
 # ---------------------------
 # Shopping Site Search Tools
 # ---------------------------
 SHOPPING_SITES = ["https://www.amazon.com/","https://coolplanet.lk/"]
-PRODUCT_KEYWORDS = ["shirt", "top", "dress", "jeans", "trousers", "jacket", "coat", "skirt", "sweater"]
 
+def search_shopping_site(site, query):
+    with _ddgs() as ddgs:
+        results = list(ddgs.text(f"site:{site} {query}", max_results=5))
+    # filter for fashion keywords
+    return [
+        f"{r.get('body', '')} -> {r.get('href', '')}"
+        for r in product_matcher.filter(results, key=lambda r: r.get("body", ""))
+    ]
+
+@timed(TOOL_SECONDS, TOOL_ERRORS, tool="shopping_site_links")
+def search_site_links(site, query, max_results=5):
+    """Returns the result URLs on `site` for `query` (used by the per-garment product search)."""
+    with _ddgs() as ddgs:
+        results = list(ddgs.text(f"site:{site} {query}", max_results=max_results))
+    return [r["href"] for r in results if r.get("href")]
+
+@timed(TOOL_SECONDS, TOOL_ERRORS, tool="shopping_site_search")
 def shopping_site_search(query: str):
+    results = fan_out(
+        {site: (lambda site=site: search_shopping_site(site, query)) for site in SHOPPING_SITES},
+        timeout=TREND_SOURCE_TIMEOUT
+    )
     results_all = []
-    with DDGS() as ddgs:
-        for site in SHOPPING_SITES:
-            search_query = f"site:{site} {query}"
-            results = list(ddgs.text(search_query, max_results=5))
-            # filter for fashion keywords
-            for r in results:
-                text = r.get("body", "")
-                href = r.get("href", "")
-                if any(word in text.lower() for word in PRODUCT_KEYWORDS):
-                    results_all.append(f"{text} -> {href}")
+    for site in SHOPPING_SITES:
+        results_all.extend(results.get(site, []))
     return results_all
 
-shopping_tool = Tool(
-    name="shopping_site_search",
-    func=shopping_site_search,
-    description="Search multiple shopping websites for clothing products."
-)
+@timed(TOOL_SECONDS, TOOL_ERRORS, tool="shopping_site_search")
+async def shopping_site_search_async(query: str):
+    results = await fan_out_async(
+        {site: (lambda site=site: run_search(search_shopping_site, site, query)) for site in SHOPPING_SITES},
+        timeout=TREND_SOURCE_TIMEOUT
+    )
+    results_all = []
+    for site in SHOPPING_SITES:
+        results_all.extend(results.get(site, []))
+    return results_all
 
 # ---------------------------
-# Export all tools
+# Agent tools (built on first use)
 # ---------------------------
-tools = [
-    instagram_tool,
-    tiktok_tool,
-    blogs_tool,
-    shopping_tool
-]
\ No newline at end of file
+_agent_tools = {}
+
+def _build_agent_tools():
+    from langchain.tools import Tool
+    instagram_tool = Tool(
+        name="instagram_fashion_search",
+        func=instagram_fashion_hashtags,
+        coroutine=instagram_fashion_hashtags_async,
+        description="Search Instagram fashion hashtags."
+    )
+    tiktok_tool = Tool(
+        name="tiktok_fashion_search",
+        func=tiktok_fashion_hashtags,
+        coroutine=tiktok_fashion_hashtags_async,
+        description="Search TikTok fashion hashtags."
+    )
+    blogs_tool = Tool(
+        name="fashion_blogs_search",
+        func=fashion_blogs_search,
+        coroutine=fashion_blogs_search_async,
+        description="Search fashion blogs for latest articles."
+    )
+    trend_search_tool = Tool(
+        name="fashion_trend_search",
+        func=fashion_trend_search,
+        coroutine=fashion_trend_search_async,
+        description="Search Instagram, TikTok and fashion blogs for current fashion trends in one call."
+    )
+    shopping_tool = Tool(
+        name="shopping_site_search",
+        func=shopping_site_search,
+        coroutine=shopping_site_search_async,
+        description="Search multiple shopping websites for clothing products."
+    )
+    return {
+        "tools": [instagram_tool, tiktok_tool, blogs_tool, shopping_tool],
+        # The trend agent gets the combined search so one tool call covers every trend source.
+        "trend_tools": [trend_search_tool, shopping_tool],
+    }
+
+def get_tools():
+    """Tools for the product search agent."""
+    if not _agent_tools:
+        _agent_tools.update(_build_agent_tools())
+    return _agent_tools["tools"]
+
+def get_trend_tools():
+    """Tools for the trend agent."""
+    if not _agent_tools:
+        _agent_tools.update(_build_agent_tools())
+    return _agent_tools["trend_tools"]
@@ -0,0 +1,214 @@
+# trend_snapshots.py
+# Persistent trend snapshots, kept fresh by a background refresher so requests don't
+# have to wait for the trend agent.
+#
+# Trends change over hours, not seconds. The refresher re-runs the trend analysis
+# for a configurable set of popular occasion/style combinations, plus every
+# combination users asked for recently, shortly before its snapshot expires
+# (refresh-ahead). Requests are answered from the snapshot, or from a stale one for up
+# to TREND_STALE_GRACE past its TTL. A combination that has never been analysed, or
+# whose snapshot is older than that, runs the agent live, and its result becomes a
+# snapshot too.
+#
+# Every worker process runs a refresher, and they share the snapshot store. Before
+# refreshing a query a worker takes a lease on it in the same SQLite file, so each
+# due query is refreshed by one process rather than once per worker.
+
+import os
+import random
+import threading
+import time
+
+import metrics
+from kvstore import KVStore
+from metrics import TREND_SNAPSHOT_LOOKUPS, TREND_SNAPSHOT_REFRESHES
+from agents.trendanalyzer import analyze_trends, analyze_trends_async, normalize_query, refresh_trends
+
+TREND_SNAPSHOT_TTL = int(os.getenv("TREND_SNAPSHOT_TTL", 6 * 3600))
+# Seconds past the TTL a stale snapshot may still be served while a refresh is pending;
+# after that (e.g. with the refresher disabled) the analysis runs live again
+TREND_STALE_GRACE = int(os.getenv("TREND_STALE_GRACE", 3600))
+# Refresh once a snapshot has used up this share of its TTL
+TREND_REFRESH_AHEAD = float(os.getenv("TREND_REFRESH_AHEAD", 0.75))
+TREND_REFRESH_INTERVAL = float(os.getenv("TREND_REFRESH_INTERVAL", 60))
+# The first pass waits this long plus up to one interval of jitter, so workers starting
+# together don't all refresh at import time; each pass refreshes at most this many
+TREND_REFRESH_START_DELAY = float(os.getenv("TREND_REFRESH_START_DELAY", 30))
+TREND_REFRESH_MAX_PER_PASS = int(os.getenv("TREND_REFRESH_MAX_PER_PASS", 2))
+# Stored snapshots (configured combinations and free-text queries); the oldest are evicted
+TREND_MAX_SNAPSHOTS = int(os.getenv("TREND_MAX_SNAPSHOTS", 1000))
+TREND_TRIM_EVERY = int(os.getenv("TREND_TRIM_EVERY", 50))
+# Combinations requested within this window are kept fresh alongside the configured ones
+TREND_ACTIVE_WINDOW = int(os.getenv("TREND_ACTIVE_WINDOW", 24 * 3600))
+# Upper bound on those, so free-text queries can't grow the refresh load without limit
+TREND_MAX_TRACKED = int(os.getenv("TREND_MAX_TRACKED", 200))
+# How long a worker holds a query after starting its refresh; longer than a refresh takes
+TREND_REFRESH_LEASE_TTL = int(os.getenv("TREND_REFRESH_LEASE_TTL", 600))
+TREND_REFRESHER_ENABLED = os.getenv("TREND_REFRESHER_ENABLED", "true").lower() in ("1", "true", "yes")
+# "occasion:style" pairs, comma separated
+TREND_SNAPSHOT_COMBOS = os.getenv(
+    "TREND_SNAPSHOT_COMBOS",
+    "party:streetwear,office:minimalist,wedding guest:classic,date night:romantic,"
+    "brunch:casual,interview:classic,beach:boho,festival:boho"
+)
+
+snapshots = KVStore("trend_snapshots")
+refresh_leases = KVStore("trend_refresh_leases")
+
+_recent = {}  # normalized query -> (query, last requested at)
+_recent_lock = threading.Lock()
+_refresher = None
+_stop = threading.Event()
+_writes = 0
+
+
+def trend_query(occasion, style):
+    """The trend analysis query used for an occasion/style combination."""
+    return f"{occasion} {style} fashion trends"
+
+
+def configured_queries():
+    queries = []
+    for combo in TREND_SNAPSHOT_COMBOS.split(","):
+        occasion, _, style = combo.strip().partition(":")
+        if occasion and style:
+            queries.append(trend_query(occasion.strip(), style.strip()))
+    return queries
+
+
+def lookup(query):
+    """Returns the stored analysis for `query`, or None when there is none or it is
+    more than TREND_STALE_GRACE past its TTL."""
+    key = normalize_query(query)
+    with _recent_lock:
+        if key in _recent or len(_recent) < TREND_MAX_TRACKED:
+            _recent[key] = (query, time.time())
+    entry = snapshots.get_entry(key)
+    if entry is None:
+        TREND_SNAPSHOT_LOOKUPS.inc(result="miss")
+        return None
+    age = time.time() - entry["updated_at"]
+    if age > TREND_SNAPSHOT_TTL + TREND_STALE_GRACE:
+        TREND_SNAPSHOT_LOOKUPS.inc(result="expired")
+        return None
+    # A stale snapshot is still served; the refresher picks it up on its next pass.
+    TREND_SNAPSHOT_LOOKUPS.inc(result="stale" if age > TREND_SNAPSHOT_TTL else "hit")
+    return entry["value"]["result"]
+
+
+def store(query, result):
+    global _writes
+    # Rows expire once they can no longer be served, and the table is capped, so one-off
+    # free-text queries don't accumulate forever
+    snapshots.set(normalize_query(query), {"query": query, "result": result},
+                  ttl=TREND_SNAPSHOT_TTL + TREND_STALE_GRACE)
+    _writes += 1
+    if _writes % TREND_TRIM_EVERY == 0:
+        snapshots.trim(TREND_MAX_SNAPSHOTS)
+
+
+def get_trends(query):
+    """Serves the snapshot for `query`; runs the analysis live only if there is none."""
+    result = lookup(query)
+    if result is None:
+        result = analyze_trends(query)
+        store(query, result)
+    return result
+
+
+async def get_trends_async(query):
+    """Async get_trends()."""
+    result = lookup(query)
+    if result is None:
+        result = await analyze_trends_async(query)
+        store(query, result)
+    return result
+
+
+def due_for_refresh():
+    """Queries whose snapshot is missing or has used up TREND_REFRESH_AHEAD of its TTL."""
+    now = time.time()
+    with _recent_lock:
+        for key, (_, requested_at) in list(_recent.items()):
+            if now - requested_at > TREND_ACTIVE_WINDOW:
+                del _recent[key]
+        wanted = {normalize_query(q): q for q in configured_queries()}
+        wanted.update({key: query for key, (query, _) in _recent.items()})
+
+    ages = snapshots.ages()
+    threshold = TREND_SNAPSHOT_TTL * TREND_REFRESH_AHEAD
+    # Oldest (or missing) first
+    due = [(ages.get(key, float("inf")), query) for key, query in wanted.items()
+           if ages.get(key, float("inf")) >= threshold]
+    return [query for _, query in sorted(due, key=lambda d: d[0], reverse=True)]
+
+
+def take_lease(query):
+    """True if this process may refresh `query`: no other process holds its lease, and
+    the snapshot wasn't refreshed since the due list was built."""
+    key = normalize_query(query)
+    if not refresh_leases.add(key, os.getpid(), ttl=TREND_REFRESH_LEASE_TTL):
+        return False
+    entry = snapshots.get_entry(key)
+    if entry is not None and time.time() - entry["updated_at"] < TREND_SNAPSHOT_TTL * TREND_REFRESH_AHEAD:
+        return False
+    return True
+
+
+def refresh_due():
+    """Refreshes up to TREND_REFRESH_MAX_PER_PASS due snapshots, one at a time to keep the
+    load on Gemini and DDGS low; the rest wait for the next pass. Queries another process
+    is already refreshing are skipped. Returns how many were refreshed."""
+    refreshed = 0
+    for query in due_for_refresh():
+        if _stop.is_set() or refreshed >= TREND_REFRESH_MAX_PER_PASS:
+            break
+        if not take_lease(query):
+            TREND_SNAPSHOT_REFRESHES.inc(outcome="skipped")
+            continue
+        try:
+            store(query, refresh_trends(query))
+            TREND_SNAPSHOT_REFRESHES.inc(outcome="ok")
+            refreshed += 1
+        except Exception as e:
+            # Let another pass (in any process) retry it
+            refresh_leases.delete(normalize_query(query))
+            TREND_SNAPSHOT_REFRESHES.inc(outcome="error")
+            print(f"Trend snapshot refresh failed for '{query}': {e}")
+    return refreshed
+
+
+def _run():
+    _stop.wait(TREND_REFRESH_START_DELAY + random.uniform(0, TREND_REFRESH_INTERVAL))
+    while not _stop.is_set():
+        started = time.perf_counter()
+        refreshed = refresh_due()
+        if refreshed:
+            print(f"Refreshed {refreshed} trend snapshots in {time.perf_counter() - started:.2f}s")
+        _stop.wait(TREND_REFRESH_INTERVAL)
+
+
+def start_refresher():
+    """Starts the background refresher thread once per process (if enabled)."""
+    global _refresher
+    if not TREND_REFRESHER_ENABLED or (_refresher is not None and _refresher.is_alive()):
+        return
+    _stop.clear()
+    _refresher = threading.Thread(target=_run, name="trend-refresher", daemon=True)
+    _refresher.start()
+
+
+def stop_refresher():
+    _stop.set()
+
+
+def _collect_snapshot_metrics():
+    ages = snapshots.ages()
+    return [
+        ("stylist_trend_snapshots", "gauge", "Stored trend snapshots.", [({}, len(ages))]),
+        ("stylist_trend_snapshot_oldest_age_seconds", "gauge", "Age of the oldest trend snapshot.",
+         [({}, round(max(ages.values(), default=0.0), 1))]),
+    ]
+
+
+metrics.register_collector(_collect_snapshot_metrics)